@@ -0,0 +1,394 @@
+"""Offline end-to-end throughput of the bot, the dashboard tasks and the uploader.
+
+usage: python bench/e2e.py [scenario ...] [--jobs N] [--concurrency N] [--files N]
+                           [--size BYTES] [--latency SECONDS] [--rate-limit SHARE]
+
+Scenarios (default: all, each in its own process so peak RSS is its own):
+  bot        bot.py handle_text -> queue -> process_job with the stub
+             gallery-dl (or the warm pool against the fixture site, --gdl pool)
+             and python-telegram-bot talking to the fake Bot API
+  dashboard  download_media + send_to_telegram for each produced item, run
+             from a thread pool like the `-P threads` worker; needs Redis
+             (REDIS_URL) or fakeredis, uses SQLite unless DATABASE_URL is set
+  telethon   telethon_send.py --serve jobs through serve_stream with a fake
+             Telethon client (single files, or albums with --album)
+  scrape     scraper.scrape_media_links against the fixture media pages
+  fapopello  a full FapopelloExtractor crawl of the fixture gallery per job
+
+Nothing leaves the machine: Telegram, the sites and gallery-dl are the
+stand-ins from bench/fakes.py. Each scenario prints jobs/s, p50/p99 job
+latency and peak RSS of the process (and of its children).
+"""
+import argparse
+import asyncio
+import itertools
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeBotAPI, FixtureSite, write_stub_gallery_dl  # noqa: E402
+
+SCENARIOS = ("bot", "dashboard", "telethon", "scrape", "fapopello")
+TOKEN = "1234:bench"
+CHAT_ID = 4242
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p * len(values)) - 1)]
+
+
+def peak_rss_mb(who):
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def report(name, latencies, wall, extra=""):
+    if not latencies:
+        print(f"{name:<10} no job finished")
+        return
+    print(f"{name:<10} {len(latencies):5d} jobs  {len(latencies) / wall:8.2f} jobs/s  "
+          f"p50 {percentile(latencies, 0.5) * 1000:8.1f} ms  p99 {percentile(latencies, 0.99) * 1000:8.1f} ms  "
+          f"peak RSS {peak_rss_mb(resource.RUSAGE_SELF):6.1f} MB "
+          f"(children {peak_rss_mb(resource.RUSAGE_CHILDREN):6.1f} MB){extra}")
+
+
+def stub_env(args, tmp):
+    """PATH and knobs for the stub gallery-dl."""
+    bindir = os.path.join(tmp, "bin")
+    os.makedirs(bindir, exist_ok=True)
+    stub = write_stub_gallery_dl(bindir)
+    os.environ["PATH"] = bindir + os.pathsep + os.environ.get("PATH", "")
+    os.environ["BENCH_GDL_FILES"] = str(args.files)
+    os.environ["BENCH_GDL_SIZE"] = str(args.size)
+    os.environ["BENCH_GDL_DELAY"] = str(args.gdl_delay)
+    return stub
+
+
+def fake_api(args):
+    api = FakeBotAPI(latency=args.latency, rate_limit=args.rate_limit, retry_after=args.retry_after,
+                     bandwidth=args.bandwidth)
+    api.start()
+    return api
+
+
+def api_summary(api):
+    calls = ", ".join(f"{k} {v}" for k, v in sorted(api.calls.items()))
+    return f"\n{'':<10} fake Bot API: {calls}; {api.bytes / 1048576:.1f} MB received, {api.throttled} x 429"
+
+
+class _Message:
+    def __init__(self, text, chat_id):
+        self.text = text
+        self.chat_id = chat_id
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+async def run_bot(args, tmp):
+    stub_env(args, tmp)
+    site = FixtureSite(media_size=args.size)
+    site.start()
+    api = fake_api(args)
+    os.environ.update({
+        "BOT_TOKEN": TOKEN,
+        "DOWNLOAD_DIR": os.path.join(tmp, "downloads"),
+        "GDL_WORKERS": str(args.concurrency if args.gdl == "pool" else 0),
+        "MAX_CONCURRENT_JOBS": str(args.concurrency),
+        "MAX_JOBS_PER_USER": str(args.concurrency),
+        "MAX_QUEUED_JOBS": str(args.jobs),
+        "METRICS_PORT": "0",
+    })
+    import bot
+    from scheduler import JobScheduler
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+
+    tg = Bot(TOKEN, base_url=f"{api.url}/bot",
+             request=HTTPXRequest(connection_pool_size=max(8, args.concurrency * 4), read_timeout=60,
+                                  write_timeout=60))
+    await tg.initialize()
+    await bot.start_gdl_pool(None)
+
+    finished = {}
+
+    async def run(job):
+        await bot.process_job(tg, job)
+        finished[job.url] = time.monotonic()
+
+    bot.scheduler = JobScheduler(run, max_concurrent=bot.MAX_CONCURRENT_JOBS, per_user=bot.MAX_JOBS_PER_USER,
+                                 max_queued=bot.MAX_QUEUED_JOBS)
+    bot.scheduler.start()
+
+    started = {}
+    wall = time.monotonic()
+    for i in range(args.jobs):
+        if args.gdl == "pool":
+            url = f"{site.url}/media/bot{i}.jpg"
+        else:
+            url = f"https://example.com/bench/{os.getpid()}/{i}"
+        update = SimpleNamespace(message=_Message(url, CHAT_ID), effective_user=SimpleNamespace(id=1 + i % 4))
+        started[url] = time.monotonic()
+        await bot.handle_text(update, None)
+    while len(finished) < args.jobs:
+        await asyncio.sleep(0.01)
+    wall = time.monotonic() - wall
+
+    await bot.scheduler.stop()
+    await bot.stop_gdl_pool(None)
+    await tg.shutdown()
+    report("bot", [finished[u] - started[u] for u in started], wall, api_summary(api))
+    api.stop()
+    site.stop()
+
+
+def run_dashboard(args, tmp):
+    stub = stub_env(args, tmp)
+    api = fake_api(args)
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'dashboard.sqlite3')}")
+    os.environ.update({
+        "MEDIA_ROOT": os.path.join(tmp, "media"),
+        "GALLERY_DL_BINARY": stub,
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "TELEGRAM_CHAT_ID": str(CHAT_ID),
+        "TELEGRAM_API_URL": api.url,
+        "TELEGRAM_CHAT_RATE": str(args.chat_rate),
+        "TELEGRAM_CHAT_BURST": str(args.chat_rate),
+    })
+    sys.path.insert(0, os.path.join(ROOT, "dashboard-mvp"))
+    from app import ratelimit, tasks
+    from app.db import Base, SessionLocal, engine
+    from app.models import MediaItem
+
+    try:
+        ratelimit.get_redis().ping()
+    except Exception as e:
+        try:
+            import fakeredis
+        except ImportError:
+            print(f"dashboard  skipped: no Redis at REDIS_URL ({e.__class__.__name__}) and no fakeredis")
+            return
+        ratelimit._redis = fakeredis.FakeRedis(decode_responses=True)
+    Base.metadata.create_all(bind=engine)
+
+    def job(i):
+        t0 = time.monotonic()
+        db = SessionLocal()
+        try:
+            item = MediaItem(source_url=f"https://example.com/bench/{os.getpid()}/{i}", status="queued")
+            db.add(item)
+            db.commit()
+            # .run() skips Celery's request stack, which is not set up for plain threads
+            tasks.download_media.run(item.id)
+            ids = [row.id for row in db.query(MediaItem.id).filter(
+                MediaItem.source_url == item.source_url, MediaItem.status == "downloaded")]
+        finally:
+            db.close()
+        for media_item_id in ids:
+            tasks.send_to_telegram.run(media_item_id)
+        return time.monotonic() - t0
+
+    wall = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = list(pool.map(job, range(args.jobs)))
+    wall = time.monotonic() - wall
+    report("dashboard", latencies, wall, api_summary(api))
+    api.stop()
+
+
+class FakeTelethonClient:
+    """Just enough of TelegramClient for telethon_send's send paths."""
+
+    def __init__(self, latency, bandwidth):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._ids = itertools.count(1)
+
+    async def get_me(self):
+        return SimpleNamespace(id=1)
+
+    async def _read(self, path):
+        size = os.path.getsize(path)
+        # the bytes are read like a real upload would, then the wire time is simulated
+        await asyncio.to_thread(lambda: open(path, "rb").read())
+        if self.bandwidth:
+            await asyncio.sleep(size / self.bandwidth)
+
+    async def upload_file(self, file, **kwargs):
+        if isinstance(file, str):
+            await self._read(file)
+        return SimpleNamespace(name=os.path.basename(str(file)))
+
+    async def send_file(self, entity, file, caption=None, **kwargs):
+        if isinstance(file, list):
+            await asyncio.sleep(self.latency)
+            return [SimpleNamespace(id=next(self._ids), media=None) for _ in file]
+        if isinstance(file, str):
+            await self._read(file)
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(id=next(self._ids), media=None)
+
+
+async def run_telethon(args, tmp):
+    os.environ.update({
+        "API_ID": "1", "API_HASH": "bench", "STRING_SESSION": "bench",
+        "FILE_ID_CACHE": os.path.join(tmp, "file_ids.sqlite3"),
+        "TELETHON_CONCURRENCY": str(args.concurrency),
+    })
+    import json
+    import telethon_send
+
+    files_dir = os.path.join(tmp, "files")
+    os.makedirs(files_dir)
+    jobs = []
+    for i in range(args.jobs):
+        paths = []
+        for n in range(args.files if args.album else 1):
+            path = os.path.join(files_dir, f"{i}_{n}.mp4")
+            with open(path, "wb") as f:
+                f.write(f"{i}/{n}".encode().ljust(args.size, b"\0"))
+            paths.append(path)
+        job = {"id": i, "chat_id": CHAT_ID, "workers": 1}
+        if args.album:
+            job["files"] = paths
+        else:
+            job.update(file=paths[0], caption=f"bench {i}")
+        jobs.append(job)
+
+    client = FakeTelethonClient(args.latency, args.bandwidth)
+    reader = asyncio.StreamReader()
+    started, finished, failed = {}, {}, []
+
+    def write(line):
+        result = json.loads(line)
+        finished[result["id"]] = time.monotonic()
+        if not result.get("ok"):
+            failed.append(result.get("error"))
+
+    wall = time.monotonic()
+    for job in jobs:
+        started[job["id"]] = time.monotonic()
+        reader.feed_data((json.dumps(job) + "\n").encode())
+    reader.feed_eof()
+    await telethon_send.serve_stream(client, reader, write)
+    wall = time.monotonic() - wall
+    extra = f"\n{'':<10} {len(failed)} failed: {failed[0]}" if failed else ""
+    report("telethon", [finished[i] - started[i] for i in started], wall, extra)
+
+
+async def run_scrape(args, tmp):
+    import scraper
+
+    site = FixtureSite(media_size=args.size)
+    site.start()
+
+    async def job(i):
+        t0 = time.monotonic()
+        links = await scraper.scrape_media_links(f"{site.url}/page/{i}", max_bytes=args.size)
+        if not links:
+            raise RuntimeError("no links scraped")
+        return time.monotonic() - t0
+
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(i):
+        async with sem:
+            return await job(i)
+
+    wall = time.monotonic()
+    latencies = await asyncio.gather(*(bounded(i) for i in range(args.jobs)))
+    wall = time.monotonic() - wall
+    await scraper.close_client()
+    report("scrape", latencies, wall)
+    site.stop()
+
+
+def run_fapopello(args, tmp):
+    from gallery_dl import config
+    from extractors.fapopello import FapopelloExtractor, Message
+
+    site = FixtureSite(posts=args.posts, media_size=args.size)
+    site.start()
+    config.set(("extractor", "fapopello"), "index", "")
+    config.set(("extractor", "fapopello"), "workers", args.concurrency)
+
+    def crawl(i):
+        t0 = time.monotonic()
+        ex = FapopelloExtractor.from_url(f"https://fapopello.com/u/onlyfans/1/bench{i}")
+        ex.root = site.url
+        ex.url = site.gallery_url(f"bench{i}")
+        urls = sum(1 for msg in ex if msg[0] == Message.Url)
+        if urls != args.posts * site.media_per_post:
+            raise RuntimeError(f"crawl found {urls} media URLs")
+        return time.monotonic() - t0
+
+    wall = time.monotonic()
+    latencies = [crawl(i) for i in range(args.jobs)]
+    wall = time.monotonic() - wall
+    report("fapopello", latencies, wall, f"  ({args.posts} posts per crawl)")
+    site.stop()
+
+
+def run_scenario(name, args):
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as tmp:
+        if name == "bot":
+            asyncio.run(run_bot(args, tmp))
+        elif name == "dashboard":
+            run_dashboard(args, tmp)
+        elif name == "telethon":
+            asyncio.run(run_telethon(args, tmp))
+        elif name == "scrape":
+            asyncio.run(run_scrape(args, tmp))
+        elif name == "fapopello":
+            run_fapopello(args, tmp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("scenarios", nargs="*", default=["all"], help="|".join(SCENARIOS) + "|all")
+    parser.add_argument("--jobs", type=int, default=50, help="jobs per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--files", type=int, default=3, help="files per job")
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="bytes per file")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per Telegram request")
+    parser.add_argument("--bandwidth", type=float, default=0, help="upload bytes/s (0: unlimited)")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of Bot API requests answered 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--chat-rate", type=float, default=1000.0, help="dashboard per-chat sends/s")
+    parser.add_argument("--gdl", choices=("stub", "pool"), default="stub", help="bot.py download path")
+    parser.add_argument("--gdl-delay", type=float, default=0.0, help="stub gallery-dl seconds per file")
+    parser.add_argument("--album", action="store_true", help="telethon: send each job's files as an album")
+    parser.add_argument("--posts", type=int, default=40, help="fapopello: posts per gallery")
+    parser.add_argument("--in-process", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS + ("all",))
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+
+    names = SCENARIOS if "all" in args.scenarios else args.scenarios
+    if args.in_process or len(names) == 1:
+        for name in names:
+            run_scenario(name, args)
+        return 0
+    # one process per scenario: separate peak RSS, and no module state shared between them
+    argv = [a for a in sys.argv[1:] if a not in SCENARIOS + ("all",)]
+    status = 0
+    for name in names:
+        status |= subprocess.call([sys.executable, os.path.abspath(__file__), name, "--in-process", *argv])
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
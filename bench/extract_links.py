@@ -0,0 +1,77 @@
+"""Compare the old bare-URL regex with the ranked MediaLinkExtractor.
+
+usage: python bench/extract_links.py [saved_page.html ...]
+
+Without arguments a synthetic page is generated: og tags, <video>/<source>
+variants, a JSON-LD block, tracking pixels, thumbnails and a lot of
+unrelated markup. Reports time per page, number of raw URLs and number of
+ranked assets. No network access: HEAD validation is not exercised here.
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper import extract_media_links, iter_candidates  # noqa: E402
+
+CHUNK_SIZE = 16384
+
+
+def regex_path(raw):
+    # the pre-ranking implementation
+    text = raw.replace("\\/", "/")
+    links = re.findall(r'https?://[^\s"\'<>]+\.(?:mp4|webm|m3u8|jpg|jpeg|png|gif|webp)(?:\?[^\s"\'<>]*)?', text)
+    return list(dict.fromkeys(links))
+
+
+def streaming_path(raw):
+    chunks = (raw[i:i + CHUNK_SIZE] for i in range(0, len(raw), CHUNK_SIZE))
+    return list(iter_candidates(chunks, "https://example.com/page"))
+
+
+def synthetic_page(assets=200, filler_kb=2048):
+    parts = ['<html><head>',
+             '<meta property="og:video" content="https://cdn.example.com/v/main_1080p.mp4">',
+             '<meta property="og:image" content="https://cdn.example.com/v/main_thumb.jpg">',
+             '<script type="application/ld+json">{"@type":"VideoObject",'
+             '"contentUrl":"https:\\/\\/cdn.example.com\\/v\\/main.m3u8"}</script></head><body>']
+    for i in range(assets):
+        parts.append(
+            f'<video poster="https://cdn.example.com/p/{i}_poster.jpg">'
+            f'<source src="/v/{i}_480p.mp4"><source src="/v/{i}_720p.mp4"><source src="/v/{i}_1080p.webm"></video>'
+            f'<img src="https://track.example.com/pixel.gif?id={i}">'
+            f'<a href="https://cdn.example.com/i/{i}-1280x720.jpg">full</a>'
+            f'<img src="https://cdn.example.com/i/{i}-150x150.jpg">')
+    filler = '<div class="c"><span>lorem ipsum dolor sit amet</span></div>\n'
+    parts.append(filler * (filler_kb * 1024 // len(filler)))
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def measure(func, raw, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = func(raw)
+    return result, (time.perf_counter() - started) / rounds
+
+
+def main():
+    pages = [(p, open(p, encoding="utf-8", errors="replace").read()) for p in sys.argv[1:]]
+    pages = pages or [("synthetic", synthetic_page())]
+    for name, raw in pages:
+        print(f"{name}: {len(raw) / 1048576:.1f} MB")
+        links, elapsed = measure(regex_path, raw, rounds=5)
+        print(f"  {'regex':<10} {elapsed * 1000:9.2f} ms  {len(links)} urls")
+        candidates, elapsed = measure(streaming_path, raw, rounds=5)
+        print(f"  {'scan':<10} {elapsed * 1000:9.2f} ms  {len(candidates)} candidates")
+        ranked, elapsed = measure(lambda r: extract_media_links(r, "https://example.com/page"), raw, rounds=5)
+        print(f"  {'ranked':<10} {elapsed * 1000:9.2f} ms  {len(ranked)} assets")
+        for link in ranked[:5]:
+            print(f"    {link}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,309 @@
+"""Local stand-ins for the services the pipelines talk to, used by bench/e2e.py.
+
+- FakeBotAPI: Bot API server for sendDocument, sendVideo, sendMediaGroup,
+  sendMessage and getMe, with a fixed latency, an optional upload bandwidth
+  and a share of requests answered with 429 retry_after.
+- FixtureSite: fapopello-style gallery and post pages, a media page for
+  scrape_media_links (og:video, size variants, thumbnails) and media files
+  of a configurable size that answer HEAD with their Content-Length.
+- write_stub_gallery_dl: an executable `gallery-dl` that accepts the
+  options bot.py and the dashboard pass and writes files of a configurable
+  size, with metadata sidecars, into the -D directory.
+"""
+import itertools
+import json
+import os
+import random
+import re
+import stat
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients hang up early on purpose, e.g. the post parser once it has the post body
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Server:
+    handler = None
+
+    def start(self):
+        owner = self
+
+        class Handler(self.handler):
+            server_owner = owner
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _read_body(handler):
+    length = handler.headers.get("Content-Length")
+    if length is not None:
+        return handler.rfile.read(int(length))
+    if handler.headers.get("Transfer-Encoding", "").lower() != "chunked":
+        return b""
+    body = bytearray()
+    while True:
+        size = int(handler.rfile.readline().split(b";")[0], 16)
+        if not size:
+            handler.rfile.readline()
+            return bytes(body)
+        body += handler.rfile.read(size)
+        handler.rfile.readline()
+
+
+def _field(body, content_type, name):
+    """A form field from a urlencoded, multipart or JSON request body."""
+    if content_type.startswith("application/json"):
+        value = json.loads(body or b"{}").get(name)
+        return value if value is None or isinstance(value, str) else json.dumps(value)
+    if content_type.startswith("multipart/"):
+        m = re.search(rb'name="' + name.encode() + rb'"(?:; filename="[^"]*")?\r\n(?:[^\r\n]+\r\n)*\r\n',
+                      body)
+        if not m:
+            return None
+        end = body.find(b"\r\n--", m.end())
+        if b"filename=" in m.group(0):
+            return None  # an uploaded file, not a value
+        return body[m.end():end].decode("utf-8", "replace")
+    values = parse_qs(body.decode("utf-8", "replace")).get(name)
+    return values[0] if values else None
+
+
+class _BotAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        api = self.server_owner
+        body = _read_body(self)
+        method = urlsplit(self.path).path.rsplit("/", 1)[-1]
+        content_type = self.headers.get("Content-Type", "")
+        if api.throttle():
+            self._reply({"ok": False, "error_code": 429,
+                         "description": f"Too Many Requests: retry after {api.retry_after}",
+                         "parameters": {"retry_after": api.retry_after}}, 429)
+            return
+        delay = api.latency + (len(body) / api.bandwidth if api.bandwidth else 0)
+        if delay:
+            time.sleep(delay)
+        api.record(method, len(body))
+        result = api.result(method, lambda name: _field(body, content_type, name))
+        if result is None:
+            self._reply({"ok": False, "error_code": 404, "description": "Not Found: method not found"}, 404)
+        else:
+            self._reply({"ok": True, "result": result})
+
+
+class FakeBotAPI(_Server):
+    handler = _BotAPIHandler
+
+    def __init__(self, latency=0.05, rate_limit=0.0, retry_after=1, bandwidth=0, seed=0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.bandwidth = bandwidth
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.bytes = 0
+        self.throttled = 0
+
+    def throttle(self):
+        with self._lock:
+            if self.rate_limit and self._random.random() < self.rate_limit:
+                self.throttled += 1
+                return True
+        return False
+
+    def record(self, method, size):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.bytes += size
+
+    def _message(self, chat_id, **extra):
+        n = next(self._ids)
+        chat = int(chat_id) if chat_id and chat_id.lstrip("-").isdigit() else 0
+        return {"message_id": n, "date": int(time.time()),
+                "chat": {"id": chat, "type": "private" if chat > 0 else "supergroup"}, **extra}
+
+    def _file(self, value, **extra):
+        # a re-sent file_id comes back as it is, uploads get a new one
+        n = next(self._ids)
+        if value and not value.startswith("attach://"):
+            return {"file_id": value, "file_unique_id": value[-16:], **extra}
+        return {"file_id": f"BENCH{n:010d}", "file_unique_id": f"U{n}", **extra}
+
+    def result(self, method, field):
+        chat_id = field("chat_id")
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method == "sendMessage":
+            return self._message(chat_id, text=field("text") or "")
+        if method == "sendDocument":
+            return self._message(chat_id, document=self._file(field("document")))
+        if method == "sendVideo":
+            return self._message(chat_id, video=self._file(field("video"), width=1280, height=720, duration=1))
+        if method == "sendMediaGroup":
+            media = json.loads(field("media") or "[]")
+            return [self._message(chat_id, document=self._file(m.get("media"))) for m in media]
+        return None
+
+
+class _SiteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, body, content_type, head=False, length=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _route(self, head):
+        site = self.server_owner
+        parts = urlsplit(self.path)
+        path = parts.path
+        if path.startswith("/media/"):
+            m = re.search(r"_(\d{3,4})p\.", path)
+            size = site.media_size * int(m.group(1)) // 1080 if m else site.media_size
+            if head:
+                self._send(b"", site.media_type(path), head=True, length=size)
+            else:
+                self._send(site.media_body(path, size), site.media_type(path))
+            return
+        if path.startswith("/u/"):
+            page = int(parse_qs(parts.query).get("page", ["1"])[0])
+            self._send(site.gallery_page(path, page).encode(), "text/html; charset=utf-8", head)
+            return
+        m = re.match(r"/p/(\d+)/", path)
+        if m:
+            self._send(site.post_page(int(m.group(1))).encode(), "text/html; charset=utf-8", head)
+            return
+        m = re.match(r"/page/(\d+)", path)
+        if m:
+            self._send(site.media_page(int(m.group(1))).encode(), "text/html; charset=utf-8", head)
+            return
+        self.send_error(404)
+
+    def do_GET(self):
+        self._route(False)
+
+    def do_HEAD(self):
+        self._route(True)
+
+
+class FixtureSite(_Server):
+    handler = _SiteHandler
+
+    def __init__(self, posts=40, posts_per_page=20, media_per_post=4, media_size=256 * 1024, filler_kb=64):
+        self.posts = posts
+        self.posts_per_page = posts_per_page
+        self.media_per_post = media_per_post
+        self.media_size = media_size
+        self.filler = "<p>comment</p>" * (filler_kb * 1024 // 14)
+
+    def gallery_url(self, user="bench"):
+        return f"{self.url}/u/onlyfans/1/{user}"
+
+    def gallery_page(self, path, page):
+        first = (page - 1) * self.posts_per_page
+        ids = range(self.posts - first, max(0, self.posts - first - self.posts_per_page), -1)
+        links = "".join(f'<a href="/p/{i}/post-{i}">post {i}</a>' for i in ids)
+        more = first + self.posts_per_page < self.posts
+        nxt = f'<a class="next" href="{path}?page={page + 1}">next</a>' if more else ""
+        return f"<html><body>{links}{nxt}{self.filler}</body></html>"
+
+    def post_page(self, post_id):
+        media = "".join(
+            f'<img src="/media/{post_id}_{i}.{"mp4" if i % 2 else "jpg"}">' for i in range(self.media_per_post))
+        return f'<html><body><div class="post-body">{media}</div>{self.filler}</body></html>'
+
+    def media_page(self, n):
+        variants = "".join(f'<source src="/media/v{n}_{h}p.mp4">' for h in (480, 720, 1080))
+        return (f'<html><head><meta property="og:video" content="/media/v{n}_720p.mp4">'
+                f'<meta property="og:image" content="/media/v{n}_thumb.jpg"></head>'
+                f'<body><video>{variants}</video><img src="/media/pixel.gif?beacon=1">'
+                f'{self.filler}</body></html>')
+
+    @staticmethod
+    def media_type(path):
+        return "video/mp4" if path.endswith(".mp4") else "image/jpeg"
+
+    @staticmethod
+    def media_body(path, size):
+        head = path.encode()
+        return head + b"\0" * max(0, size - len(head))
+
+
+STUB_GALLERY_DL = '''#!{python}
+"""gallery-dl stand-in: writes BENCH_GDL_FILES files of BENCH_GDL_SIZE bytes
+into the -D directory, one BENCH_GDL_DELAY seconds apart, with .json sidecars."""
+import hashlib, json, os, sys, time
+
+args = sys.argv[1:]
+directory = args[args.index("-D") + 1] if "-D" in args else "."
+url = args[-1]
+files = int(os.environ.get("BENCH_GDL_FILES", "3"))
+size = int(os.environ.get("BENCH_GDL_SIZE", str(1024 * 1024)))
+delay = float(os.environ.get("BENCH_GDL_DELAY", "0"))
+post_id = int(hashlib.sha1(url.encode()).hexdigest()[:12], 16)
+os.makedirs(directory, exist_ok=True)
+for num in range(1, files + 1):
+    time.sleep(delay)
+    path = os.path.join(directory, f"bench_{{post_id}}_{{num}}.mp4")
+    # distinct content per file, so caches keyed by content see new files
+    head = f"{{url}}#{{num}}".encode()
+    with open(path + ".part", "wb") as f:
+        f.write(head)
+        f.write(bytes(max(0, size - len(head))))
+    os.replace(path + ".part", path)
+    if "--write-metadata" in args:
+        with open(path + ".json", "w") as f:
+            json.dump({{"category": "bench", "subcategory": "stub", "id": post_id, "num": num}}, f)
+    print(path, flush=True)
+'''
+
+
+def write_stub_gallery_dl(directory):
+    """Write an executable `gallery-dl` into directory; returns its path."""
+    path = os.path.join(directory, "gallery-dl")
+    with open(path, "w") as f:
+        f.write(STUB_GALLERY_DL.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
@@ -0,0 +1,79 @@
+"""Compare the old whole-page regex post parser with iter_post_media.
+
+usage: python bench/fapopello_parse.py [saved_post.html ...]
+
+Without arguments a synthetic post page is generated: a post body with a few
+hundred media tags followed by several MB of comments, which the streaming
+parser never has to read. Reports time per page and peak traced memory.
+"""
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractors.fapopello import iter_post_media  # noqa: E402
+
+CHUNK_SIZE = 16384
+
+
+def regex_path(raw):
+    # the pre-streaming implementation: decode everything, then scan it twice
+    post_data = raw.decode("utf-8", "replace")
+    body_match = re.search(r'<div class="post-body">(.*?)</div>', post_data, re.DOTALL)
+    if not body_match:
+        return []
+    media_urls = re.findall(r'src="([^"]+\.(?:jpg|jpeg|png|mp4|webm|webp))"', body_match.group(1))
+    unique_media = []
+    for m in media_urls:
+        if m not in unique_media:
+            unique_media.append(m)
+    return unique_media
+
+
+def streaming_path(raw):
+    def chunks():
+        for i in range(0, len(raw), CHUNK_SIZE):
+            yield raw[i:i + CHUNK_SIZE].decode("utf-8", "replace")
+    return list(iter_post_media(chunks()))
+
+
+def synthetic_page(media=400, comments_mb=8):
+    body = "".join(
+        '<p><img src="/media/{0}/{1}.jpg"><video src="/media/{0}/{1}.mp4"></video></p>'.format(i % 50, i)
+        for i in range(media))
+    comment = '<div class="comment"><img src="/avatars/x.png"> nice post</div>\n'
+    tail = comment * (comments_mb * 1048576 // len(comment))
+    return ('<html><body><div class="post-body">' + body + "</div>" + tail + "</body></html>").encode()
+
+
+def measure(func, raw, rounds):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = func(raw)
+    elapsed = (time.perf_counter() - started) / rounds
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    pages = [(p, open(p, "rb").read()) for p in sys.argv[1:]] or [("synthetic", synthetic_page())]
+    for name, raw in pages:
+        print(f"{name}: {len(raw) / 1048576:.1f} MB")
+        expected = None
+        for label, func in (("regex", regex_path), ("streaming", streaming_path)):
+            result, elapsed, peak = measure(func, raw, rounds=5)
+            if expected is None:
+                expected = result
+            elif result != expected:
+                print("  !! results differ between parsers")
+            print(f"  {label:<10} {elapsed * 1000:9.2f} ms  peak {peak / 1048576:7.2f} MB  {len(result)} urls")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
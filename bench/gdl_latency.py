@@ -0,0 +1,87 @@
+"""Startup-to-first-byte latency: `gallery-dl` subprocess vs the warm GalleryDLPool.
+
+usage: python bench/gdl_latency.py [rounds]
+
+A local HTTP server serves a small image that gallery-dl's directlink
+extractor picks up; the latency of a job is the time from submitting it to
+the server seeing its first request.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gdl_pool import GalleryDLPool  # noqa: E402
+
+first_hit = {}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        first_hit.setdefault(self.path, time.monotonic())
+        body = b"\xff\xd8\xff" + b"\0" * 1024
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def options(job_dir):
+    return [((), "base-directory", str(job_dir)), ((), "directory", ())]
+
+
+async def via_subprocess(url, job_dir):
+    proc = await asyncio.create_subprocess_exec(
+        "gallery-dl", "-D", str(job_dir), url,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    await proc.wait()
+
+
+async def bench(label, run, base, rounds, tmp):
+    latencies = []
+    for i in range(rounds):
+        path = f"/{label}-{i}.jpg"
+        job_dir = Path(tmp) / f"{label}-{i}"
+        started = time.monotonic()
+        await run(base + path, job_dir)
+        if path in first_hit:
+            latencies.append(first_hit[path] - started)
+    if not latencies:
+        print(f"{label:<12} no requests reached the server")
+        return
+    latencies.sort()
+    p90 = latencies[int(len(latencies) * 0.9) - 1] if len(latencies) >= 10 else latencies[-1]
+    print(f"{label:<12} p50 {statistics.median(latencies) * 1000:8.1f} ms   p90 {p90 * 1000:8.1f} ms   (n={len(latencies)})")
+
+
+async def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    pool = GalleryDLPool(1)
+    await pool.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            await bench("subprocess", via_subprocess, base, rounds, tmp)
+            await bench("pool", lambda url, d: pool.run(url, options(d), timeout=60), base, rounds, tmp)
+    finally:
+        await pool.close()
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
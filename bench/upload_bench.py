@@ -0,0 +1,46 @@
+"""Compare MTProto upload throughput: single-stream upload_file vs upload_parallel.
+
+usage: API_ID=.. API_HASH=.. STRING_SESSION=.. python bench/upload_bench.py <file> [workers ...]
+
+Only the upload is timed; nothing is posted to any chat. The file must be larger
+than 10 MB, since SaveBigFilePart is rejected for smaller files.
+"""
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon import TelegramClient  # noqa: E402
+from telethon.sessions import StringSession  # noqa: E402
+
+import telethon_send  # noqa: E402
+
+
+async def timed(label, size, coro):
+    started = time.monotonic()
+    await coro
+    elapsed = time.monotonic() - started
+    print(f'{label:<24} {elapsed:8.2f}s  {size / 1048576 / elapsed:8.2f} MB/s')
+
+
+async def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 2
+    file_path = sys.argv[1]
+    workers = [int(w) for w in sys.argv[2:]] or [2, 4, 8]
+    size = os.path.getsize(file_path)
+    print(f'{os.path.basename(file_path)}: {size / 1048576:.1f} MB')
+
+    session = StringSession(telethon_send.STRING_SESSION)
+    async with TelegramClient(session, telethon_send.API_ID, telethon_send.API_HASH) as client:
+        await timed('single stream', size, client.upload_file(file_path))
+        for n in workers:
+            await timed(f'parallel x{n}', size, telethon_send.upload_parallel(client, file_path, n))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main()))
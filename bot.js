@@ -178,150 +178,104 @@ async function updateProgress(chatId, messageId, text) {
   } catch {}
 }
 
-async function isVideoByProbe(filePath) {
-  return await new Promise((resolve) => {
-    const p = spawn('ffprobe', [
-      '-v', 'error',
-      '-select_streams', 'v:0',
-      '-show_entries', 'stream=codec_type',
-      '-of', 'default=noprint_wrappers=1:nokey=1',
-      filePath,
-    ]);
-    let out = '';
-    p.stdout.on('data', (d) => (out += d.toString()));
-    p.on('error', () => resolve(false));
-    p.on('close', (code) => resolve(code === 0 && out.toLowerCase().includes('video')));
-  });
-}
-
-async function transcodeToTelegramMp4(inputPath) {
-  const outputPath = inputPath.replace(/\.[^/.]+$/, '') + '.tg.mp4';
-  return await new Promise((resolve) => {
-    log('ffmpeg:start', inputPath, '->', outputPath);
-    const p = spawn('ffmpeg', [
-      '-y',
-      '-i', inputPath,
-      '-vf', 'scale=960:-2,fps=30',
-      '-c:v', 'libx264',
-      '-profile:v', 'baseline',
-      '-level', '3.1',
-      '-preset', 'veryfast',
-      '-crf', '30',
-      '-pix_fmt', 'yuv420p',
-      '-movflags', '+faststart',
-      '-c:a', 'aac',
-      '-b:a', '96k',
-      '-ac', '1',
-      outputPath,
-    ]);
-    let err = '';
-    p.stderr.on('data', (d) => (err += d.toString()));
-    p.on('error', () => resolve(null));
-    p.on('close', (code) => {
-      log('ffmpeg:close', code);
-      if (code !== 0) log('ffmpeg:error', err.slice(-1200));
-      resolve(code === 0 ? outputPath : null);
-    });
-  });
-}
-
-async function remuxToMp4(inputPath) {
-  const outputPath = inputPath.replace(/\.[^/.]+$/, '') + '.remux.mp4';
-  return await new Promise((resolve) => {
-    log('ffmpeg:remux:start', inputPath, '->', outputPath);
-    const p = spawn('ffmpeg', ['-y', '-i', inputPath, '-c', 'copy', '-movflags', '+faststart', outputPath]);
-    let err = '';
-    p.stderr.on('data', (d) => (err += d.toString()));
-    p.on('error', () => resolve(null));
-    p.on('close', (code) => {
-      log('ffmpeg:remux:close', code);
-      if (code !== 0) log('ffmpeg:remux:error', err.slice(-1200));
-      resolve(code === 0 ? outputPath : null);
-    });
-  });
+// Probe results are shared with telethon_send.py through a `<file>.probe.json`
+// sidecar (see media_probe.py), keyed by size + mtime in whole milliseconds.
+function readProbeCache(filePath) {
+  try {
+    const st = fs.statSync(filePath);
+    const j = JSON.parse(fs.readFileSync(`${filePath}.probe.json`, 'utf8'));
+    if (j.size === st.size && j.mtime === Math.floor(st.mtimeMs)) return j;
+  } catch {}
+  return null;
 }
 
-async function compressToUnderLimit(inputPath, targetMB = 48) {
-  const outputPath = inputPath.replace(/\.[^/.]+$/, '') + `.small.mp4`;
-  const targetBits = Math.max(600_000, Math.floor((targetMB * 1024 * 1024 * 8) / 60));
-  return await new Promise((resolve) => {
-    log('ffmpeg:small:start', inputPath, '->', outputPath, 'targetMB=', targetMB);
-    const p = spawn('ffmpeg', [
-      '-y', '-i', inputPath,
-      '-vf', 'scale=720:-2,fps=24',
-      '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '34', '-maxrate', `${Math.floor(targetBits/1000)}k`, '-bufsize', `${Math.floor(targetBits/500)}k`,
-      '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
-      '-c:a', 'aac', '-b:a', '64k', '-ac', '1',
-      outputPath,
-    ]);
-    let err = '';
-    p.stderr.on('data', (d) => (err += d.toString()));
-    p.on('error', () => resolve(null));
-    p.on('close', (code) => {
-      log('ffmpeg:small:close', code);
-      if (code !== 0) log('ffmpeg:small:error', err.slice(-1200));
-      resolve(code === 0 ? outputPath : null);
-    });
-  });
+function writeProbeCache(filePath, meta) {
+  try {
+    const st = fs.statSync(filePath);
+    const tmp = `${filePath}.probe.json.tmp`;
+    fs.writeFileSync(tmp, JSON.stringify({ ...meta, size: st.size, mtime: Math.floor(st.mtimeMs) }));
+    fs.renameSync(tmp, `${filePath}.probe.json`);
+  } catch {}
 }
 
-async function transcodeProfile(inputPath, profile = 'hd') {
-  const outputPath = inputPath.replace(/\.[^/.]+$/, '') + `.${profile}.mp4`;
-  const profiles = {
-    hd: ['-vf', 'scale=1280:-2,fps=30', '-crf', '23', '-b:a', '128k'],
-    sd: ['-vf', 'scale=854:-2,fps=24', '-crf', '30', '-b:a', '96k'],
-    lq: ['-vf', 'scale=1920:-2,fps=30', '-crf', '18', '-b:a', '160k'],
-  };
-  const cfg = profiles[profile] || profiles.hd;
-  return await new Promise((resolve) => {
-    log('ffmpeg:profile:start', profile, inputPath, '->', outputPath);
-    const p = spawn('ffmpeg', [
-      '-y', '-i', inputPath,
-      ...cfg,
-      '-c:v', 'libx264', '-preset', 'veryfast',
-      '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
-      '-c:a', 'aac', '-ac', '2',
-      outputPath,
-    ]);
-    let err = '';
-    p.stderr.on('data', (d) => (err += d.toString()));
-    p.on('error', () => resolve(null));
-    p.on('close', (code) => {
-      log('ffmpeg:profile:close', profile, code);
-      if (code !== 0) log('ffmpeg:profile:error', err.slice(-1200));
-      resolve(code === 0 ? outputPath : null);
-    });
-  });
+function removeProbeCache(filePath) {
+  try { fs.unlinkSync(`${filePath}.probe.json`); } catch {}
 }
 
-async function getVideoMeta(filePath) {
-  return await new Promise((resolve) => {
+async function probeVideo(filePath) {
+  const cached = readProbeCache(filePath);
+  if (cached) return cached;
+  const meta = await new Promise((resolve) => {
     const p = spawn('ffprobe', [
       '-v', 'error',
-      '-select_streams', 'v:0',
-      '-show_entries', 'stream=width,height:format=duration',
+      '-show_entries', 'stream=codec_type,width,height:format=duration',
       '-of', 'json',
       filePath,
     ]);
     let out = '';
     p.stdout.on('data', (d) => (out += d.toString()));
-    p.on('error', () => resolve({}));
+    p.on('error', () => resolve(null));
     p.on('close', (code) => {
-      if (code !== 0) return resolve({});
+      if (code !== 0) return resolve(null);
       try {
         const j = JSON.parse(out || '{}');
-        const s = (j.streams && j.streams[0]) || {};
-        const duration = Math.round(parseFloat((j.format || {}).duration || '0'));
+        const s = (j.streams || []).find((x) => x.codec_type === 'video') || null;
+        const duration = parseFloat((j.format || {}).duration || '0');
         resolve({
-          duration: Number.isFinite(duration) && duration > 0 ? duration : undefined,
-          width: s.width || undefined,
-          height: s.height || undefined,
+          video: !!s,
+          width: (s && s.width) || null,
+          height: (s && s.height) || null,
+          duration: Number.isFinite(duration) && duration > 0 ? duration : null,
         });
       } catch {
-        resolve({});
+        resolve(null);
       }
     });
   });
+  if (meta) writeProbeCache(filePath, meta);
+  return meta || {};
+}
+
+async function isVideoByProbe(filePath) {
+  return !!(await probeVideo(filePath)).video;
+}
+
+async function transcode(inputPath, profile, outputPath) {
+  log('transcode:start', profile, inputPath, '->', outputPath);
+  const r = await transcoderDaemon.call({ file: inputPath, profile, output: outputPath });
+  if (!r.ok) {
+    log('transcode:error', profile, String(r.error || '').slice(-1200));
+    return null;
+  }
+  log('transcode:done', profile, r.cached ? 'cached' : r.remuxed ? 'remuxed' : 'encoded');
+  return r.output;
+}
+
+async function transcodeToTelegramMp4(inputPath) {
+  return await transcode(inputPath, 'telegram', inputPath.replace(/\.[^/.]+$/, '') + '.tg.mp4');
+}
+
+async function remuxToMp4(inputPath) {
+  return await transcode(inputPath, 'remux', inputPath.replace(/\.[^/.]+$/, '') + '.remux.mp4');
+}
+
+async function compressToUnderLimit(inputPath, targetMB = 48) {
+  return await transcode(inputPath, `small:${targetMB}`, inputPath.replace(/\.[^/.]+$/, '') + '.small.mp4');
+}
+
+async function transcodeProfile(inputPath, profile = 'hd') {
+  if (!['hd', 'sd', 'lq'].includes(profile)) profile = 'hd';
+  return await transcode(inputPath, profile, inputPath.replace(/\.[^/.]+$/, '') + `.${profile}.mp4`);
+}
+
+async function getVideoMeta(filePath) {
+  const meta = await probeVideo(filePath);
+  const duration = Math.round(meta.duration || 0);
+  return {
+    duration: duration > 0 ? duration : undefined,
+    width: meta.width || undefined,
+    height: meta.height || undefined,
+  };
 }
 
 async function createVideoThumbnail(inputPath) {
@@ -433,25 +387,80 @@ async function downloadToJob(url, jobDir) {
   return { result, files };
 }
 
-async function telethonSendVideo(chatId, videoPath, caption, duration, thumbPath) {
-  return await new Promise((resolve) => {
+// Long-lived Python helpers (telethon_send.py, transcoder.py) take JSON-line
+// jobs on stdin and answer each with a JSON line carrying the job's id.
+function createDaemon(tag, script) {
+  const pending = new Map();
+  let daemon = null;
+
+  function start() {
+    if (daemon) return daemon;
     const pyBin = fs.existsSync('/opt/py/bin/python') ? '/opt/py/bin/python' : 'python3';
-    const proc = spawn(pyBin, [
-      '/app/telethon_send.py',
-      String(chatId),
-      videoPath,
-      caption,
-      String(duration || ''),
-      String(thumbPath || ''),
-    ], { env: process.env });
-    let perr = '';
-    proc.stderr.on('data', (d) => (perr += d.toString()));
-    proc.on('error', (e) => { log('telethon:spawn:error', e?.message || String(e)); resolve(false); });
-    proc.on('close', (code) => {
-      if (code !== 0) log('telethon:error', perr.slice(-1000));
-      resolve(code === 0);
+    const proc = spawn(pyBin, [script, '--serve'], { env: { ...process.env, DOWNLOAD_DIR } });
+    let buf = '';
+    proc.stdout.on('data', (d) => {
+      buf += d.toString();
+      let nl;
+      while ((nl = buf.indexOf('\n')) >= 0) {
+        const line = buf.slice(0, nl).trim();
+        buf = buf.slice(nl + 1);
+        if (!line) continue;
+        let r;
+        try { r = JSON.parse(line); } catch { log(`${tag}:daemon:stdout`, line.slice(0, 300)); continue; }
+        const done = pending.get(r.id);
+        if (done) { pending.delete(r.id); done(r); }
+      }
     });
+    proc.stderr.on('data', (d) => log(`${tag}:daemon`, d.toString().trim().slice(-1000)));
+    const onExit = (why) => {
+      if (daemon !== proc) return;
+      daemon = null;
+      log(`${tag}:daemon:exit`, why);
+      for (const [id, done] of pending) {
+        pending.delete(id);
+        done({ id, ok: false, error: `daemon exited (${why})` });
+      }
+    };
+    proc.stdin.on('error', (e) => onExit(e?.message || String(e)));
+    proc.on('error', (e) => onExit(e?.message || String(e)));
+    proc.on('close', (code) => onExit(`code=${code}`));
+    daemon = proc;
+    log(`${tag}:daemon:start`, proc.pid);
+    return proc;
+  }
+
+  // resolves with the daemon's result line, { ok: false, error } on failure
+  function call(job) {
+    const id = `${Date.now()}-${Math.random().toString(36).slice(2, 8)}`;
+    return new Promise((resolve) => {
+      pending.set(id, resolve);
+      try {
+        start().stdin.write(JSON.stringify({ id, ...job }) + '\n');
+      } catch (e) {
+        pending.delete(id);
+        log(`${tag}:spawn:error`, e?.message || String(e));
+        resolve({ id, ok: false, error: e?.message || String(e) });
+      }
+    });
+  }
+
+  return { call };
+}
+
+const telethonDaemon = createDaemon('telethon', '/app/telethon_send.py');
+// one bounded ffmpeg pool with an output cache for every transcode (see transcoder.py)
+const transcoderDaemon = createDaemon('transcoder', '/app/transcoder.py');
+
+async function telethonSendVideo(chatId, videoPath, caption, duration, thumbPath) {
+  const r = await telethonDaemon.call({
+    chat_id: chatId,
+    file: videoPath,
+    caption,
+    duration: duration || null,
+    thumb: thumbPath || null,
   });
+  if (!r.ok) log('telethon:error', r.error);
+  return !!r.ok;
 }
 
 function detectSourceUrlForFile(filePath, fallbackUrl) {
@@ -513,12 +522,7 @@ async function sendMediaFile(chatId, filePath, caption, mode = 's', inlineKeyboa
     const c = await compressToUnderLimit(filePath, 48);
     if (c) source = c;
   } else if (mode === 't') {
-    const out = filePath + '.trim.mp4';
-    const trimmed = await new Promise((resolve) => {
-      const p = spawn('ffmpeg', ['-y', '-ss', '0', '-t', '30', '-i', filePath, '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '28', '-c:a', 'aac', '-movflags', '+faststart', out]);
-      p.on('close', (code) => resolve(code === 0 && fs.existsSync(out) ? out : null));
-      p.on('error', () => resolve(null));
-    });
+    const trimmed = await transcode(filePath, 'trim30', filePath + '.trim.mp4');
     if (trimmed) source = trimmed;
   }
 
@@ -570,11 +574,13 @@ async function sendMediaFile(chatId, filePath, caption, mode = 's', inlineKeyboa
             reply_markup: inlineKeyboard ? { inline_keyboard: inlineKeyboard } : undefined,
           });
           try { fs.unlinkSync(smaller); } catch {}
+          removeProbeCache(smaller);
           return { ok: true, kind: 'video', messageId: sent2?.message_id };
         } catch (e2) {
           log('send:video:small:error', e2?.message || String(e2));
         }
         try { fs.unlinkSync(smaller); } catch {}
+        removeProbeCache(smaller);
       }
     }
 
@@ -587,7 +593,7 @@ async function sendMediaFile(chatId, filePath, caption, mode = 's', inlineKeyboa
     return { ok, kind: 'video' };
   } finally {
     if (thumb) { try { fs.unlinkSync(thumb); } catch {} }
-    if (source !== filePath) { try { fs.unlinkSync(source); } catch {} }
+    if (source !== filePath) { try { fs.unlinkSync(source); } catch {} removeProbeCache(source); }
   }
 }
 
@@ -833,6 +839,7 @@ bot.on('callback_query', async (q) => {
           if (res.ok) sent++;
           try { fs.unlinkSync(f); } catch {}
           try { fs.unlinkSync(`${f}.json`); } catch {}
+          removeProbeCache(f);
         }
         await updateProgress(chatId, progressMsg.message_id, `📥 التنزيل: 100%\n📦 الملفات: ${uploadFiles.length}\n📤 الرفع: 100%\n📄 الحالي: ${uploadFiles.length}/${uploadFiles.length}\n✅ done. sent=${sent}`);
         await bot.sendMessage(chatId, `✅ done. sent=${sent}`);
@@ -903,6 +910,7 @@ bot.on('callback_query', async (q) => {
         const res = await sendMediaFile(chatId, localFile, cap, mode, perVideoActionRows(token));
         if (!res.ok) await bot.sendMessage(chatId, '❌ فشل تنفيذ العملية على الفيديو المحدد.');
         try { fs.unlinkSync(localFile); } catch {}
+        removeProbeCache(localFile);
       } catch (e) {
         log('va:error', e?.message || String(e));
         await bot.sendMessage(chatId, `❌ تعذر تنفيذ العملية: ${e.message || e}`);
@@ -1,15 +1,32 @@
 import asyncio
+import importlib.util
 import os
-import re
 import shutil
 import subprocess
-import urllib.request
-import uuid
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 from pathlib import Path
 
 from telegram import Update
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
 
+import job_journal
+import media_split
+import metrics
+from gdl_pool import GalleryDLPool
+from job_journal import JobJournal
+from media_cache import FileIdCache, MediaCache, url_key
+from scheduler import Job, JobScheduler, QueueFull
+from scraper import close_client, scrape_media_links
+
+try:
+    import telethon_send
+except ImportError:  # without telethon, large files are always split
+    telethon_send = None
+
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 DOWNLOAD_DIR = Path(os.getenv("DOWNLOAD_DIR", "./downloads"))
 ALLOWED_USER_ID = int(os.getenv("ALLOWED_USER_ID", "0"))
@@ -18,38 +35,363 @@ API_ID = os.getenv("API_ID", "")
 API_HASH = os.getenv("API_HASH", "")
 STRING_SESSION = os.getenv("STRING_SESSION", "")
 
+# number of warm in-process gallery-dl workers; 0 falls back to one subprocess per URL
+GDL_WORKERS = int(os.getenv("GDL_WORKERS", "2"))
+GDL_TIMEOUT = 180
+
+# job queue: how many downloads run at once, per user, and how many may wait
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", str(max(1, GDL_WORKERS))))
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", "1"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "50"))
+
+# files of one job are uploaded as they finish downloading, this many at a time
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "2"))
+MAX_FILES_PER_JOB = 10
+# Telegram fetches documents sent by URL itself and caps them at 20 MB
+URL_UPLOAD_LIMIT = 20 * 1024 * 1024
+# bots upload at most 50 MB; a user session (STRING_SESSION) uploads up to 2 GB
+BOT_API_LIMIT = 49 * 1024 * 1024
+MTPROTO_LIMIT = 2000 * 1024 * 1024
+# videos above the limit are cut into parts by this many ffmpeg processes at once
+SPLIT_WORKERS = int(os.getenv("SPLIT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# how many times one send waits out a Telegram flood limit before giving up
+FLOOD_RETRIES = 3
+
+# Prometheus metrics on http://<host>:METRICS_PORT/metrics; 0 disables
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# finished downloads are kept by content hash and reused for repeat links; 0 disables
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+# how long a link's cached result is served before it is downloaded again
+MEDIA_CACHE_TTL = int(os.getenv("MEDIA_CACHE_TTL", str(24 * 3600)))
+# runs a job gets, restarts and resent links included, before it is given up
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+RESUME_HINT = "ارسل الرابط مرة ثانية للمتابعة من حيث توقف."
+
 DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+media_cache = (
+    MediaCache(DOWNLOAD_DIR / ".cache", MEDIA_CACHE_MAX_BYTES, ttl=MEDIA_CACHE_TTL)
+    if MEDIA_CACHE_MAX_BYTES > 0 else None
+)
+# Telegram file_ids of everything this bot uploaded, by content hash
+file_ids = FileIdCache(DOWNLOAD_DIR / ".cache" / "file_ids.sqlite3")
+FILE_ID_SENDER = "bot:" + BOT_TOKEN.split(":")[0]
+# unfinished jobs, their files and gallery-dl download archives, kept across restarts
+JOURNAL_DIR = DOWNLOAD_DIR / ".journal"
+# parts of split videos, outside the job directories gallery-dl's files are collected from;
+# whatever a killed run left behind is dropped on start
+SPLIT_DIR = DOWNLOAD_DIR / ".split"
+shutil.rmtree(SPLIT_DIR, ignore_errors=True)
+journal = JobJournal(JOURNAL_DIR / "jobs.sqlite3")
+# the journal's SQLite commits run off the event loop, one at a time and in order
+journal_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+# journal ids of jobs queued or running, so a resent link does not run twice at once
+active_jobs = set()
+
+gdl_pool = None
+scheduler = None
+# Telethon client of STRING_SESSION for files above BOT_API_LIMIT
+mtproto = None
+
+
+def journal_call(method, *args):
+    """Run `method` on the journal thread; returns an awaitable of its result.
+
+    Calls run in the order they are made, so a read sees every write made before it.
+    """
+    return asyncio.get_running_loop().run_in_executor(journal_thread, method, *args)
+
+
+def journal_write(method, *args):
+    """journal_call for callbacks that cannot await; a failure is only logged."""
+    def logged(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"journal: {method.__name__} failed: {future.exception()}")
+
+    journal_call(method, *args).add_done_callback(logged)
+
 
 def is_url(text: str) -> bool:
     t = text.strip().lower()
     return t.startswith("http://") or t.startswith("https://")
 
 
-def extract_media_links(raw_html: str):
-    html = raw_html.replace('\\/', '/')
-    pattern = r'https?://[^\s"\'<>]+\.(?:mp4|webm|m3u8|jpg|jpeg|png|gif|webp)(?:\?[^\s"\'<>]*)?'
-    found = re.findall(pattern, html, flags=re.IGNORECASE)
-    # remove duplicates while preserving order
-    out = []
-    seen = set()
-    for u in found:
-        if u not in seen:
-            seen.add(u)
-            out.append(u)
-    return out
-
-
-def scrape_media_links(url: str):
-    req = urllib.request.Request(
-        url,
-        headers={
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-        },
+def gallery_dl_options(job_dir: Path, archive: Path = None):
+    """Config overrides equivalent to `gallery-dl -D job_dir --write-metadata --no-mtime`,
+    plus `--download-archive archive` when given."""
+    options = [
+        ((), "base-directory", str(job_dir)),
+        ((), "directory", ()),
+        ((), "postprocessors", [{"name": "metadata"}]),
+        ((), "mtime", False),
+    ]
+    if archive is not None:
+        options.append((("extractor",), "archive", str(archive)))
+    if API_ID:
+        options.append((("extractor", "telegram"), "api-id", API_ID))
+    if API_HASH:
+        options.append((("extractor", "telegram"), "api-hash", API_HASH))
+    if STRING_SESSION:
+        options.append((("extractor", "telegram"), "session", STRING_SESSION))
+    return options
+
+
+async def run_gallery_dl(url: str, job_dir: Path, on_file=None, archive: Path = None):
+    """Download `url` into `job_dir`; returns (returncode, output).
+
+    `on_file(path)` is called for each file as soon as gallery-dl finishes it.
+    Files recorded in the download archive `archive` are skipped.
+    Raises asyncio.TimeoutError once GDL_TIMEOUT has passed, after killing
+    whatever was running the job.
+    """
+    if gdl_pool is not None:
+        result = await gdl_pool.run(url, gallery_dl_options(job_dir, archive), timeout=GDL_TIMEOUT, on_file=on_file)
+        return result["returncode"], result["log"]
+
+    cmd = [
+        "gallery-dl",
+        "-D",
+        str(job_dir),
+        "--write-metadata",
+        "--no-mtime",
+    ]
+    if archive is not None:
+        cmd += ["--download-archive", str(archive)]
+    if API_ID:
+        cmd += ["-o", f"extractor.telegram.api-id={API_ID}"]
+    if API_HASH:
+        cmd += ["-o", f"extractor.telegram.api-hash={API_HASH}"]
+    if STRING_SESSION:
+        cmd += ["-o", f"extractor.telegram.session={STRING_SESSION}"]
+    cmd += [url]
+
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=os.environ.copy(),
     )
-    with urllib.request.urlopen(req, timeout=25) as r:
-        data = r.read().decode("utf-8", "ignore")
-    return extract_media_links(data)
+
+    async def read_stdout():
+        # with stdout not a tty, gallery-dl prints each finished file's path on its own line
+        lines = []
+        async for raw in proc.stdout:
+            line = raw.decode("utf-8", "ignore").rstrip("\n")
+            lines.append(line)
+            if on_file is not None and line and not line.startswith("# ") and os.path.isfile(line):
+                on_file(line)
+        return "\n".join(lines)
+
+    try:
+        stdout, stderr, _ = await asyncio.wait_for(
+            asyncio.gather(read_stdout(), proc.stderr.read(), proc.wait()), timeout=GDL_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        proc.kill()
+        raise
+    return proc.returncode, stderr.decode("utf-8", "ignore") or stdout
+
+
+def sent_file_id(message):
+    attachment = message.effective_attachment
+    if isinstance(attachment, (list, tuple)):
+        # photos come as a list of sizes, the last one is the original
+        attachment = attachment[-1] if attachment else None
+    return getattr(attachment, "file_id", None)
+
+
+async def telegram_call(category: str, send):
+    """Await `send()`, waiting out up to FLOOD_RETRIES Telegram flood limits."""
+    for attempt in range(1, FLOOD_RETRIES + 1):
+        try:
+            return await send()
+        except RetryAfter as e:
+            if attempt == FLOOD_RETRIES:
+                raise
+            metrics.BACKOFF_SECONDS.labels(category).observe(e.retry_after)
+            await asyncio.sleep(e.retry_after)
+
+
+async def send_file(bot, chat_id: int, f: Path, category: str = "other", caption: str = None):
+    """send_document that re-sends a known file_id instead of uploading again."""
+    size = f.stat().st_size
+    if size > BOT_API_LIMIT:
+        # the bot can have no file_id of it; not hashed here, send_large's path does if it needs to
+        return None
+
+    digest = await asyncio.to_thread(file_ids.digest, f)
+    cached = await asyncio.to_thread(file_ids.get, digest, FILE_ID_SENDER)
+    if cached:
+        async def resend():
+            started = time.monotonic()
+            message = await bot.send_document(chat_id, cached, caption=caption)
+            metrics.observe_upload(category, "file_id", 0, time.monotonic() - started)
+            return message
+
+        try:
+            return await telegram_call(category, resend)
+        except BadRequest:
+            # the file_id is no longer valid for this bot
+            await asyncio.to_thread(file_ids.forget, digest, FILE_ID_SENDER)
+
+    async def upload():
+        # reopened per attempt: a failed send has consumed the file object
+        started = time.monotonic()
+        with open(f, "rb") as fp:
+            message = await bot.send_document(chat_id, fp, filename=f.name, caption=caption)
+        metrics.observe_upload(category, "bot_api", size, time.monotonic() - started)
+        return message
+
+    message = await telegram_call(category, upload)
+    file_id = sent_file_id(message)
+    if file_id:
+        await asyncio.to_thread(file_ids.put, digest, FILE_ID_SENDER, file_id)
+    return message
+
+
+async def mtproto_entity(chat_id: int):
+    try:
+        return await mtproto.get_input_entity(chat_id)
+    except ValueError:
+        # a fresh session knows no entities yet; dialogs fill the cache
+        await mtproto.get_dialogs()
+        return await mtproto.get_input_entity(chat_id)
+
+
+async def send_mtproto(chat_id: int, f: Path, caption: str = ""):
+    entity = await mtproto_entity(chat_id)
+    if media_split.can_split(f):
+        return await telethon_send.send_video(mtproto, entity, str(f), caption)
+    return await telethon_send.send_document(mtproto, entity, str(f), caption)
+
+
+async def send_large(bot, chat_id: int, f: Path, category: str = "other",
+                     resume=None, on_part=None):
+    """Deliver a file above BOT_API_LIMIT; None when it cannot be sent.
+
+    With a user session the file goes over MTProto. Otherwise (or above
+    MTPROTO_LIMIT) videos are cut into stream-copied parts captioned
+    "i/N", each uploaded as soon as it is cut. `on_part(part_bytes, number)`
+    is called after each part is sent; `resume=(part_bytes, number)` from an
+    earlier run skips the parts up to number when the part size is the same.
+    """
+    if mtproto is not None and f.stat().st_size <= MTPROTO_LIMIT:
+        return await send_mtproto(chat_id, f)
+    if not media_split.can_split(f):
+        return None
+
+    limit = MTPROTO_LIMIT if mtproto is not None else BOT_API_LIMIT
+    SPLIT_DIR.mkdir(parents=True, exist_ok=True)
+    parts_dir = Path(tempfile.mkdtemp(prefix=f"{f.stem}.", dir=SPLIT_DIR))
+    first = resume[1] + 1 if resume and resume[0] == limit else 1
+    sent = []
+    try:
+        # closed before parts_dir goes, so no cut is still writing into it
+        async with aclosing(media_split.split(f, parts_dir, limit, SPLIT_WORKERS, first)) as parts:
+            async for number, count, part in parts:
+                caption = f"{f.name} — {number}/{count}"
+                if mtproto is not None:
+                    message = await send_mtproto(chat_id, part, caption)
+                else:
+                    message = await send_file(bot, chat_id, part, category, caption)
+                if message is None:
+                    raise media_split.SplitError(f"part {number}/{count} is still above the upload limit")
+                sent.append(message)
+                if on_part is not None:
+                    on_part(limit, number)
+                part.unlink(missing_ok=True)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    return sent
+
+
+async def upload_files(bot, chat_id: int, queue: asyncio.Queue, category: str = "other",
+                       on_done=None, seen: int = 0, on_part=None, parts=None):
+    """Send files from `queue` as they arrive until a None sentinel; returns (seen, sent).
+
+    `on_done(path, state)` is called with job_journal.SENT or SKIPPED for each
+    file that needs no further attempt; `seen` counts files an earlier run of
+    the job already handled against MAX_FILES_PER_JOB. `on_part(path,
+    part_bytes, number)` is called for each split part sent, and `parts` maps
+    paths to the (part_bytes, number) an earlier run got to.
+    """
+    stats = {"seen": seen, "sent": 0}
+    parts = parts or {}
+
+    def done(f, state):
+        if on_done is not None:
+            on_done(f, state)
+
+    async def worker():
+        while True:
+            f = await queue.get()
+            if f is None:
+                queue.put_nowait(None)
+                return
+            if stats["seen"] >= MAX_FILES_PER_JOB:
+                done(f, job_journal.SKIPPED)
+                continue
+            stats["seen"] += 1
+            try:
+                message = await send_file(bot, chat_id, f, category)
+                if message is None:
+                    message = await send_large(
+                        bot, chat_id, f, category, resume=parts.get(f),
+                        on_part=None if on_part is None else lambda size, number, f=f: on_part(f, size, number))
+                if message is None:
+                    done(f, job_journal.SKIPPED)
+                    size_mb = f.stat().st_size / (1024 * 1024)
+                    await bot.send_message(chat_id, f"⚠️ تخطيت ملف كبير: {f.name} ({size_mb:.1f}MB)")
+                    continue
+                done(f, job_journal.SENT)
+                stats["sent"] += 1
+            except Exception as e:
+                try:
+                    await bot.send_message(chat_id, f"❌ فشل رفع {f.name}: {e}")
+                except Exception as report_error:
+                    # the worker keeps taking files for the rest of the job
+                    print(f"upload: could not report {f.name} to chat {chat_id}: {report_error}")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, UPLOAD_CONCURRENCY))))
+    return stats["seen"], stats["sent"]
+
+
+async def start_gdl_pool(app: Application):
+    global gdl_pool
+    if GDL_WORKERS <= 0 or importlib.util.find_spec("gallery_dl") is None:
+        return
+    pool = GalleryDLPool(GDL_WORKERS, cache_dir=media_cache.root if media_cache else None)
+    await pool.start()
+    gdl_pool = pool
+    print(f"gallery-dl pool ready ({GDL_WORKERS} workers)")
+
+
+async def stop_gdl_pool(app: Application):
+    if gdl_pool is not None:
+        await gdl_pool.close()
+
+
+async def start_mtproto(app: Application):
+    global mtproto
+    if telethon_send is None or not (API_ID and API_HASH and STRING_SESSION):
+        return
+    client = telethon_send.make_client()
+    try:
+        await client.connect()
+        if not await client.is_user_authorized():
+            raise RuntimeError("STRING_SESSION is not authorized")
+    except Exception as e:
+        print(f"MTProto session unavailable ({e}); large videos will be split")
+        await client.disconnect()
+        return
+    mtproto = client
+    print("MTProto uploads ready for large files")
+
+
+async def stop_mtproto(app: Application):
+    if mtproto is not None:
+        await mtproto.disconnect()
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -67,6 +409,48 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+def job_archive(job_id: str) -> Path:
+    return JOURNAL_DIR / f"{job_id}.archive.sqlite3"
+
+
+def submit_job(job: Job):
+    """Queue a journaled job; returns its position, raises QueueFull."""
+    position = scheduler.submit(job)
+    active_jobs.add(job.id)
+    return position
+
+
+def discard_job(job_id: str):
+    """Drop a job from the journal along with its download directory and archive.
+
+    Blocks on SQLite and the file system; run it with journal_call.
+    """
+    journal.finish(job_id)
+    shutil.rmtree(DOWNLOAD_DIR / job_id, ignore_errors=True)
+    job_archive(job_id).unlink(missing_ok=True)
+
+
+async def resume_jobs(bot):
+    """Queue the jobs an earlier run of the bot left unfinished."""
+    for row in await journal_call(journal.unfinished):
+        if row["id"] in active_jobs:
+            continue
+        if row["attempts"] >= JOB_MAX_ATTEMPTS:
+            await journal_call(discard_job, row["id"])
+            continue
+        job = Job(user_id=row["user_id"], chat_id=row["chat_id"], url=row["url"],
+                  priority=row["priority"], id=row["id"])
+        try:
+            submit_job(job)
+        except QueueFull:
+            # the rest stay journaled for the next start or a resent link
+            return
+        try:
+            await bot.send_message(job.chat_id, f"🔁 استئناف تحميل لم يكتمل:\n{job.url}")
+        except Exception as e:
+            print(f"journal: could not notify chat {job.chat_id}: {e}")
+
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text:
         return
@@ -76,104 +460,221 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("غير مصرح لك باستخدام هذا البوت.")
         return
 
-    url = update.message.text.strip()
-    if not is_url(url):
+    urls = update.message.text.split()
+    if not urls or not all(is_url(u) for u in urls):
         await update.message.reply_text("ارسل رابط صحيح يبدأ بـ http أو https")
         return
 
-    await update.message.reply_text("⏳ جاري التحميل عبر gallery-dl...")
-
-    job_dir = DOWNLOAD_DIR / str(uuid.uuid4())
+    chat_id = update.message.chat_id
+    # links a full queue turned away, reported together once the rest are queued
+    rejected = []
+    # messages with fewer links run first, so a single link never waits behind a batch
+    for url in urls:
+        # a link resent to the same chat continues its unfinished job
+        job_id, created = await journal_call(journal.open, user_id, chat_id, url, len(urls))
+        if job_id in active_jobs:
+            await update.message.reply_text(f"⏳ هذا الرابط قيد التنفيذ بالفعل\n{url}")
+            continue
+        job = Job(user_id=user_id, chat_id=chat_id, url=url, priority=len(urls), id=job_id)
+        starting = scheduler.would_start_now()
+        try:
+            position = submit_job(job)
+        except QueueFull:
+            if created:
+                await journal_call(journal.finish, job_id)
+            rejected.append(url)
+            continue
+        if starting:
+            await update.message.reply_text(f"⏳ جاري التحميل عبر gallery-dl...\n{url}")
+        else:
+            await update.message.reply_text(f"🕒 تمت الإضافة للطابور، ترتيبك: {position}\n{url}")
+    if rejected:
+        await update.message.reply_text(
+            "🚦 الطابور ممتلئ حاليًا، هذه الروابط لم تُضف، جرّب بعد قليل:\n" + "\n".join(rejected))
+
+
+async def process_job(bot, job: Job):
+    chat_id = job.chat_id
+    url = job.url
+    waited = time.monotonic() - job.queued_at
+    category = await asyncio.to_thread(metrics.url_category, url)
+    metrics.QUEUE_WAIT.labels(category).observe(waited)
+    outcome = "error"
+    # the job's directory, archive and journal entry go once it is over;
+    # until then a restart or a resent link picks it up where it stopped
+    finished = False
+
+    job_dir = DOWNLOAD_DIR / job.id
     job_dir.mkdir(parents=True, exist_ok=True)
+    attempt = await journal_call(journal.start, job.id)
+    last_attempt = attempt >= JOB_MAX_ATTEMPTS
+    # files of earlier runs; those already sent or skipped are not queued again
+    earlier = await journal_call(journal.files, job.id)
+    handled = {Path(p) for p, state in earlier.items() if state != job_journal.PENDING}
+    # split videos an earlier run sent some parts of
+    parts = {Path(p): progress for p, progress in (await journal_call(journal.parts, job.id)).items()}
+
+    # files are uploaded while gallery-dl keeps downloading the rest
+    queue = asyncio.Queue()
+    # insertion-ordered, so the cache keeps gallery-dl's file order
+    queued = {}
+
+    def on_file(path):
+        p = Path(path)
+        # metadata sidecars, and files gallery-dl or media_probe are still writing
+        if p in queued or p.name.endswith((".json", ".part", ".tmp")) or not p.is_file():
+            return
+        queued[p] = None
+        journal_write(journal.add_file, job.id, p)
+        if p not in handled:
+            queue.put_nowait(p)
 
-    cmd = [
-        "gallery-dl",
-        "-D",
-        str(job_dir),
-        "--write-metadata",
-        "--no-mtime",
-    ]
-    if API_ID:
-        cmd += ["-o", f"extractor.telegram.api-id={API_ID}"]
-    if API_HASH:
-        cmd += ["-o", f"extractor.telegram.api-hash={API_HASH}"]
-    if STRING_SESSION:
-        cmd += ["-o", f"extractor.telegram.session={STRING_SESSION}"]
-    cmd += [url]
+    def on_done(path, state):
+        journal_write(journal.mark, job.id, path, state)
 
-    env = os.environ.copy()
+    def on_part(path, part_bytes, number):
+        journal_write(journal.mark_part, job.id, path, part_bytes, number)
 
+    uploader = asyncio.create_task(upload_files(
+        bot, chat_id, queue, category, on_done, seen=len(handled), on_part=on_part, parts=parts))
     try:
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            env=env,
-        )
+        # what an earlier run downloaded but did not send goes out first
+        for p in earlier:
+            on_file(p)
+
+        if media_cache is not None and not earlier:
+            cached = await asyncio.to_thread(media_cache.materialize, url_key(url), job_dir)
+            if cached:
+                for p in cached:
+                    on_file(p)
+                queue.put_nowait(None)
+                seen, sent = await uploader
+                outcome = "cached"
+                finished = True
+                await bot.send_message(chat_id, f"✅ تم (من الذاكرة المؤقتة). ارسلت {sent} ملف/ملفات.")
+                return
+
+        started = time.monotonic()
         try:
-            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=180)
+            returncode, msg = await run_gallery_dl(url, job_dir, on_file, job_archive(job.id))
         except asyncio.TimeoutError:
-            proc.kill()
-            await update.message.reply_text("⌛ العملية أخذت وقت طويل وتم إيقافها. جرّب رابط آخر.")
-            shutil.rmtree(job_dir, ignore_errors=True)
+            metrics.DOWNLOAD_SECONDS.labels(category, "timeout").observe(time.monotonic() - started)
+            outcome = "timeout"
+            finished = last_attempt
+            queue.put_nowait(None)
+            await uploader
+            await bot.send_message(
+                chat_id, "⌛ العملية أخذت وقت طويل وتم إيقافها. "
+                + ("جرّب رابط آخر." if finished else RESUME_HINT))
             return
 
-        if proc.returncode != 0:
-            msg = (stderr.decode("utf-8", "ignore") or stdout.decode("utf-8", "ignore"))[-1200:]
+        metrics.DOWNLOAD_SECONDS.labels(category, "ok" if returncode == 0 else "failed").observe(
+            time.monotonic() - started)
+        if returncode != 0 and not queued:
+            outcome = "failed"
+            finished = True
+            queue.put_nowait(None)
+            await uploader
+            msg = msg[-1200:]
 
             # fallback for unsupported websites: scrape direct media URLs from page source
             if "Unsupported URL" in msg:
                 try:
-                    links = scrape_media_links(url)
+                    links = await scrape_media_links(url, max_bytes=URL_UPLOAD_LIMIT)
                     if links:
                         sent_links = 0
-                        for link in links[:8]:
+                        for link in links:
                             try:
-                                await update.message.reply_document(link)
+                                await bot.send_document(chat_id, link)
                                 sent_links += 1
                             except Exception:
-                                await update.message.reply_text(link)
-                        await update.message.reply_text(f"✅ تم عبر الوضع البديل. ارسلت {sent_links} ملف/رابط.")
-                        shutil.rmtree(job_dir, ignore_errors=True)
+                                await bot.send_message(chat_id, link)
+                        outcome = "fallback"
+                        await bot.send_message(chat_id, f"✅ تم عبر الوضع البديل. ارسلت {sent_links} ملف/رابط.")
                         return
                 except Exception as fe:
                     msg = msg + f"\n(fallback failed: {fe})"
 
-            await update.message.reply_text(f"❌ فشل التحميل:\n{msg}")
-            shutil.rmtree(job_dir, ignore_errors=True)
+            await bot.send_message(chat_id, f"❌ فشل التحميل:\n{msg}")
             return
 
-        files = [p for p in job_dir.rglob("*") if p.is_file()]
-        files = [p for p in files if not p.name.endswith(".json")]
-
-        if not files:
-            await update.message.reply_text("تم التنفيذ لكن ما لقيت ملفات قابلة للإرسال.")
-            shutil.rmtree(job_dir, ignore_errors=True)
+        # pick up anything gallery-dl finished without reporting it
+        for p in sorted(job_dir.rglob("*")):
+            on_file(p)
+        queue.put_nowait(None)
+        seen, sent = await uploader
+        metrics.DOWNLOAD_BYTES.labels(category).observe(sum(p.stat().st_size for p in queued if p.exists()))
+
+        if media_cache is not None and queued:
+            try:
+                # a job that ended with errors only contributes its per-file entries
+                await asyncio.to_thread(media_cache.store_job, url if returncode == 0 else None, list(queued))
+            except Exception as e:
+                print(f"media cache: could not store {url}: {e}")
+
+        # files whose upload failed, or gallery-dl errors, leave the job open
+        finished = last_attempt or (returncode == 0 and not await journal_call(journal.pending, job.id))
+        if not seen:
+            outcome = "empty"
+            await bot.send_message(chat_id, "تم التنفيذ لكن ما لقيت ملفات قابلة للإرسال.")
             return
 
-        sent = 0
-        for f in files[:10]:
-            size_mb = f.stat().st_size / (1024 * 1024)
-            if size_mb > 49:
-                await update.message.reply_text(f"⚠️ تخطيت ملف كبير: {f.name} ({size_mb:.1f}MB)")
-                continue
-            with open(f, "rb") as fp:
-                await update.message.reply_document(fp, filename=f.name)
-                sent += 1
-
-        await update.message.reply_text(f"✅ تم. ارسلت {sent} ملف/ملفات.")
+        outcome = "ok" if returncode == 0 else "partial"
+        if returncode != 0:
+            await bot.send_message(chat_id, f"⚠️ gallery-dl انتهى مع أخطاء:\n{msg[-600:]}")
+        await bot.send_message(chat_id, f"✅ تم. ارسلت {sent} ملف/ملفات.")
+        if not finished:
+            await bot.send_message(chat_id, f"⚠️ بعض الملفات لم تكتمل. {RESUME_HINT}")
 
     except Exception as e:
-        await update.message.reply_text(f"❌ خطأ داخلي: {e}")
+        finished = last_attempt
+        await bot.send_message(chat_id, f"❌ خطأ داخلي: {e}" + ("" if finished else f"\n{RESUME_HINT}"))
     finally:
-        shutil.rmtree(job_dir, ignore_errors=True)
+        metrics.JOBS.labels(category, outcome).inc()
+        if not uploader.done():
+            uploader.cancel()
+        # queued before the job leaves active_jobs, so a resent link cannot open it again
+        discarded = journal_call(discard_job, job.id) if finished else None
+        active_jobs.discard(job.id)
+        if discarded is not None:
+            await discarded
+
+
+async def post_init(app: Application):
+    global scheduler
+    if metrics.serve(METRICS_PORT):
+        print(f"metrics on :{METRICS_PORT}/metrics")
+    await start_gdl_pool(app)
+    await start_mtproto(app)
+    scheduler = JobScheduler(
+        lambda job: process_job(app.bot, job),
+        max_concurrent=MAX_CONCURRENT_JOBS,
+        per_user=MAX_JOBS_PER_USER,
+        max_queued=MAX_QUEUED_JOBS,
+    )
+    scheduler.start()
+    await resume_jobs(app.bot)
+
+
+async def post_shutdown(app: Application):
+    if scheduler is not None:
+        await scheduler.stop()
+    await stop_gdl_pool(app)
+    await stop_mtproto(app)
+    await close_client()
 
 
 if __name__ == "__main__":
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN is required")
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
@@ -0,0 +1,54 @@
+import time
+import uuid
+from . import events
+from .ratelimit import get_redis
+
+BATCH_TTL = 7 * 24 * 3600
+
+
+def _key(batch_id: str) -> str:
+    return f"send_batch:{batch_id}"
+
+
+def create(kind: str) -> str:
+    batch_id = uuid.uuid4().hex
+    r = get_redis()
+    r.hset(_key(batch_id), mapping={"kind": kind, "total": 0, "sent": 0, "failed": 0, "skipped": 0, "dispatched": 0, "created": time.time()})
+    r.expire(_key(batch_id), BATCH_TTL)
+    return batch_id
+
+
+def _publish(batch_id: str):
+    progress = get(batch_id)
+    if progress:
+        events.publish("batch", **progress)
+
+
+def add_total(batch_id: str, n: int):
+    get_redis().hincrby(_key(batch_id), "total", n)
+    _publish(batch_id)
+
+
+def mark_dispatched(batch_id: str):
+    get_redis().hset(_key(batch_id), "dispatched", 1)
+    _publish(batch_id)
+
+
+def record(batch_id: str, outcome: str):
+    """Count one item as "sent", "failed" or "skipped"."""
+    get_redis().hincrby(_key(batch_id), outcome, 1)
+    _publish(batch_id)
+
+
+def get(batch_id: str):
+    data = get_redis().hgetall(_key(batch_id))
+    if not data:
+        return None
+    total, sent, failed, skipped = (int(data[k]) for k in ("total", "sent", "failed", "skipped"))
+    if data["dispatched"] != "1":
+        status = "dispatching"
+    elif sent + failed + skipped >= total:
+        status = "done"
+    else:
+        status = "running"
+    return {"id": batch_id, "kind": data["kind"], "status": status, "total": total, "sent": sent, "failed": failed, "skipped": skipped}
@@ -5,9 +5,23 @@ celery_app = Celery(
     "media_dashboard",
     broker=settings.redis_url,
     backend=settings.redis_url,
+    include=["app.tasks"],
 )
 
+# Sends only wait on Telegram and run on a threaded worker of their own;
+# downloads keep the default queue, whose worker runs one gallery-dl per process.
+SEND_QUEUE = "sends"
+
 celery_app.conf.update(
     task_track_started=True,
     result_expires=3600,
+    task_routes={
+        "tasks.send_to_telegram": {"queue": SEND_QUEUE},
+        "tasks.dispatch_send_batch": {"queue": SEND_QUEUE},
+        "tasks.send_batch_chunk": {"queue": SEND_QUEUE},
+    },
+    beat_schedule={
+        "storage-gc": {"task": "tasks.storage_gc", "schedule": settings.storage_gc_interval},
+        "storage-reconcile": {"task": "tasks.storage_reconcile", "schedule": settings.storage_reconcile_interval},
+    },
 )
@@ -20,9 +20,33 @@ class Settings:
 
     media_root: str = os.getenv("MEDIA_ROOT", "/data/media")
     gallery_dl_binary: str = os.getenv("GALLERY_DL_BINARY", "gallery-dl")
+    # seconds one gallery-dl run may take before it is killed
+    download_timeout: int = int(os.getenv("DOWNLOAD_TIMEOUT", "1800"))
+    media_cache_max_bytes: int = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))
+    media_cache_ttl: int = int(os.getenv("MEDIA_CACHE_TTL", str(24 * 3600)))
+    # files of sent (then idle) items are evicted once MEDIA_ROOT passes the quota; 0 disables
+    storage_quota_bytes: int = int(os.getenv("STORAGE_QUOTA_BYTES", str(100 * 1024 ** 3)))
+    # seconds an item that was not sent must sit unused before its file may be evicted
+    storage_max_idle: int = int(os.getenv("STORAGE_MAX_IDLE", str(7 * 24 * 3600)))
+    storage_gc_interval: int = int(os.getenv("STORAGE_GC_INTERVAL", "600"))
+    # full walk of MEDIA_ROOT that corrects the usage the GC sums from the index
+    storage_reconcile_interval: int = int(os.getenv("STORAGE_RECONCILE_INTERVAL", str(24 * 3600)))
+    # transcoder.py profile applied to videos before sending (e.g. telegram, sd, small:48); empty sends originals
+    transcode_profile: str = os.getenv("TRANSCODE_PROFILE", "")
+    transcode_cache_max_bytes: int = int(os.getenv("TRANSCODE_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
 
     telegram_bot_token: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
     telegram_chat_id: str = os.getenv("TELEGRAM_CHAT_ID", "")
+    # a local telegram-bot-api server, or the fake one in bench/
+    telegram_api_url: str = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+    # sends per second to one chat, shared by all workers, and how many may go out back to back
+    telegram_chat_rate: float = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+    telegram_chat_burst: float = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+    send_batch_chunk: int = int(os.getenv("SEND_BATCH_CHUNK", "100"))
+    # optional MTProto account for files above the Bot API's 50 MB upload limit
+    telegram_api_id: str = os.getenv("TELEGRAM_API_ID", "")
+    telegram_api_hash: str = os.getenv("TELEGRAM_API_HASH", "")
+    telegram_string_session: str = os.getenv("TELEGRAM_STRING_SESSION", "")
 
 
 settings = Settings()
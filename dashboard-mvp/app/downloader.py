@@ -0,0 +1,89 @@
+import os
+import signal
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass, field
+from .config import settings
+
+PROGRESS_INTERVAL = 1.0
+
+
+class DownloadTimeout(Exception):
+    pass
+
+
+@dataclass
+class DownloadResult:
+    returncode: int
+    files: list = field(default_factory=list)
+    log: str = ""
+
+
+def _reported_files(stdout: str, directory: str):
+    # with stdout not a tty, gallery-dl prints each file's path on its own line,
+    # prefixed with "# " when it was already on disk
+    root = os.path.realpath(directory) + os.sep
+    files = []
+    for line in stdout.splitlines():
+        path = line[2:] if line.startswith("# ") else line
+        path = path.strip()
+        if path and os.path.realpath(path).startswith(root) and os.path.isfile(path) and path not in files:
+            files.append(path)
+    return files
+
+
+def _sidecar_files(directory: str):
+    # every file gallery-dl wrote has a <name>.json metadata sidecar next to it
+    files = []
+    for dirpath, _, names in os.walk(directory):
+        present = set(names)
+        for name in sorted(names):
+            if name.endswith(".json") and name[:-5] in present:
+                files.append(os.path.join(dirpath, name[:-5]))
+    return files
+
+
+def _dir_size(directory: str) -> int:
+    total = 0
+    for dirpath, _, names in os.walk(directory):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                # renamed from .part or removed meanwhile
+                pass
+    return total
+
+
+def run_gallery_dl(url: str, directory: str, timeout: int = None, on_progress=None) -> DownloadResult:
+    """Download url into its own directory and return exactly the files it produced.
+
+    on_progress(bytes) is called about once per PROGRESS_INTERVAL with the
+    size of the job directory so far. Raises DownloadTimeout after killing
+    gallery-dl and anything it started once timeout seconds have passed.
+    """
+    timeout = timeout or settings.download_timeout
+    os.makedirs(directory, exist_ok=True)
+    cmd = [settings.gallery_dl_binary, "-D", directory, "--write-metadata", "--no-mtime", url]
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(cmd, stdout=out, stderr=err, start_new_session=True)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                proc.wait(timeout=max(0.0, min(PROGRESS_INTERVAL, deadline - time.monotonic())))
+                break
+            except subprocess.TimeoutExpired:
+                if time.monotonic() >= deadline:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                    proc.wait()
+                    raise DownloadTimeout(f"gallery-dl did not finish within {timeout}s")
+                if on_progress is not None:
+                    on_progress(_dir_size(directory))
+        out.seek(0)
+        err.seek(0)
+        stdout = out.read().decode("utf-8", "ignore")
+        stderr = err.read().decode("utf-8", "ignore")
+
+    files = _reported_files(stdout, directory) or _sidecar_files(directory)
+    return DownloadResult(proc.returncode, files, (stderr or stdout)[-4000:])
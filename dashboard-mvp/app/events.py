@@ -0,0 +1,66 @@
+import json
+import time
+import redis
+import redis.asyncio
+from .config import settings
+from .ratelimit import get_redis
+
+CHANNEL = "media_events"
+# minimum seconds between progress events of one item and phase
+PROGRESS_INTERVAL = 0.5
+KEEPALIVE = 15
+
+_async_redis = None
+
+
+def publish(event: str, **data):
+    """Fan an event out to every open /events stream; progress is best effort."""
+    try:
+        get_redis().publish(CHANNEL, json.dumps({"type": event, **data}, default=str))
+    except redis.RedisError:
+        pass
+
+
+def item_status(item):
+    publish("status", id=item.id, status=item.status, filename=item.filename, error=item.error_message)
+
+
+class Progress:
+    """Throttled byte-progress callback for one item: progress(done, total=None)."""
+
+    def __init__(self, item_id: int, phase: str):
+        self.item_id = item_id
+        self.phase = phase
+        self._last = 0.0
+
+    def __call__(self, done: int, total: int = None):
+        now = time.monotonic()
+        if now - self._last < PROGRESS_INTERVAL and done != total:
+            return
+        self._last = now
+        publish("progress", id=self.item_id, phase=self.phase, bytes=done, total=total)
+
+
+def _get_async_redis():
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = redis.asyncio.Redis.from_url(settings.redis_url, decode_responses=True)
+    return _async_redis
+
+
+async def stream(request):
+    """Server-sent events for every published event until the client goes away."""
+    pubsub = _get_async_redis().pubsub()
+    await pubsub.subscribe(CHANNEL)
+    try:
+        yield "retry: 3000\n\n"
+        while not await request.is_disconnected():
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=KEEPALIVE)
+            if message is None:
+                # keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            yield f"data: {message['data']}\n\n"
+    finally:
+        await pubsub.unsubscribe(CHANNEL)
+        await pubsub.aclose()
@@ -25,6 +25,8 @@ TRANSLATIONS = {
         "page": "Page",
         "next": "Next",
         "prev": "Prev",
+        "items": "items",
+        "batch_progress": "Send batch",
     },
     "ar": {
         "title": "لوحة تحكم وسائط تيليجرام",
@@ -52,6 +54,8 @@ TRANSLATIONS = {
         "page": "الصفحة",
         "next": "التالي",
         "prev": "السابق",
+        "items": "عنصر",
+        "batch_progress": "دفعة الإرسال",
     },
 }
 
@@ -1,6 +1,5 @@
-from math import ceil
 from fastapi import FastAPI, Request, Depends, Form
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
@@ -10,9 +9,12 @@ from .db import Base, engine, get_db
 from .models import MediaItem, JobHistory
 from .auth import authenticate, require_auth
 from .celery_app import celery_app
-from .tasks import download_media, send_to_telegram
+from . import batches, events, metrics
+from .tasks import dispatch_send_batch, download_media
 from .config import settings
 from .i18n import t
+from .migrate import run as run_migrations
+from .pagination import cached_count, keyset_page
 
 app = FastAPI(title=settings.app_name)
 app.add_middleware(SessionMiddleware, secret_key=settings.secret_key)
@@ -23,6 +25,7 @@ templates = Jinja2Templates(directory="app/templates")
 @app.on_event("startup")
 def startup():
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
 
 
 @app.get("/")
@@ -62,7 +65,8 @@ def set_lang(request: Request, lang: str):
 @app.get("/dashboard", response_class=HTMLResponse)
 def dashboard(
     request: Request,
-    page: int = 1,
+    after: str = "",
+    before: str = "",
     status: str = "all",
     q: str = "",
     db: Session = Depends(get_db),
@@ -77,22 +81,18 @@ def dashboard(
     if q:
         query = query.filter(MediaItem.source_url.ilike(f"%{q}%"))
 
-    total = query.count()
-    pages = max(1, ceil(total / page_size))
-    items = (
-        query.order_by(MediaItem.created_at.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
-        .all()
-    )
+    # searches only get a capped count; plain status filters are exact but cached
+    total = cached_count(f"media:{status}:{q}", query, capped=bool(q))
+    items, next_cursor, prev_cursor = keyset_page(query, MediaItem, page_size, after, before)
 
     return templates.TemplateResponse(
         "dashboard.html",
         {
             "request": request,
             "items": items,
-            "page": page,
-            "pages": pages,
+            "total": total,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
             "status": status,
             "q": q,
             "lang": lang,
@@ -149,42 +149,64 @@ def bulk_deselect(request: Request, status: str = Form("all"), q: str = Form("")
 
 
 @app.post("/send-selected")
-def send_selected(request: Request, db: Session = Depends(get_db)):
+def send_selected(request: Request):
     require_auth(request)
-    items = db.query(MediaItem).filter(MediaItem.selected.is_(True), MediaItem.status.in_(["downloaded", "send_failed"])).all()
-    for item in items:
-        send_to_telegram.delay(item.id)
-    return RedirectResponse(url="/history", status_code=302)
+    batch_id = batches.create("selected")
+    dispatch_send_batch.delay(batch_id, "selected")
+    return RedirectResponse(url=f"/history?batch={batch_id}", status_code=302)
 
 
 @app.get("/history", response_class=HTMLResponse)
-def history(request: Request, page: int = 1, db: Session = Depends(get_db)):
+def history(request: Request, after: str = "", before: str = "", batch: str = "", db: Session = Depends(get_db)):
     require_auth(request)
     lang = request.session.get("lang", settings.language_default)
     page_size = 20
-    total = db.query(JobHistory).count()
-    pages = max(1, ceil(total / page_size))
-    rows = (
-        db.query(JobHistory)
-        .order_by(JobHistory.created_at.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
-        .all()
-    )
-    return templates.TemplateResponse("history.html", {"request": request, "rows": rows, "page": page, "pages": pages, "lang": lang, "t": t})
+    query = db.query(JobHistory)
+    total = cached_count("history", query)
+    rows, next_cursor, prev_cursor = keyset_page(query, JobHistory, page_size, after, before)
+    return templates.TemplateResponse("history.html", {
+        "request": request, "rows": rows, "total": total,
+        "next_cursor": next_cursor, "prev_cursor": prev_cursor,
+        "batch": batch, "lang": lang, "t": t,
+    })
 
 
 @app.post("/retry-failed-sends")
-def retry_failed_sends(request: Request, db: Session = Depends(get_db)):
+def retry_failed_sends(request: Request):
     require_auth(request)
-    items = db.query(MediaItem).filter(MediaItem.status == "send_failed").all()
-    for item in items:
-        db.add(JobHistory(media_item_id=item.id, action="retry", status="ok", detail="Retry queued"))
-        send_to_telegram.delay(item.id)
-    db.commit()
-    return RedirectResponse(url="/history", status_code=302)
+    batch_id = batches.create("retry")
+    dispatch_send_batch.delay(batch_id, "retry")
+    return RedirectResponse(url=f"/history?batch={batch_id}", status_code=302)
+
+
+@app.get("/batch/{batch_id}")
+def batch_status(request: Request, batch_id: str):
+    require_auth(request)
+    progress = batches.get(batch_id)
+    if progress is None:
+        return JSONResponse({"error": "unknown batch"}, status_code=404)
+    return progress
+
+
+@app.get("/events")
+def event_stream(request: Request):
+    """Live status, progress and batch events; served from Redis pub/sub, no DB access."""
+    require_auth(request)
+    return StreamingResponse(
+        events.stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint, including the Celery worker's samples."""
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
 
 
 @app.get("/health")
 def health():
     return {"ok": True, "celery": str(celery_app.main)}
+
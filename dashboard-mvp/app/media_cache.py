@@ -0,0 +1,214 @@
+import json
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+# keys, hashing and linking are the repository's media_cache.py, copied to /app/media_cache.py
+from media_cache import file_digest, gdl_key, link_or_copy, url_key  # noqa: F401
+from .config import settings
+from .models import FileDigest, MediaBlob, MediaCacheEntry, TelegramFile
+
+
+def cache_root() -> str:
+    return os.path.join(settings.media_root, ".cache")
+
+
+def enabled() -> bool:
+    return settings.media_cache_max_bytes > 0
+
+
+def blob_path(sha256: str, ext: str) -> str:
+    return os.path.join(cache_root(), "blobs", sha256[:2], sha256 + ext)
+
+
+def lookup(db: Session, key: str):
+    """[(blob path, original name)] cached under key, or None on a miss."""
+    rows = (
+        db.query(MediaCacheEntry, MediaBlob)
+        .join(MediaBlob, MediaBlob.sha256 == MediaCacheEntry.sha256)
+        .filter(MediaCacheEntry.key == key)
+        .order_by(MediaCacheEntry.position)
+        .all()
+    )
+    if not rows:
+        return None
+    expired = key.startswith("url:") and settings.media_cache_ttl and \
+        rows[0][0].created_at < datetime.utcnow() - timedelta(seconds=settings.media_cache_ttl)
+    files = [(blob_path(blob.sha256, blob.ext), entry.name) for entry, blob in rows]
+    if expired or not all(os.path.isfile(p) for p, _ in files):
+        db.query(MediaCacheEntry).filter(MediaCacheEntry.key == key).delete(synchronize_session=False)
+        db.commit()
+        return None
+    now = datetime.utcnow()
+    for _, blob in rows:
+        blob.last_used = now
+    db.commit()
+    return files
+
+
+def materialize(db: Session, key: str, dest_dir: str):
+    """Hardlink the files cached under key into dest_dir; returns their paths or None."""
+    files = lookup(db, key)
+    if files is None:
+        return None
+    os.makedirs(dest_dir, exist_ok=True)
+    out = []
+    for blob, name in files:
+        dst = os.path.join(dest_dir, name)
+        if os.path.exists(dst) and os.path.samefile(blob, dst):
+            out.append(dst)
+            continue
+        if os.path.exists(dst):
+            dst = os.path.join(dest_dir, f"{os.path.basename(blob)[:8]}_{name}")
+        if not os.path.exists(dst):
+            link_or_copy(blob, dst)
+        _remember(db, dst, os.path.basename(blob)[:64])
+        out.append(dst)
+    db.commit()
+    return out
+
+
+def _remember(db: Session, path: str, sha256: str):
+    """Record the digest of path, a link or copy of the blob sha256, without hashing it again."""
+    st = os.stat(path)
+    row = db.get(FileDigest, path)
+    if row is None:
+        row = FileDigest(path=path)
+        db.add(row)
+    row.size, row.mtime_ns, row.sha256 = st.st_size, st.st_mtime_ns, sha256
+
+
+def _add_blob(db: Session, path: str):
+    # memoized by path: the send hashes the same file, and storage counts it as the blob's
+    sha256 = digest(db, path)
+    ext = os.path.splitext(path)[1].lower()
+    dst = blob_path(sha256, ext)
+    if not os.path.exists(dst):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        link_or_copy(path, tmp)
+        os.replace(tmp, dst)
+    blob = db.get(MediaBlob, sha256)
+    if blob is None:
+        blob = MediaBlob(sha256=sha256, ext=ext, size=os.path.getsize(dst))
+        db.add(blob)
+    blob.last_used = datetime.utcnow()
+    return sha256
+
+
+def store(db: Session, source_url, paths):
+    """Cache downloaded files under their source URL and each under its gallery-dl id.
+
+    source_url may be None to record only the per-file keys.
+    """
+    files = [(_add_blob(db, p), os.path.basename(p)) for p in paths]
+    keys = {}
+    if source_url is not None and files:
+        keys[url_key(source_url)] = files
+    for p, entry in zip(paths, files):
+        try:
+            with open(p + ".json", encoding="utf-8") as f:
+                key = gdl_key(json.load(f))
+        except (OSError, ValueError, AttributeError):
+            continue
+        if key:
+            keys[key] = [entry]
+    for key, entries in keys.items():
+        db.query(MediaCacheEntry).filter(MediaCacheEntry.key == key).delete(synchronize_session=False)
+        for i, (sha256, name) in enumerate(entries):
+            db.add(MediaCacheEntry(key=key, position=i, sha256=sha256, name=name))
+    db.commit()
+    evict(db)
+
+
+def evict(db: Session):
+    """Drop least recently used blobs until the cache fits media_cache_max_bytes."""
+    total = db.query(func.coalesce(func.sum(MediaBlob.size), 0)).scalar()
+    if total <= settings.media_cache_max_bytes:
+        return
+    victims = []
+    for blob in db.query(MediaBlob).order_by(MediaBlob.last_used).yield_per(500):
+        if total <= settings.media_cache_max_bytes:
+            break
+        victims.append((blob.sha256, blob.ext))
+        total -= blob.size
+    _drop(db, victims)
+
+
+def _drop(db: Session, blobs):
+    """Forget the (sha256, ext) blobs and delete their files."""
+    for sha256, _ in blobs:
+        # a key missing one of its files is no longer a usable hit
+        keys = db.query(MediaCacheEntry.key).filter(MediaCacheEntry.sha256 == sha256)
+        db.query(MediaCacheEntry).filter(MediaCacheEntry.key.in_(keys)).delete(synchronize_session=False)
+        db.query(MediaBlob).filter(MediaBlob.sha256 == sha256).delete(synchronize_session=False)
+    db.commit()
+    for sha256, ext in blobs:
+        try:
+            os.unlink(blob_path(sha256, ext))
+        except OSError:
+            pass
+
+
+def release(db: Session, path: str) -> int:
+    """Delete path, and the cache blob it is a hardlink of once nothing else links to it.
+
+    Returns the bytes this frees on disk: nothing while another job's file
+    or the cache still holds the same inode.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 0
+    blob = None
+    if st.st_nlink > 1:
+        row = db.get(MediaBlob, digest(db, path))
+        if row is not None:
+            candidate = blob_path(row.sha256, row.ext)
+            if os.path.exists(candidate) and os.path.samefile(candidate, path):
+                blob = (row.sha256, row.ext)
+    os.remove(path)
+    db.query(FileDigest).filter(FileDigest.path == path).delete(synchronize_session=False)
+    db.commit()
+    links = st.st_nlink - 1
+    if blob is not None and links == 1:
+        # only the cache held on to it: the blob goes with its last file
+        _drop(db, [blob])
+        links = 0
+    return st.st_size if links == 0 else 0
+
+
+def digest(db: Session, path: str) -> str:
+    """SHA-256 of path, memoized by path, size and mtime."""
+    st = os.stat(path)
+    row = db.get(FileDigest, path)
+    if row and row.size == st.st_size and row.mtime_ns == st.st_mtime_ns:
+        return row.sha256
+    sha256 = file_digest(path)
+    if row is None:
+        row = FileDigest(path=path)
+        db.add(row)
+    row.size, row.mtime_ns, row.sha256 = st.st_size, st.st_mtime_ns, sha256
+    db.commit()
+    return sha256
+
+
+def get_file_id(db: Session, sha256: str, sender: str):
+    row = db.get(TelegramFile, (sha256, sender))
+    return row.file_id if row else None
+
+
+def put_file_id(db: Session, sha256: str, sender: str, file_id: str):
+    row = db.get(TelegramFile, (sha256, sender))
+    if row is None:
+        db.add(TelegramFile(sha256=sha256, sender=sender, file_id=file_id))
+    else:
+        row.file_id = file_id
+    db.commit()
+
+
+def forget_file_id(db: Session, sha256: str, sender: str):
+    db.query(TelegramFile).filter(TelegramFile.sha256 == sha256, TelegramFile.sender == sender).delete()
+    db.commit()
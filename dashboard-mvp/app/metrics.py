@@ -0,0 +1,49 @@
+"""Dashboard side of the repository's metrics.py, which the Dockerfile copies to /app/metrics.py.
+
+The job and upload series, categories and helpers are the shared module's,
+so the bot and the dashboard report under the same names; this adds the
+per-chat throttle histogram and renders /metrics.
+"""
+import os
+from . import config  # noqa: F401  loads .env before the multiprocess dir is read
+
+# the web app and the Celery workers are separate processes: with
+# PROMETHEUS_MULTIPROC_DIR set (before prometheus_client is imported) they all
+# write their samples there and /metrics aggregates them
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from metrics import (  # noqa: E402,F401
+    BACKOFF_SECONDS,
+    DOWNLOAD_BYTES,
+    DOWNLOAD_SECONDS,
+    JOBS,
+    QUEUE_WAIT,
+    SECONDS,
+    UPLOAD_SECONDS,
+    UPLOAD_THROUGHPUT,
+    file_category,
+    observe_upload,
+    url_category,
+)
+
+SEND_THROTTLE_SECONDS = Histogram(
+    "telegram_send_throttle_seconds", "Time a send waited for the per-chat rate limit", buckets=SECONDS)
+
+
+def render():
+    """(body, content type) of the current samples for /metrics."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
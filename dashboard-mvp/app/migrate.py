@@ -0,0 +1,51 @@
+import logging
+from pathlib import Path
+from sqlalchemy import text
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+# pg_advisory_lock key, so only one process migrates at a time
+LOCK_ID = 74201
+
+log = logging.getLogger("migrate")
+
+
+def run(engine):
+    """Apply migrations/*.sql that are not in schema_migrations yet, in name order.
+
+    Migrations are PostgreSQL SQL; other databases only get create_all.
+    """
+    if engine.dialect.name != "postgresql":
+        return []
+    applied = []
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": LOCK_ID})
+        conn.commit()
+        try:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version TEXT PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+            ))
+            done = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+            conn.commit()
+            for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+                if path.stem in done:
+                    continue
+                log.info("applying migration %s", path.name)
+                conn.exec_driver_sql(path.read_text(encoding="utf-8"))
+                conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": path.stem})
+                conn.commit()
+                applied.append(path.stem)
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": LOCK_ID})
+            conn.commit()
+    return applied
+
+
+if __name__ == "__main__":
+    from .db import Base, engine
+    from . import models  # noqa: F401
+
+    logging.basicConfig(level=logging.INFO)
+    Base.metadata.create_all(bind=engine)
+    print("applied:", ", ".join(run(engine)) or "nothing")
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, Index
 from .db import Base
 
 
@@ -9,8 +9,11 @@ class MediaItem(Base):
     id = Column(Integer, primary_key=True, index=True)
     source_url = Column(Text, nullable=False)
     local_path = Column(Text, nullable=True)
+    # size of the file at local_path and when it was last downloaded or sent (storage GC)
+    size_bytes = Column(BigInteger, nullable=True)
+    last_accessed_at = Column(DateTime, nullable=True)
     filename = Column(String(512), nullable=True)
-    status = Column(String(50), nullable=False, default="queued")  # queued/downloading/downloaded/failed/sent/send_failed
+    status = Column(String(50), nullable=False, default="queued")  # queued/downloading/downloaded/failed/sent/send_failed/evicted
     selected = Column(Boolean, default=False)
     error_message = Column(Text, nullable=True)
     telegram_message_id = Column(String(100), nullable=True)
@@ -27,3 +30,52 @@ class JobHistory(Base):
     status = Column(String(32), nullable=False)  # ok/failed
     detail = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# kept in step with migrations/001_list_indexes.sql, which also adds the
+# pg_trgm index for URL search
+Index("ix_media_items_status_created_at", MediaItem.status, MediaItem.created_at.desc(), MediaItem.id.desc())
+Index("ix_media_items_created_at", MediaItem.created_at.desc(), MediaItem.id.desc())
+Index("ix_media_items_selected", MediaItem.id, postgresql_where=MediaItem.selected.is_(True))
+Index("ix_job_history_created_at", JobHistory.created_at.desc(), JobHistory.id.desc())
+# kept in step with migrations/002_media_storage.sql
+Index("ix_media_items_stored", MediaItem.last_accessed_at, MediaItem.id,
+      postgresql_where=MediaItem.local_path.isnot(None))
+
+
+class MediaBlob(Base):
+    __tablename__ = "media_blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    ext = Column(String(16), nullable=False, default="")
+    size = Column(BigInteger, nullable=False)
+    last_used = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class MediaCacheEntry(Base):
+    __tablename__ = "media_cache_entries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(Text, nullable=False, index=True)  # url:<source_url> or gdl:<category>:<id>[:<num>]
+    position = Column(Integer, nullable=False, default=0)
+    sha256 = Column(String(64), nullable=False, index=True)
+    name = Column(String(512), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class TelegramFile(Base):
+    __tablename__ = "telegram_files"
+
+    sha256 = Column(String(64), primary_key=True)
+    sender = Column(String(64), primary_key=True)  # bot:<bot id>, file_ids are only valid for the bot that got them
+    file_id = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class FileDigest(Base):
+    __tablename__ = "file_digests"
+
+    path = Column(Text, primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    mtime_ns = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=False)
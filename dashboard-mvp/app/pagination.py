@@ -0,0 +1,73 @@
+from datetime import datetime
+from sqlalchemy import tuple_
+from .ratelimit import get_redis
+
+COUNT_TTL = 60
+# searches stop counting here and show "10000+"
+COUNT_CAP = 10000
+
+
+def encode_cursor(row) -> str:
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, row_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError:
+        return None
+
+
+def keyset_page(query, model, page_size: int, after: str = "", before: str = ""):
+    """One page ordered by (created_at, id) descending.
+
+    Returns (rows, next_cursor, prev_cursor); a cursor is None when there is
+    nothing further in that direction.
+    """
+    key = tuple_(model.created_at, model.id)
+    newest_first = (model.created_at.desc(), model.id.desc())
+    after_key = decode_cursor(after) if after else None
+    before_key = decode_cursor(before) if before else None
+
+    if before_key:
+        rows = (
+            query.filter(key > tuple_(*before_key))
+            .order_by(model.created_at.asc(), model.id.asc())
+            .limit(page_size + 1)
+            .all()
+        )
+        has_prev = len(rows) > page_size
+        rows = list(reversed(rows[:page_size]))
+        has_next = True
+    else:
+        if after_key:
+            query = query.filter(key < tuple_(*after_key))
+        rows = query.order_by(*newest_first).limit(page_size + 1).all()
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = after_key is not None
+
+    next_cursor = encode_cursor(rows[-1]) if rows and has_next else None
+    prev_cursor = encode_cursor(rows[0]) if rows and has_prev else None
+    return rows, next_cursor, prev_cursor
+
+
+def cached_count(cache_key: str, query, capped: bool = False):
+    """Row count of query, cached in Redis for COUNT_TTL seconds.
+
+    With capped=True counting stops after COUNT_CAP rows; the result is then
+    returned as a string like "10000+".
+    """
+    r = get_redis()
+    key = f"count:{cache_key}"
+    cached = r.get(key)
+    if cached is not None:
+        return cached
+    if capped:
+        n = query.limit(COUNT_CAP + 1).count()
+        value = f"{COUNT_CAP}+" if n > COUNT_CAP else str(n)
+    else:
+        value = str(query.count())
+    r.set(key, value, ex=COUNT_TTL)
+    return value
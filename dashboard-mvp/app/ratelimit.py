@@ -0,0 +1,60 @@
+import time
+import redis
+from .config import settings
+
+_redis = None
+
+# Refill by elapsed time, then take one token if there is one. Returns 0 on
+# success, otherwise the seconds until a token will be available. Redis TIME
+# is used so workers on different hosts share one clock.
+_TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+def get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+    return _redis
+
+
+class TokenBucket:
+    """Token bucket kept in Redis, so every worker process draws from the same budget."""
+
+    def __init__(self, key: str, rate: float, burst: float):
+        self.key = key
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._script = get_redis().register_script(_TOKEN_BUCKET)
+
+    def try_acquire(self) -> float:
+        """Take a token; returns 0.0 on success or the seconds to wait before trying again."""
+        return float(self._script(keys=[self.key], args=[self.rate, self.burst]))
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+def chat_bucket(chat_id: str) -> TokenBucket:
+    return TokenBucket(f"tg:bucket:{chat_id}", settings.telegram_chat_rate, settings.telegram_chat_burst)
@@ -0,0 +1,167 @@
+"""Layout of MEDIA_ROOT and the garbage collector that keeps it under quota.
+
+Job directories are sharded by a hash of the item id,
+`MEDIA_ROOT/jobs/<h[:2]>/<h[2:4]>/<id>/`, so no directory holds more than a
+few dozen entries however large the library grows. Each MediaItem records
+the size of its file and when it was last used, which makes the eviction
+order an index query.
+
+The quota is checked against what MEDIA_ROOT takes on disk, summed from the
+index: the cache blobs plus the item files that are not hardlinks of one, so
+a linked file counts once. What the index does not see (sidecars, transcoder
+outputs, files copied across devices) is measured by `reconcile`, an
+occasional walk of MEDIA_ROOT, and added on. Evicting an item only frees its
+bytes once the cache blob goes with its last file.
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import and_, exists, func
+from sqlalchemy.orm import Session
+from . import media_cache
+from .config import settings
+from .models import FileDigest, JobHistory, MediaBlob, MediaItem
+from .ratelimit import get_redis
+
+# finished items whose files may go once they have been idle for storage_max_idle
+IDLE_EVICTABLE = ("downloaded", "failed", "send_failed")
+GC_BATCH = 500
+# bytes on disk the index does not account for, as of the last reconcile (may be negative)
+UNINDEXED_KEY = "storage:unindexed_bytes"
+
+
+def job_dir(media_item_id: int) -> str:
+    h = hashlib.md5(str(media_item_id).encode()).hexdigest()
+    return os.path.join(settings.media_root, "jobs", h[:2], h[2:4], str(media_item_id))
+
+
+def track(item: MediaItem, path: str):
+    """Point item at path and index its size."""
+    item.local_path = path
+    item.size_bytes = os.path.getsize(path)
+    item.last_accessed_at = datetime.utcnow()
+
+
+def touch(item: MediaItem):
+    item.last_accessed_at = datetime.utcnow()
+
+
+def indexed_usage(db: Session) -> int:
+    """Bytes of the cache blobs and of the stored item files that are not links of one."""
+    blobs = db.query(func.coalesce(func.sum(MediaBlob.size), 0)).scalar()
+    linked = exists().where(and_(FileDigest.path == MediaItem.local_path, FileDigest.sha256 == MediaBlob.sha256))
+    files = db.query(func.coalesce(func.sum(MediaItem.size_bytes), 0)).filter(
+        MediaItem.local_path.isnot(None), ~linked).scalar()
+    return int(blobs) + int(files)
+
+
+def usage(db: Session) -> int:
+    """What media_root takes: the index, corrected by the last reconcile."""
+    return indexed_usage(db) + int(get_redis().get(UNINDEXED_KEY) or 0)
+
+
+def disk_usage() -> int:
+    """Bytes of the files under media_root, each hardlinked inode counted once; walks the tree."""
+    seen = set()
+    total = 0
+    for directory, _, names in os.walk(settings.media_root):
+        for name in names:
+            try:
+                st = os.lstat(os.path.join(directory, name))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
+
+
+def evict(db: Session, item: MediaItem) -> int:
+    """Delete item's file and its metadata sidecar and mark it "evicted"; returns the bytes freed."""
+    path = item.local_path
+    freed = media_cache.release(db, path)
+    try:
+        freed += os.path.getsize(path + ".json")
+        os.remove(path + ".json")
+    except FileNotFoundError:
+        pass
+    directory = os.path.dirname(path)
+    if directory.startswith(os.path.join(settings.media_root, "jobs") + os.sep):
+        try:
+            # the job directory goes with its last file
+            os.rmdir(directory)
+        except OSError:
+            pass
+    # nothing left to send: batches and retries skip the item from now on
+    item.status = "evicted"
+    item.local_path = None
+    item.size_bytes = None
+    db.add(JobHistory(media_item_id=item.id, action="evict", status="ok", detail=path))
+    return freed
+
+
+def backfill(db: Session, limit: int = 10 * GC_BATCH) -> int:
+    """Index the size and last use of up to `limit` files recorded before they were tracked."""
+    items = db.query(MediaItem).filter(
+        MediaItem.local_path.isnot(None), MediaItem.size_bytes.is_(None)
+    ).limit(limit).all()
+    for item in items:
+        try:
+            item.size_bytes = os.path.getsize(item.local_path)
+        except OSError:
+            item.local_path = None
+        if item.last_accessed_at is None:
+            item.last_accessed_at = item.updated_at or item.created_at
+    db.commit()
+    return len(items)
+
+
+def reconcile(db: Session) -> dict:
+    """Walk media_root and record how far its real usage is from the index."""
+    backfill(db)
+    indexed = indexed_usage(db)
+    real = disk_usage()
+    get_redis().set(UNINDEXED_KEY, real - indexed)
+    return {"indexed": indexed, "disk": real, "unindexed": real - indexed}
+
+
+def _candidates(db: Session, idle_before):
+    q = db.query(MediaItem).filter(MediaItem.local_path.isnot(None))
+    if idle_before is None:
+        q = q.filter(MediaItem.status == "sent")
+    else:
+        q = q.filter(MediaItem.status.in_(IDLE_EVICTABLE), MediaItem.last_accessed_at < idle_before)
+    return q.order_by(MediaItem.last_accessed_at, MediaItem.id).limit(GC_BATCH).all()
+
+
+def collect_garbage(db: Session) -> dict:
+    """Evict files until usage is under storage_quota_bytes.
+
+    Sent items go first, least recently used first, then items of any other
+    finished status that have not been used for storage_max_idle seconds.
+    Queued and downloading items are never touched.
+    """
+    quota = settings.storage_quota_bytes
+    backfill(db)
+    used = usage(db)
+    stats = {"before": used, "evicted": 0, "freed": 0}
+    if quota <= 0 or used <= quota:
+        stats["after"] = used
+        return stats
+
+    idle_before = datetime.utcnow() - timedelta(seconds=settings.storage_max_idle)
+    for phase in (None, idle_before):
+        while used > quota:
+            items = _candidates(db, phase)
+            if not items:
+                break
+            for item in items:
+                if used <= quota:
+                    break
+                freed = evict(db, item)
+                used -= freed
+                stats["evicted"] += 1
+                stats["freed"] += freed
+            db.commit()
+    stats["after"] = used
+    return stats
@@ -1,17 +1,51 @@
 import os
-import subprocess
-import requests
+import shutil
+import time
+from datetime import datetime
+from sqlalchemy import and_
 from sqlalchemy.orm import Session
+from . import batches, downloader, events, media_cache, metrics, storage, telegram_upload, transcode
 from .celery_app import celery_app
 from .config import settings
 from .db import SessionLocal
 from .models import MediaItem, JobHistory
+from .ratelimit import chat_bucket
 
 
 def _db() -> Session:
     return SessionLocal()
 
 
+def _record_files(db: Session, item: MediaItem, paths: list, detail: str):
+    """Attach the first file to item and create one MediaItem per further file."""
+    items = [item]
+    for path in paths[1:]:
+        extra = MediaItem(source_url=item.source_url, selected=item.selected)
+        db.add(extra)
+        items.append(extra)
+    for it, path in zip(items, paths):
+        storage.track(it, path)
+        it.filename = os.path.basename(path)
+        it.status = "downloaded"
+        it.error_message = None
+    db.flush()
+    db.add_all([
+        JobHistory(media_item_id=it.id, action="download", status="ok", detail=f"{detail}: {it.local_path}")
+        for it in items
+    ])
+    db.commit()
+    for it in items:
+        events.item_status(it)
+
+
+def _fail_download(db: Session, item: MediaItem, error: str):
+    item.status = "failed"
+    item.error_message = error[:4000]
+    db.add(JobHistory(media_item_id=item.id, action="download", status="failed", detail=item.error_message))
+    db.commit()
+    events.item_status(item)
+
+
 @celery_app.task(name="tasks.download_media")
 def download_media(media_item_id: int):
     db = _db()
@@ -19,48 +53,144 @@ def download_media(media_item_id: int):
         item = db.query(MediaItem).filter(MediaItem.id == media_item_id).first()
         if not item:
             return
+        category = metrics.url_category(item.source_url)
+        if item.created_at:
+            metrics.QUEUE_WAIT.labels(category).observe((datetime.utcnow() - item.created_at).total_seconds())
         item.status = "downloading"
         db.commit()
+        events.item_status(item)
 
-        os.makedirs(settings.media_root, exist_ok=True)
-        output_template = os.path.join(settings.media_root, "%(title)s_%(id)s.%(ext)s")
-        cmd = [settings.gallery_dl_binary, "-o", f"filename={output_template}", item.source_url]
+        directory = storage.job_dir(item.id)
+        if media_cache.enabled():
+            cached = media_cache.materialize(db, media_cache.url_key(item.source_url), directory)
+            if cached:
+                _record_files(db, item, cached, "cache")
+                metrics.JOBS.labels(category, "cached").inc()
+                return
 
-        proc = subprocess.run(cmd, capture_output=True, text=True)
-        if proc.returncode != 0:
-            item.status = "failed"
-            item.error_message = proc.stderr[:4000]
-            db.add(JobHistory(media_item_id=item.id, action="download", status="failed", detail=item.error_message))
-            db.commit()
+        started = time.monotonic()
+        try:
+            result = downloader.run_gallery_dl(
+                item.source_url, directory, on_progress=events.Progress(item.id, "download")
+            )
+        except downloader.DownloadTimeout as e:
+            metrics.DOWNLOAD_SECONDS.labels(category, "timeout").observe(time.monotonic() - started)
+            metrics.JOBS.labels(category, "timeout").inc()
+            _fail_download(db, item, str(e))
+            shutil.rmtree(directory, ignore_errors=True)
             return
 
-        # naive output parsing fallback
-        out = (proc.stdout or "").strip().splitlines()
-        guessed_file = None
-        for line in reversed(out):
-            if os.path.exists(line.strip()):
-                guessed_file = line.strip()
-                break
+        outcome = "failed" if not result.files else "ok" if result.returncode == 0 else "partial"
+        metrics.DOWNLOAD_SECONDS.labels(category, outcome).observe(time.monotonic() - started)
+        metrics.JOBS.labels(category, outcome).inc()
+        if not result.files:
+            _fail_download(db, item, result.log if result.returncode != 0 else "Download finished but no file was produced")
+            shutil.rmtree(directory, ignore_errors=True)
+            return
+        metrics.DOWNLOAD_BYTES.labels(category).observe(sum(os.path.getsize(p) for p in result.files))
+        # a non-zero exit with files on disk means some of the post's files failed
+        _record_files(db, item, result.files, "download" if result.returncode == 0 else f"partial (exit {result.returncode})")
 
-        if not guessed_file:
-            candidates = sorted(
-                [os.path.join(settings.media_root, f) for f in os.listdir(settings.media_root)],
-                key=os.path.getmtime,
-                reverse=True,
-            )
-            guessed_file = candidates[0] if candidates else None
-
-        item.local_path = guessed_file
-        item.filename = os.path.basename(guessed_file) if guessed_file else None
-        item.status = "downloaded" if guessed_file else "failed"
-        if not guessed_file:
-            item.error_message = "Download finished but file not detected"
-        db.add(JobHistory(media_item_id=item.id, action="download", status="ok" if guessed_file else "failed", detail=item.local_path or item.error_message))
-        db.commit()
+        if media_cache.enabled():
+            try:
+                # the URL key only for complete results, the per-file keys from the sidecars always
+                media_cache.store(db, item.source_url if result.returncode == 0 else None, result.files)
+            except Exception:
+                db.rollback()
     finally:
         db.close()
 
 
+def _result_file_id(message: dict):
+    for kind in ("document", "video", "animation", "audio"):
+        if kind in message:
+            return message[kind].get("file_id")
+    if message.get("photo"):
+        return message["photo"][-1].get("file_id")
+    return None
+
+
+def _fail_send(db: Session, item: MediaItem, error: str):
+    item.status = "send_failed"
+    item.error_message = error[:4000]
+    db.add(JobHistory(media_item_id=item.id, action="send", status="failed", detail=item.error_message))
+    db.commit()
+    events.item_status(item)
+    return False
+
+
+def _send_item(db: Session, item: MediaItem) -> bool:
+    """Send one downloaded item, recording the outcome on it; returns True when sent."""
+    try:
+        return _send_local(db, item)
+    except Exception as e:
+        # MTProto, transcode and I/O errors fail this item only, never the rest of its batch
+        db.rollback()
+        return _fail_send(db, item, f"{e.__class__.__name__}: {e}")
+
+
+def _send_local(db: Session, item: MediaItem) -> bool:
+    if not item.local_path or not os.path.exists(item.local_path):
+        return _fail_send(db, item, "File not found")
+
+    token = settings.telegram_bot_token
+    chat_id = settings.telegram_chat_id
+    if not token or not chat_id:
+        return _fail_send(db, item, "Telegram config missing")
+
+    path = transcode.prepare(item.local_path)
+    try:
+        return _send_file(db, item, path, token, chat_id)
+    finally:
+        if path != item.local_path:
+            # a hardlink of the transcoder's cached output
+            os.remove(path)
+
+
+def _send_file(db: Session, item: MediaItem, path: str, token: str, chat_id: str) -> bool:
+    sender = "bot:" + token.split(":")[0]
+    sha256 = media_cache.digest(db, path)
+    file_id = media_cache.get_file_id(db, sha256, sender)
+    category = metrics.file_category(item.local_path, metrics.url_category(item.source_url))
+    result = None
+    error = None
+    waited = time.monotonic()
+    chat_bucket(chat_id).acquire()
+    metrics.SEND_THROTTLE_SECONDS.observe(time.monotonic() - waited)
+    # not a stored status: only the live view shows it
+    events.publish("status", id=item.id, status="sending", filename=item.filename, error=None)
+    if file_id:
+        # sent before: Telegram already has the bytes
+        try:
+            result = telegram_upload.run(telegram_upload.send_document(chat_id, file_id=file_id, category=category))
+        except telegram_upload.TelegramError as e:
+            if e.status_code == 400:
+                media_cache.forget_file_id(db, sha256, sender)
+            else:
+                error = e.description
+    if result is None and error is None:
+        try:
+            result = telegram_upload.run(telegram_upload.send_document(
+                chat_id, path=path, progress=events.Progress(item.id, "upload"), category=category
+            ))
+        except telegram_upload.TelegramError as e:
+            error = e.description
+    if result is None:
+        return _fail_send(db, item, error)
+
+    new_file_id = _result_file_id(result)
+    if new_file_id and new_file_id != file_id:
+        media_cache.put_file_id(db, sha256, sender, new_file_id)
+    item.status = "sent"
+    storage.touch(item)
+    item.telegram_message_id = str(result.get("message_id"))
+    item.error_message = None
+    db.add(JobHistory(media_item_id=item.id, action="send", status="ok", detail=item.telegram_message_id))
+    db.commit()
+    events.item_status(item)
+    return True
+
+
 @celery_app.task(name="tasks.send_to_telegram")
 def send_to_telegram(media_item_id: int):
     db = _db()
@@ -68,36 +198,82 @@ def send_to_telegram(media_item_id: int):
         item = db.query(MediaItem).filter(MediaItem.id == media_item_id).first()
         if not item:
             return
-        if not item.local_path or not os.path.exists(item.local_path):
-            item.status = "send_failed"
-            item.error_message = "File not found"
-            db.add(JobHistory(media_item_id=item.id, action="send", status="failed", detail=item.error_message))
-            db.commit()
-            return
+        _send_item(db, item)
+    finally:
+        db.close()
 
-        token = settings.telegram_bot_token
-        chat_id = settings.telegram_chat_id
-        if not token or not chat_id:
-            item.status = "send_failed"
-            item.error_message = "Telegram config missing"
-            db.add(JobHistory(media_item_id=item.id, action="send", status="failed", detail=item.error_message))
-            db.commit()
-            return
 
-        url = f"https://api.telegram.org/bot{token}/sendDocument"
-        with open(item.local_path, "rb") as f:
-            resp = requests.post(url, data={"chat_id": chat_id}, files={"document": f}, timeout=120)
-
-        if resp.ok and resp.json().get("ok"):
-            result = resp.json().get("result", {})
-            item.status = "sent"
-            item.telegram_message_id = str(result.get("message_id"))
-            item.error_message = None
-            db.add(JobHistory(media_item_id=item.id, action="send", status="ok", detail=item.telegram_message_id))
-        else:
-            item.status = "send_failed"
-            item.error_message = resp.text[:4000]
-            db.add(JobHistory(media_item_id=item.id, action="send", status="failed", detail=item.error_message))
-        db.commit()
+def send_filter(mode: str):
+    """Rows a batch of the given mode sends: "selected" or "retry" (failed sends)."""
+    if mode == "retry":
+        return MediaItem.status == "send_failed"
+    return and_(MediaItem.selected.is_(True), MediaItem.status.in_(["downloaded", "send_failed"]))
+
+
+@celery_app.task(name="tasks.dispatch_send_batch")
+def dispatch_send_batch(batch_id: str, mode: str):
+    """Walk the matching ids by keyset and queue them as chunk tasks."""
+    db = _db()
+    try:
+        last_id = 0
+        while True:
+            ids = [
+                row.id
+                for row in db.query(MediaItem.id)
+                .filter(send_filter(mode), MediaItem.id > last_id)
+                .order_by(MediaItem.id)
+                .limit(settings.send_batch_chunk)
+            ]
+            if not ids:
+                break
+            last_id = ids[-1]
+            if mode == "retry":
+                db.bulk_save_objects([
+                    JobHistory(media_item_id=i, action="retry", status="ok", detail=f"Retry queued (batch {batch_id})")
+                    for i in ids
+                ])
+                db.commit()
+            batches.add_total(batch_id, len(ids))
+            send_batch_chunk.delay(batch_id, mode, ids)
+        batches.mark_dispatched(batch_id)
+    finally:
+        db.close()
+
+
+@celery_app.task(name="tasks.send_batch_chunk")
+def send_batch_chunk(batch_id: str, mode: str, ids: list):
+    db = _db()
+    try:
+        items = {
+            item.id: item
+            for item in db.query(MediaItem).filter(MediaItem.id.in_(ids), send_filter(mode))
+        }
+        for media_item_id in ids:
+            item = items.get(media_item_id)
+            if item is None:
+                # sent, deselected or deleted since the batch was dispatched
+                batches.record(batch_id, "skipped")
+                continue
+            batches.record(batch_id, "sent" if _send_item(db, item) else "failed")
+    finally:
+        db.close()
+
+
+@celery_app.task(name="tasks.storage_gc")
+def storage_gc():
+    """Periodic (celery beat): evict files until MEDIA_ROOT is under the storage quota."""
+    db = _db()
+    try:
+        return storage.collect_garbage(db)
+    finally:
+        db.close()
+
+
+@celery_app.task(name="tasks.storage_reconcile")
+def storage_reconcile():
+    """Periodic (celery beat): measure MEDIA_ROOT on disk against the index the GC sums."""
+    db = _db()
+    try:
+        return storage.reconcile(db)
     finally:
         db.close()
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import threading
+import time
+import httpx
+from . import metrics
+from .config import settings
+
+# Bot API refuses uploads above 50 MB; bigger files go through MTProto
+BOT_API_LIMIT = 50 * 1024 * 1024
+MAX_ATTEMPTS = 5
+
+_loop = None
+_loop_lock = threading.Lock()
+_client = None
+_mtproto = None
+_mtproto_lock = None
+
+
+class TelegramError(Exception):
+    def __init__(self, description, status_code=None):
+        super().__init__(description)
+        self.description = description
+        self.status_code = status_code
+
+
+class _ProgressFile:
+    """Read-through file wrapper that reports how much httpx has read of it."""
+
+    def __init__(self, f, callback):
+        self._f = f
+        self._callback = callback
+        self._total = os.fstat(f.fileno()).st_size
+        self._done = 0
+
+    def read(self, size=-1):
+        chunk = self._f.read(size)
+        self._done += len(chunk)
+        self._callback(self._done, self._total)
+        return chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        pos = self._f.seek(offset, whence)
+        self._done = pos
+        return pos
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def _get_loop():
+    """One event loop thread per worker process, shared by every task thread."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="telegram-upload", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def run(coro):
+    """Run coro on the upload loop and block the calling task thread until it is done."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        # pooled keep-alive connections reused by all uploads of this process;
+        # the write timeout applies per chunk, so long uploads never time out as a whole
+        _client = httpx.AsyncClient(
+            base_url=settings.telegram_api_url,
+            timeout=httpx.Timeout(30.0, write=120.0, pool=None),
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        )
+    return _client
+
+
+async def bot_api(method: str, data: dict, path: str = None, field: str = "document", progress=None,
+                  category: str = "other"):
+    """Call a Bot API method, streaming path from disk as field when given.
+
+    progress(sent, total) is called as the file is read for the upload.
+    Waits out 429 responses for the retry_after Telegram asks for; the
+    waits are recorded under category.
+    Returns the result object or raises TelegramError.
+    """
+    url = f"/bot{settings.telegram_bot_token}/{method}"
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            if path:
+                # httpx streams file objects in chunks with a precomputed Content-Length
+                with open(path, "rb") as f:
+                    if progress is not None:
+                        f = _ProgressFile(f, progress)
+                    resp = await _get_client().post(url, data=data, files={field: (os.path.basename(path), f)})
+            else:
+                resp = await _get_client().post(url, data=data)
+        except httpx.TransportError as e:
+            if attempt == MAX_ATTEMPTS:
+                raise TelegramError(f"{e.__class__.__name__}: {e}") from e
+            await asyncio.sleep(attempt)
+            continue
+
+        try:
+            payload = resp.json()
+        except ValueError:
+            payload = {"ok": False, "description": resp.text[:4000]}
+        if payload.get("ok"):
+            return payload.get("result", {})
+        if resp.status_code == 429 and attempt < MAX_ATTEMPTS:
+            wait = (payload.get("parameters") or {}).get("retry_after", attempt)
+            metrics.BACKOFF_SECONDS.labels(category).observe(wait)
+            await asyncio.sleep(wait)
+            continue
+        raise TelegramError(payload.get("description") or resp.text[:4000], resp.status_code)
+
+
+async def _get_mtproto():
+    global _mtproto, _mtproto_lock
+    if not (settings.telegram_api_id and settings.telegram_api_hash and settings.telegram_string_session):
+        raise TelegramError(f"file is larger than {BOT_API_LIMIT // 1048576} MB and MTProto is not configured")
+    if _mtproto_lock is None:
+        _mtproto_lock = asyncio.Lock()
+    async with _mtproto_lock:
+        if _mtproto is None:
+            from telethon import TelegramClient
+            from telethon.sessions import StringSession
+
+            client = TelegramClient(
+                StringSession(settings.telegram_string_session),
+                int(settings.telegram_api_id),
+                settings.telegram_api_hash,
+            )
+            await client.connect()
+            _mtproto = client
+    return _mtproto
+
+
+async def send_mtproto(chat_id: str, path: str, progress=None):
+    client = await _get_mtproto()
+    try:
+        entity = await client.get_input_entity(int(chat_id))
+    except ValueError:
+        # a fresh session knows no entities yet; dialogs fill the cache
+        await client.get_dialogs()
+        entity = await client.get_input_entity(int(chat_id))
+    msg = await client.send_file(entity, path, force_document=True, part_size_kb=512, progress_callback=progress)
+    return {"message_id": msg.id}
+
+
+async def send_document(chat_id: str, path: str = None, file_id: str = None, progress=None,
+                        category: str = "other"):
+    """Send a file by file_id, by Bot API upload, or over MTProto when it is too big for the Bot API.
+
+    The time taken, 429 waits included, is recorded per transport under category.
+    """
+    started = time.monotonic()
+    if file_id:
+        result = await bot_api("sendDocument", {"chat_id": chat_id, "document": file_id}, category=category)
+        metrics.observe_upload(category, "file_id", 0, time.monotonic() - started)
+        return result
+    size = os.path.getsize(path)
+    if size > BOT_API_LIMIT:
+        result = await send_mtproto(chat_id, path, progress)
+        transport = "mtproto"
+    else:
+        result = await bot_api("sendDocument", {"chat_id": chat_id}, path=path, progress=progress, category=category)
+        transport = "bot_api"
+    metrics.observe_upload(category, transport, size, time.monotonic() - started)
+    return result
@@ -0,0 +1,52 @@
+"""Optional transcode of videos before they are sent, through the repository's transcoder.py.
+
+transcoder.py runs every ffmpeg job of a process through one bounded pool and
+caches its outputs by input hash and profile; the Dockerfile copies it into
+the image. Without it, or with TRANSCODE_PROFILE empty, files are sent as
+they were downloaded.
+"""
+import logging
+import os
+import threading
+from .config import settings
+
+try:
+    import transcoder
+except ImportError:
+    transcoder = None
+
+log = logging.getLogger("transcode")
+
+VIDEO_EXTS = {".mp4", ".m4v", ".mov", ".mkv", ".webm", ".avi", ".ts"}
+
+_transcoder = None
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(settings.transcode_profile) and transcoder is not None
+
+
+def _get():
+    global _transcoder
+    with _lock:
+        if _transcoder is None:
+            _transcoder = transcoder.Transcoder(
+                os.path.join(settings.media_root, ".cache", "transcoded"),
+                settings.transcode_cache_max_bytes,
+            )
+    return _transcoder
+
+
+def prepare(path: str):
+    """Path of the file to send for path; a new file the caller removes, or path itself."""
+    if not enabled() or os.path.splitext(path)[1].lower() not in VIDEO_EXTS:
+        return path
+    profile = settings.transcode_profile
+    stem = os.path.splitext(path)[0]
+    try:
+        out, _, _ = _get().run(path, profile, f"{stem}.{profile.replace(':', '-')}.mp4")
+    except transcoder.TranscodeError as e:
+        log.warning("transcode of %s failed, sending the original: %s", path, e)
+        return path
+    return str(out)
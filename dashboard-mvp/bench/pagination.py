@@ -0,0 +1,94 @@
+"""OFFSET vs keyset pagination, counts and URL search on a seeded media_items table.
+
+usage: DATABASE_URL=postgresql+psycopg2://... python bench/pagination.py [rows]
+
+Seeds `rows` (default 1,000,000) media_items with generate_series when the
+table holds fewer, applies the migrations, then times each query shape
+with EXPLAIN ANALYZE. Use a throwaway database: the rows are left in place
+so reruns skip seeding.
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+
+from app import models  # noqa: E402,F401
+from app.db import Base, engine  # noqa: E402
+from app.migrate import run as run_migrations  # noqa: E402
+
+PAGE_SIZE = 10
+STATUSES = ["queued", "downloading", "downloaded", "failed", "sent", "send_failed"]
+
+
+def seed(conn, rows):
+    have = conn.execute(text("SELECT count(*) FROM media_items")).scalar()
+    if have >= rows:
+        return have
+    started = time.perf_counter()
+    conn.execute(text(
+        "INSERT INTO media_items (source_url, status, selected, created_at, updated_at) "
+        "SELECT 'https://example' || (n % 97) || '.com/post/' || n || '/' || md5(n::text), "
+        "(ARRAY[:s0, :s1, :s2, :s3, :s4, :s5])[1 + (n % 6)], n % 50 = 0, "
+        "now() - (n || ' seconds')::interval, now() "
+        "FROM generate_series(:lo, :hi) AS n"
+    ), {**{f"s{i}": s for i, s in enumerate(STATUSES)}, "lo": have + 1, "hi": rows})
+    conn.commit()
+    conn.execute(text("ANALYZE media_items"))
+    conn.commit()
+    print(f"seeded {rows - have} rows in {time.perf_counter() - started:.1f}s")
+    return rows
+
+
+def explain(conn, sql, params=None):
+    plan = conn.execute(text("EXPLAIN (ANALYZE, FORMAT TEXT) " + sql), params or {}).scalars().all()
+    ms = float(re.search(r"Execution Time: ([\d.]+) ms", plan[-1]).group(1))
+    scan = next((line.strip() for line in plan if "Scan" in line), plan[0].strip())
+    return ms, scan.split("  (")[0]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    if engine.dialect.name != "postgresql":
+        print("this benchmark needs PostgreSQL (DATABASE_URL)")
+        return 2
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        total = seed(conn, rows)
+        deep = (total // 2) // PAGE_SIZE * PAGE_SIZE
+        cursor = conn.execute(text(
+            "SELECT created_at, id FROM media_items WHERE status = 'sent' "
+            "ORDER BY created_at DESC, id DESC OFFSET :o LIMIT 1"), {"o": deep // 6}).one()
+
+        cases = [
+            ("offset, page 1",
+             "SELECT * FROM media_items WHERE status = 'sent' ORDER BY created_at DESC, id DESC LIMIT 11", {}),
+            (f"offset, row {deep // 6}",
+             "SELECT * FROM media_items WHERE status = 'sent' ORDER BY created_at DESC, id DESC "
+             "OFFSET :o LIMIT 11", {"o": deep // 6}),
+            (f"keyset, row {deep // 6}",
+             "SELECT * FROM media_items WHERE status = 'sent' AND (created_at, id) < (:c, :i) "
+             "ORDER BY created_at DESC, id DESC LIMIT 11", {"c": cursor[0], "i": cursor[1]}),
+            ("count(*) all", "SELECT count(*) FROM media_items", {}),
+            ("count(*) status", "SELECT count(*) FROM media_items WHERE status = 'sent'", {}),
+            ("search ilike page",
+             "SELECT * FROM media_items WHERE source_url ILIKE :q ORDER BY created_at DESC, id DESC LIMIT 11",
+             {"q": "%example42.com/post/12%"}),
+            ("search capped count",
+             "SELECT count(*) FROM (SELECT 1 FROM media_items WHERE source_url ILIKE :q LIMIT 10001) s",
+             {"q": "%example42.com/post/12%"}),
+        ]
+        print(f"{total} rows")
+        for label, sql, params in cases:
+            ms, scan = explain(conn, sql, params)
+            print(f"  {label:<24} {ms:10.2f} ms  {scan}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
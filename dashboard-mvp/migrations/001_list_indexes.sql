@@ -0,0 +1,12 @@
+-- Indexes behind keyset pagination, status filters and URL search.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_media_items_status_created_at ON media_items (status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_media_items_created_at ON media_items (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_media_items_selected ON media_items (id) WHERE selected;
+CREATE INDEX IF NOT EXISTS ix_media_items_source_url_trgm ON media_items USING gin (source_url gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ix_job_history_created_at ON job_history (created_at DESC, id DESC);
+
+ANALYZE media_items;
+ANALYZE job_history;
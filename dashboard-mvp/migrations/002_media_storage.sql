@@ -0,0 +1,9 @@
+-- Per-file size and last use for the storage GC (app/storage.py).
+ALTER TABLE media_items ADD COLUMN IF NOT EXISTS size_bytes BIGINT;
+ALTER TABLE media_items ADD COLUMN IF NOT EXISTS last_accessed_at TIMESTAMP;
+
+-- sizes are filled in by the GC task itself, it has to stat the files anyway
+UPDATE media_items SET last_accessed_at = COALESCE(updated_at, created_at)
+WHERE local_path IS NOT NULL AND last_accessed_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_media_items_stored ON media_items (last_accessed_at, id) WHERE local_path IS NOT NULL;
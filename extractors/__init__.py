@@ -1 +1,16 @@
 # custom gallery-dl extractors package
+import importlib.util
+from pathlib import Path
+
+DIRECTORY = Path(__file__).resolve().parent
+
+
+def register(extractor, directory=DIRECTORY):
+    """Add the extractor modules in `directory` to gallery_dl.extractor `extractor`."""
+    for path in sorted(Path(directory).glob("*.py")):
+        if path.name.startswith("_"):
+            continue
+        spec = importlib.util.spec_from_file_location(f"gdl_external_{path.stem}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        extractor.add_module(module)
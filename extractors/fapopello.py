@@ -2,60 +2,117 @@ from gallery_dl.extractor.common import Extractor, Message
 from gallery_dl import util
 import os
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+import codecs
+import json
+import sqlite3
 import re
 
+POST_BODY_START = '<div class="post-body">'
+POST_BODY_END = "</div>"
+MEDIA_SRC = re.compile(r'src="([^"]+\.(?:jpg|jpeg|png|mp4|webm|webp))"')
+POST_LINK = re.compile(r'href="(/p/(\d+)/[^"]+)"')
+NEXT_LINK = re.compile(r'class="next" href="([^"]+)"')
+
 
 class FapopelloExtractor(Extractor):
     """Extractor for fapopello.com (External Version)"""
     category = "fapopello"
+    root = "https://fapopello.com"
     filename_fmt = "{category}_{user}_{post_id}_{index}.{extension}"
     directory_fmt = ("{category}", "{user}")
     pattern = r"https?://(?:www\.)?fapopello\.com/u/[^/]+/[^/]+/(?P<user>[^/?#]+)"
     example = "https://fapopello.com/u/onlyfans/319076/consuelo_hotwife"
 
     def items(self):
-        url = self.url
         user = self.groups[0]
         metadata = self.metadata(user)
+        workers = max(1, self.config("workers", 4))
+        index = self._crawl_index()
+        known_run = max(1, self.config("known-run", 3))
+        # stopping at indexed posts is only safe when an earlier crawl went
+        # all the way down the listing; the flag is cleared until this crawl
+        # has done the same, so a crawl cut short cannot leave a gap behind
+        complete = index.begin(user) if index else False
+
+        # post pages are fetched by a bounded pool, one extra thread
+        # prefetches the next gallery page while the current one resolves
+        pool = ThreadPoolExecutor(max_workers=workers + 1)
+        stop_at = None
+        try:
+            page = pool.submit(self._fetch_page, self.url)
+            while page:
+                page_data = page.result()
 
-        while url:
-            self.log.info("Fetching gallery page: %s", url)
-            page_data = self.request(url).text
+                # Find posts and IDs; new posts are listed first, so a run
+                # of already indexed posts means the rest is indexed as well
+                posts = []
+                run = 0
+                for path, post_id in POST_LINK.findall(page_data):
+                    post_url = self.root + path
+                    media = index.get(user, post_id) if index else None
+                    if media is None:
+                        run = 0
+                        posts.append((post_url, post_id, pool.submit(
+                            self._post_media_urls, post_url)))
+                    else:
+                        run += 1
+                        posts.append((post_url, post_id, media))
+                        if complete and run >= known_run:
+                            stop_at = post_id
+                            break
 
-            # Find posts and IDs
-            post_links = re.findall(r'href="(/p/(\d+)/[^"]+)"', page_data)
+                # Pagination
+                next_match = NEXT_LINK.search(page_data)
+                if next_match and stop_at is None:
+                    page = pool.submit(
+                        self._fetch_page, self.root + next_match.group(1))
+                else:
+                    page = None
 
-            for path, post_id in post_links:
-                post_url = "https://fapopello.com" + path
-                yield Message.Directory, None, {"user": user}
-                yield from self._extract_post_media(post_url, user, post_id, metadata)
+                # results are consumed in listing order, whatever order they finish in
+                for post_url, post_id, media in posts:
+                    if not isinstance(media, list):
+                        media = media.result()
+                        if index:
+                            index.add(user, post_id, post_url, media)
+                    yield Message.Directory, None, {"user": user}
+                    yield from self._extract_post_media(media, user, post_id, metadata)
 
-            # Pagination
-            next_match = re.search(r'class="next" href="([^"]+)"', page_data)
-            if next_match:
-                url = "https://fapopello.com" + next_match.group(1)
-            else:
-                url = None
+            if stop_at is not None:
+                self.log.info("Reached indexed posts at %s, serving the rest from %s",
+                              stop_at, index.path)
+                for post_id, media in index.older(user, stop_at):
+                    yield Message.Directory, None, {"user": user}
+                    yield from self._extract_post_media(media, user, post_id, metadata)
+            if index:
+                index.finish(user)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
 
     def metadata(self, user=None):
         return {"user": user or self.groups[0]}
 
-    def _extract_post_media(self, post_url, user, post_id, metadata):
-        post_data = self.request(post_url).text
-        body_match = re.search(r'<div class="post-body">(.*?)</div>', post_data, re.DOTALL)
-        if not body_match:
-            return
+    def _crawl_index(self):
+        path = self.config("index", "~/.cache/gallery-dl/fapopello.sqlite3")
+        if not path:
+            return None
+        return CrawlIndex(util.expand_path(path))
 
-        content = body_match.group(1)
-        media_urls = re.findall(r'src="([^"]+\.(?:jpg|jpeg|png|mp4|webm|webp))"', content)
+    def _fetch_page(self, url):
+        self.log.info("Fetching gallery page: %s", url)
+        return self.request(url).text
 
-        unique_media = []
-        for m in media_urls:
-            if m not in unique_media:
-                unique_media.append(m)
+    def _post_media_urls(self, post_url):
+        response = self.request(post_url, stream=True)
+        try:
+            return [urljoin(post_url, m)
+                    for m in iter_post_media(iter_text(response))]
+        finally:
+            response.close()
 
-        for index, media_url in enumerate(unique_media):
-            media_url = urljoin(post_url, media_url)
+    def _extract_post_media(self, media_urls, user, post_id, metadata):
+        for index, media_url in enumerate(media_urls):
             filename, extension = os.path.splitext(media_url)
             extension = extension.lstrip('.')
             data = {
@@ -68,3 +125,104 @@ class FapopelloExtractor(Extractor):
             if isinstance(metadata, dict):
                 data.update(metadata)
             yield Message.Url, media_url, data
+
+
+def iter_text(response, chunk_size=16384):
+    """Decode a streamed response chunk by chunk"""
+    decoder = codecs.getincrementaldecoder(
+        response.encoding or "utf-8")(errors="replace")
+    for chunk in response.iter_content(chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", True)
+
+
+def iter_post_media(chunks):
+    """Yield the unique media 'src' values of the first post-body <div>
+
+    Only as much of 'chunks' is consumed as it takes to reach the end
+    of the post body.
+    """
+    seen = set()
+    buf = ""
+    inside = False
+    for chunk in chunks:
+        buf += chunk
+        if not inside:
+            start = buf.find(POST_BODY_START)
+            if start < 0:
+                buf = buf[-len(POST_BODY_START) + 1:]
+                continue
+            buf = buf[start + len(POST_BODY_START):]
+            inside = True
+
+        end = buf.find(POST_BODY_END)
+        if end >= 0:
+            body = buf[:end]
+        else:
+            # hold back the last, possibly incomplete tag
+            cut = buf.rfind("<")
+            if cut < 0:
+                cut = len(buf)
+            body, buf = buf[:cut], buf[cut:]
+
+        for media_url in MEDIA_SRC.findall(body):
+            if media_url not in seen:
+                seen.add(media_url)
+                yield media_url
+        if end >= 0:
+            return
+
+
+class CrawlIndex():
+    """Persistent per-user record of resolved posts and their media URLs"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS posts ("
+            "user TEXT NOT NULL, post_id INTEGER NOT NULL, "
+            "post_url TEXT, media TEXT NOT NULL, "
+            "PRIMARY KEY (user, post_id))")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user TEXT PRIMARY KEY, complete INTEGER NOT NULL DEFAULT 0)")
+
+    def begin(self, user):
+        """Whether 'user' was indexed down to its oldest post; clears the flag"""
+        row = self.db.execute(
+            "SELECT complete FROM users WHERE user=?", (user,)).fetchone()
+        if row and row[0]:
+            with self.db:
+                self.db.execute(
+                    "UPDATE users SET complete=0 WHERE user=?", (user,))
+            return True
+        return False
+
+    def finish(self, user):
+        """Mark 'user' as indexed down to its oldest post"""
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO users VALUES (?, 1)", (user,))
+
+    def get(self, user, post_id):
+        row = self.db.execute(
+            "SELECT media FROM posts WHERE user=? AND post_id=?",
+            (user, int(post_id))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, user, post_id, post_url, media_urls):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?)",
+                (user, int(post_id), post_url, json.dumps(media_urls)))
+
+    def older(self, user, post_id):
+        """Indexed posts listed after 'post_id', newest first"""
+        for pid, media in self.db.execute(
+                "SELECT post_id, media FROM posts WHERE user=? AND post_id<? "
+                "ORDER BY post_id DESC", (user, int(post_id))):
+            yield str(pid), json.loads(media)
@@ -0,0 +1,243 @@
+"""Warm gallery-dl worker processes for bot.py.
+
+Each worker imports gallery_dl once, registers the modules in `extractors/`,
+and then runs `gallery_dl.job.DownloadJob` for one URL at a time, so a job
+no longer pays interpreter startup, extractor imports and config parsing.
+A job that runs past its timeout gets its worker killed and replaced, which
+keeps the kill semantics of the old `gallery-dl` subprocess. Every finished
+file is reported back while the job is still running, so the caller can
+start uploading before the whole gallery is downloaded.
+
+With a media cache directory, a file whose gallery-dl category/id is already
+cached is hardlinked into place and reported without being downloaded again.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import extractors
+from media_cache import MediaCache, gdl_key, link_or_copy
+
+EXTRACTORS_DIR = extractors.DIRECTORY
+
+
+class _Capture(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.lines = []
+        self.setFormatter(logging.Formatter("[%(name)s][%(levelname)s] %(message)s"))
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class _Notify:
+    """Wrap a gallery-dl output object and report finished files over `conn`."""
+
+    def __init__(self, out, conn):
+        self.out = out
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+    def success(self, path):
+        self.out.success(path)
+        self.conn.send(("file", path))
+
+    def skip(self, path):
+        # a cached copy _link_cached put in place, or a file an earlier run of a
+        # resumed job downloaded (found on disk or in its download archive);
+        # reported like a download, bot.py's journal decides whether to send it
+        self.out.skip(path)
+        self.conn.send(("file", path))
+
+
+def _job_class(conn, cache=None):
+    from gallery_dl import job
+
+    class NotifyingJob(job.DownloadJob):
+        # child jobs are built as self.__class__(url, self) and inherit the hook
+        def __init__(self, url, parent=None):
+            job.DownloadJob.__init__(self, url, parent)
+            self.out = _Notify(self.out, conn)
+
+        def handle_url(self, url, kwdict):
+            if cache is not None:
+                self._link_cached(kwdict)
+            job.DownloadJob.handle_url(self, url, kwdict)
+
+        def _link_cached(self, kwdict):
+            # put a cached copy where gallery-dl expects the file; its own
+            # exists() check then skips the download
+            key = gdl_key(kwdict)
+            if key is None:
+                return
+            pathfmt = self.pathfmt
+            pathfmt.set_filename(kwdict)
+            if not pathfmt.extension:
+                return
+            pathfmt.build_path()
+            if pathfmt.exists():
+                return
+            files = cache.lookup(key)
+            if files:
+                os.makedirs(os.path.dirname(pathfmt.realpath), exist_ok=True)
+                link_or_copy(files[0][0], pathfmt.realpath)
+
+    return NotifyingJob
+
+
+def _run_job(conn, url, options, cache=None):
+    from gallery_dl import config, exception
+
+    config.clear()
+    config.load()
+    for path, key, value in options:
+        config.set(tuple(path), key, value)
+
+    capture = _Capture()
+    root = logging.getLogger()
+    root.addHandler(capture)
+    started = time.monotonic()
+    try:
+        returncode = _job_class(conn, cache)(url).run()
+    except exception.NoExtractorError:
+        logging.getLogger("gallery-dl").error("Unsupported URL '%s'", url)
+        returncode = 64
+    except Exception as e:
+        logging.getLogger("gallery-dl").error("%s: %s", e.__class__.__name__, e)
+        returncode = 1
+    finally:
+        root.removeHandler(capture)
+    return {
+        "returncode": returncode,
+        "log": "\n".join(capture.lines)[-4000:],
+        "elapsed": time.monotonic() - started,
+    }
+
+
+def _worker_main(conn, extractor_dirs, cache_dir=None):
+    from gallery_dl import extractor, output
+
+    # eviction is left to the bot process, workers only read
+    cache = MediaCache(cache_dir, max_bytes=float("inf")) if cache_dir else None
+    output.initialize_logging(logging.INFO)
+    for directory in extractor_dirs:
+        extractors.register(extractor, directory)
+    # walking every extractor class once imports all modules up front
+    extractor.find("gdl-pool:warmup")
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg is None:
+            break
+        url, options = msg
+        conn.send(("done", _run_job(conn, url, options, cache)))
+
+
+class _Worker:
+    def __init__(self, ctx, extractor_dirs, cache_dir=None):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(
+            target=_worker_main, args=(child, extractor_dirs, cache_dir), daemon=True)
+        self.proc.start()
+        child.close()
+
+    def kill(self):
+        self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+
+
+class GalleryDLPool:
+    """A fixed number of preloaded gallery-dl processes, one job each at a time."""
+
+    def __init__(self, size, extractor_dirs=(EXTRACTORS_DIR,), cache_dir=None):
+        self.size = max(1, size)
+        self.extractor_dirs = [str(d) for d in extractor_dirs if Path(d).is_dir()]
+        self.cache_dir = str(cache_dir) if cache_dir else None
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = asyncio.Queue()
+        self._workers = set()
+        self._respawning = set()
+
+    async def _spawn(self):
+        loop = asyncio.get_running_loop()
+        worker = await loop.run_in_executor(
+            None, _Worker, self._ctx, self.extractor_dirs, self.cache_dir)
+        try:
+            await asyncio.wait_for(loop.run_in_executor(None, worker.conn.recv), 120)
+        except BaseException:
+            worker.kill()
+            raise
+        self._workers.add(worker)
+        return worker
+
+    def _discard(self, worker):
+        self._workers.discard(worker)
+        worker.kill()
+
+    async def start(self):
+        for worker in await asyncio.gather(*(self._spawn() for _ in range(self.size))):
+            self._idle.put_nowait(worker)
+
+    async def close(self):
+        for worker in list(self._workers):
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            self._discard(worker)
+
+    async def run(self, url, options, timeout, on_file=None):
+        """Run one DownloadJob; returns {returncode, log, elapsed}.
+
+        `on_file(path)` is called for every file as soon as it is complete.
+        Raises asyncio.TimeoutError after killing the worker when the job
+        takes longer than `timeout` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        worker = await self._idle.get()
+        healthy = False
+        try:
+            worker.conn.send((url, options))
+            while True:
+                kind, payload = await asyncio.wait_for(
+                    loop.run_in_executor(None, worker.conn.recv), deadline - loop.time())
+                if kind == "file":
+                    if on_file is not None:
+                        on_file(payload)
+                    continue
+                healthy = True
+                return payload
+        except asyncio.TimeoutError:
+            # TimeoutError is an OSError subclass, keep it out of the clause below
+            raise
+        except (EOFError, OSError) as e:
+            return {"returncode": 1, "log": f"gallery-dl worker died: {e!r}", "elapsed": 0.0}
+        finally:
+            if healthy:
+                self._idle.put_nowait(worker)
+            else:
+                self._discard(worker)
+                task = asyncio.ensure_future(self._replace())
+                self._respawning.add(task)
+                task.add_done_callback(self._respawning.discard)
+
+    async def _replace(self):
+        while True:
+            try:
+                self._idle.put_nowait(await self._spawn())
+                return
+            except Exception:
+                logging.getLogger("gdl_pool").exception("could not respawn gallery-dl worker")
+                await asyncio.sleep(5)
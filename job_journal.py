@@ -0,0 +1,125 @@
+"""SQLite journal of bot.py's jobs, so a restart or a failed upload loses nothing.
+
+A job is recorded when it is queued and dropped once it is done. Until then
+the journal keeps its link and chat, every file gallery-dl produced and
+whether that file was sent; the job's download directory and gallery-dl
+download archive stay on disk as well. On startup bot.py queues every
+unfinished job again, and sending the same link to the same chat picks up
+its unfinished job: files that were sent are not sent twice, and gallery-dl
+skips whatever its archive lists. A video sent as split parts records how
+many parts went out, at which part size, so a resumed job sends the rest.
+
+The methods block on SQLite; bot.py runs them on one thread of their own.
+"""
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+# file states
+PENDING = 0
+SENT = 1
+# not sent and not worth retrying (too large, over the per-job limit)
+SKIPPED = 2
+
+
+@contextmanager
+def _connect(path):
+    db = sqlite3.connect(path, timeout=60)
+    db.row_factory = sqlite3.Row
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+class JobJournal:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, "
+                "url TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, "
+                "attempts INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_chat_url ON jobs (chat_id, url)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "job_id TEXT NOT NULL, path TEXT NOT NULL, state INTEGER NOT NULL, "
+                "position INTEGER NOT NULL, part_bytes INTEGER, parts_sent INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (job_id, path))")
+
+    def _db(self):
+        return _connect(self.path)
+
+    def open(self, user_id, chat_id, url, priority=0):
+        """(job id, created): the unfinished job for url in chat_id, else a new one."""
+        with self._db() as db:
+            row = db.execute(
+                "SELECT id FROM jobs WHERE chat_id=? AND url=? ORDER BY created LIMIT 1",
+                (chat_id, url)).fetchone()
+            if row:
+                return row["id"], False
+            job_id = uuid.uuid4().hex
+            db.execute(
+                "INSERT INTO jobs (id, user_id, chat_id, url, priority, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, chat_id, url, priority, time.time()))
+        return job_id, True
+
+    def start(self, job_id):
+        """Count a run of the job; returns how many runs it has had, this one included."""
+        with self._db() as db:
+            db.execute("UPDATE jobs SET attempts = attempts + 1 WHERE id=?", (job_id,))
+            row = db.execute("SELECT attempts FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return row["attempts"] if row else 1
+
+    def add_file(self, job_id, path):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO files (job_id, path, state, position) VALUES (?, ?, ?, "
+                "(SELECT COUNT(*) FROM files WHERE job_id=?))",
+                (job_id, str(path), PENDING, job_id))
+
+    def mark(self, job_id, path, state):
+        with self._db() as db:
+            db.execute("UPDATE files SET state=? WHERE job_id=? AND path=?", (state, job_id, str(path)))
+
+    def mark_part(self, job_id, path, part_bytes, number):
+        """Record that parts 1..number of path, split at part_bytes, were sent."""
+        with self._db() as db:
+            db.execute(
+                "UPDATE files SET part_bytes=?, parts_sent=? WHERE job_id=? AND path=?",
+                (part_bytes, number, job_id, str(path)))
+
+    def parts(self, job_id):
+        """{path: (part_bytes, parts sent)} of the job's partly sent files."""
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT path, part_bytes, parts_sent FROM files WHERE job_id=? AND parts_sent > 0",
+                (job_id,)).fetchall()
+        return {row["path"]: (row["part_bytes"], row["parts_sent"]) for row in rows}
+
+    def files(self, job_id):
+        """{path: state} of the job's files in the order they were produced."""
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT path, state FROM files WHERE job_id=? ORDER BY position", (job_id,)).fetchall()
+        return {row["path"]: row["state"] for row in rows}
+
+    def pending(self, job_id):
+        with self._db() as db:
+            return db.execute(
+                "SELECT COUNT(*) FROM files WHERE job_id=? AND state=?", (job_id, PENDING)).fetchone()[0]
+
+    def unfinished(self):
+        with self._db() as db:
+            return [dict(row) for row in db.execute("SELECT * FROM jobs ORDER BY created")]
+
+    def finish(self, job_id):
+        with self._db() as db:
+            db.execute("DELETE FROM files WHERE job_id=?", (job_id,))
+            db.execute("DELETE FROM jobs WHERE id=?", (job_id,))
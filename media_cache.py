@@ -0,0 +1,270 @@
+"""Content-addressed store for downloaded media, shared across jobs.
+
+Files are kept once under `<root>/blobs/<sha256[:2]>/<sha256><ext>` and
+indexed in SQLite by key: `url:<source url>` maps to every file one job
+produced, `gdl:<category>:<id>[:<num>]` maps to a single file gallery-dl
+reported for a post. A hit is hardlinked into the job directory, so a repeat
+request costs no network traffic and no copy. Blobs are evicted least
+recently used first once their total size passes `max_bytes`.
+
+FileIdCache remembers what Telegram handed back for an upload (a Bot API
+file_id, or an MTProto document/photo reference) per content hash and
+sender, so a file that was sent before is re-sent without re-uploading it.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def gdl_key(meta):
+    """Per-file key from a gallery-dl metadata dict, or None without an id."""
+    category, post_id = meta.get("category"), meta.get("id")
+    if not category or post_id is None:
+        return None
+    key = f"gdl:{category}:{post_id}"
+    if meta.get("num") is not None:
+        key += f":{meta['num']}"
+    return key
+
+
+def url_key(url):
+    return "url:" + url.strip()
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        # never overwrite an existing file with a copy
+        raise
+    except OSError:
+        # different filesystem or no hardlink support
+        shutil.copyfile(src, dst)
+
+
+@contextmanager
+def _connect(path):
+    # one short-lived connection per call: the bot, its thread pool and the
+    # gallery-dl worker processes all use the same index
+    db = sqlite3.connect(path, timeout=60)
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+class MediaCache:
+    def __init__(self, root, max_bytes, ttl=None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+        self.path = self.root / "index.sqlite3"
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "sha256 TEXT PRIMARY KEY, ext TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT NOT NULL, position INTEGER NOT NULL, "
+                "sha256 TEXT NOT NULL, name TEXT NOT NULL, created REAL NOT NULL, "
+                "PRIMARY KEY (key, position))")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_sha256 ON entries (sha256)")
+            db.execute("CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used)")
+
+    def _db(self):
+        return _connect(self.path)
+
+    def blob_path(self, sha256, ext):
+        return self.root / "blobs" / sha256[:2] / (sha256 + ext)
+
+    def lookup(self, key):
+        """[(blob path, original name)] for `key`, or None on a miss."""
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT e.sha256, b.ext, e.name, e.created FROM entries e "
+                "JOIN blobs b ON b.sha256 = e.sha256 "
+                "WHERE e.key=? ORDER BY e.position", (key,)).fetchall()
+            if not rows:
+                return None
+            if self.ttl and key.startswith("url:") and rows[0][3] < time.time() - self.ttl:
+                db.execute("DELETE FROM entries WHERE key=?", (key,))
+                return None
+            files = [(self.blob_path(sha, ext), name) for sha, ext, name, _ in rows]
+            if not all(p.is_file() for p, _ in files):
+                db.execute("DELETE FROM entries WHERE key=?", (key,))
+                return None
+            db.executemany(
+                "UPDATE blobs SET last_used=? WHERE sha256=?",
+                [(time.time(), sha) for sha, _, _, _ in rows])
+        return files
+
+    def materialize(self, key, dest_dir):
+        """Hardlink the files cached under `key` into `dest_dir`; None on a miss."""
+        files = self.lookup(key)
+        if files is None:
+            return None
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        out = []
+        for blob, name in files:
+            dst = dest_dir / name
+            if not dst.exists():
+                link_or_copy(blob, dst)
+            out.append(dst)
+        return out
+
+    def _add_blob(self, path):
+        path = Path(path)
+        sha256 = file_digest(path)
+        ext = path.suffix.lower()
+        blob = self.blob_path(sha256, ext)
+        if not blob.exists():
+            blob.parent.mkdir(exist_ok=True)
+            tmp = blob.with_name(f"{blob.name}.{os.getpid()}.tmp")
+            tmp.unlink(missing_ok=True)
+            link_or_copy(path, tmp)
+            os.replace(tmp, blob)
+        return sha256, ext, blob.stat().st_size
+
+    def _record(self, keys):
+        blobs = {blob for files in keys.values() for blob, _ in files}
+        if not blobs:
+            return
+        now = time.time()
+        with self._db() as db:
+            db.executemany(
+                "INSERT INTO blobs VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(sha256) DO UPDATE SET last_used=excluded.last_used",
+                [(sha, ext, size, now) for sha, ext, size in blobs])
+            for key, files in keys.items():
+                db.execute("DELETE FROM entries WHERE key=?", (key,))
+                db.executemany(
+                    "INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+                    [(key, i, sha, name, now) for i, ((sha, _, _), name) in enumerate(files)])
+        self.evict()
+
+    def store(self, key, paths):
+        """Record `paths`, in order, as the result for `key`."""
+        self._record({key: [(self._add_blob(p), Path(p).name) for p in paths]})
+
+    def store_job(self, url, paths):
+        """Cache a job's files under its URL and each file under its gallery-dl id.
+
+        `url` may be None to only record the per-file keys, e.g. for a job
+        that did not finish cleanly.
+        """
+        paths = [Path(p) for p in paths]
+        files = [(self._add_blob(p), p.name) for p in paths]
+        keys = {}
+        if url is not None and files:
+            keys[url_key(url)] = files
+        for p, entry in zip(paths, files):
+            try:
+                with open(f"{p}.json", encoding="utf-8") as f:
+                    key = gdl_key(json.load(f))
+            except (OSError, ValueError, AttributeError):
+                continue
+            if key:
+                keys[key] = [entry]
+        self._record(keys)
+
+    def evict(self):
+        with self._db() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for sha, ext, size in db.execute("SELECT sha256, ext, size FROM blobs ORDER BY last_used"):
+                if total <= self.max_bytes:
+                    break
+                victims.append((sha, ext))
+                total -= size
+            for sha, _ in victims:
+                # a key missing one of its files is no longer a usable hit
+                db.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries WHERE sha256=?)", (sha,))
+                db.execute("DELETE FROM blobs WHERE sha256=?", (sha,))
+        for sha, ext in victims:
+            try:
+                self.blob_path(sha, ext).unlink()
+            except OSError:
+                pass
+
+
+class FileIdCache:
+    """Telegram file references by (sha256, sender).
+
+    `sender` tells apart the identities a reference is valid for, e.g.
+    `bot:<bot id>` or `mtproto:<user id>`. File digests are memoized by inode,
+    so a file hardlinked from the MediaCache is not hashed again.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                "sha256 TEXT NOT NULL, sender TEXT NOT NULL, "
+                "value TEXT NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (sha256, sender))")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                "dev INTEGER NOT NULL, ino INTEGER NOT NULL, "
+                "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sha256 TEXT NOT NULL, "
+                "PRIMARY KEY (dev, ino))")
+
+    def _db(self):
+        return _connect(self.path)
+
+    def digest(self, path):
+        st = os.stat(path)
+        with self._db() as db:
+            row = db.execute(
+                "SELECT sha256 FROM digests WHERE dev=? AND ino=? AND size=? AND mtime_ns=?",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)).fetchone()
+        if row:
+            return row[0]
+        sha256 = file_digest(path)
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, sha256))
+        return sha256
+
+    def get(self, sha256, sender):
+        with self._db() as db:
+            row = db.execute(
+                "SELECT value FROM file_ids WHERE sha256=? AND sender=?",
+                (sha256, sender)).fetchone()
+        return row[0] if row else None
+
+    def put(self, sha256, sender, value):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO file_ids VALUES (?, ?, ?, ?)",
+                (sha256, sender, value, time.time()))
+
+    def forget(self, sha256, sender):
+        with self._db() as db:
+            db.execute("DELETE FROM file_ids WHERE sha256=? AND sender=?", (sha256, sender))
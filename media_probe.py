@@ -0,0 +1,157 @@
+"""Video metadata probing shared by telethon_send.py and bot.js.
+
+Results are cached in a `<file>.probe.json` sidecar next to gallery-dl's own
+`<file>.json`, keyed by file size and mtime (integer milliseconds, so Node's
+`Math.floor(stat.mtimeMs)` produces the same key). When ffprobe is not
+installed or cannot read the file, width/height/duration are read straight
+from the MP4 `moov` box.
+"""
+import os
+import json
+import struct
+import subprocess
+
+SIDECAR_SUFFIX = '.probe.json'
+
+
+def sidecar_path(file_path):
+    return file_path + SIDECAR_SUFFIX
+
+
+def _stat_key(file_path):
+    st = os.stat(file_path)
+    return st.st_size, st.st_mtime_ns // 1_000_000
+
+
+def read_cache(file_path):
+    try:
+        size, mtime = _stat_key(file_path)
+        with open(sidecar_path(file_path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('size') != size or meta.get('mtime') != mtime:
+        return None
+    return meta
+
+
+def write_cache(file_path, meta):
+    tmp = sidecar_path(file_path) + '.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, sidecar_path(file_path))
+    except OSError:
+        pass
+
+
+def ffprobe(file_path):
+    """Return {video, width, height, duration}, {} on a probe error, or None
+    when ffprobe itself is unavailable."""
+    try:
+        p = subprocess.run([
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'stream=codec_type,width,height:format=duration',
+            '-of', 'json', file_path
+        ], capture_output=True, text=True, check=False)
+    except OSError:
+        return None
+    if p.returncode != 0:
+        return {}
+    try:
+        j = json.loads(p.stdout or '{}')
+        streams = j.get('streams') or []
+        s = next((s for s in streams if s.get('codec_type') == 'video'), {})
+        return {
+            'video': bool(s),
+            'width': int(s.get('width') or 0) or None,
+            'height': int(s.get('height') or 0) or None,
+            'duration': float((j.get('format') or {}).get('duration') or 0) or None,
+        }
+    except (ValueError, TypeError):
+        return {}
+
+
+def _boxes(f, start, end):
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _find(f, start, end, kind):
+    return next(((s, e) for k, s, e in _boxes(f, start, end) if k == kind), None)
+
+
+def _video_track_size(f, start, end):
+    mdia = _find(f, start, end, b'mdia')
+    hdlr = mdia and _find(f, *mdia, b'hdlr')
+    if not hdlr:
+        return None
+    f.seek(hdlr[0] + 8)
+    if f.read(4) != b'vide':
+        return None
+    tkhd = _find(f, start, end, b'tkhd')
+    if not tkhd:
+        return None
+    f.seek(tkhd[0])
+    version = f.read(1)[0]
+    f.seek(tkhd[0] + (88 if version == 1 else 76))
+    width, height = struct.unpack('>II', f.read(8))
+    return width >> 16, height >> 16
+
+
+def parse_mp4(file_path):
+    """Read width/height/duration from the mvhd and video tkhd boxes."""
+    try:
+        with open(file_path, 'rb') as f:
+            moov = _find(f, 0, os.fstat(f.fileno()).st_size, b'moov')
+            if not moov:
+                return None
+            meta = {'video': False, 'width': None, 'height': None, 'duration': None}
+            for kind, start, end in _boxes(f, *moov):
+                if kind == b'mvhd':
+                    f.seek(start)
+                    if f.read(1)[0] == 1:
+                        f.seek(start + 20)
+                        timescale, duration = struct.unpack('>IQ', f.read(12))
+                    else:
+                        f.seek(start + 12)
+                        timescale, duration = struct.unpack('>II', f.read(8))
+                    if timescale:
+                        meta['duration'] = duration / timescale
+                elif kind == b'trak' and not meta['video']:
+                    size = _video_track_size(f, start, end)
+                    if size:
+                        meta.update(video=True, width=size[0] or None, height=size[1] or None)
+            return meta
+    except (OSError, struct.error, IndexError):
+        return None
+
+
+def probe(file_path):
+    """Cached {video, width, height, duration} for `file_path`; {} if unknown."""
+    meta = read_cache(file_path)
+    if meta is not None:
+        return meta
+    meta = ffprobe(file_path)
+    if not meta:
+        meta = parse_mp4(file_path)
+    if not meta:
+        return {}
+    try:
+        meta['size'], meta['mtime'] = _stat_key(file_path)
+    except OSError:
+        return meta
+    write_cache(file_path, meta)
+    return meta
@@ -0,0 +1,138 @@
+"""Split videos above an upload limit into playable parts without re-encoding.
+
+Cut points come from ffprobe's packet list: every part starts on a video
+keyframe and its packets add up to at most HEADROOM of the limit, so the
+stream-copied parts stay below it even though a copy can only be cut at
+keyframes. `split` hands the parts out in order as soon as each one is
+written, so the first part is uploading while the next ones are cut; at most
+`workers` ffmpeg processes run ahead of the caller, so a long video never has
+more than that many parts waiting on disk.
+"""
+import asyncio
+import os
+import subprocess
+from collections import deque
+from pathlib import Path
+
+VIDEO_EXTS = {".mp4", ".m4v", ".mov", ".mkv", ".webm"}
+# room for container overhead and the audio interleaved around each cut
+HEADROOM = 0.95
+# ffmpeg's input seek lands on the keyframe at or before the position; a cut
+# is placed just after its keyframe so rounding never picks the previous one
+SEEK_MARGIN = 0.001
+
+
+class SplitError(Exception):
+    pass
+
+
+def can_split(path) -> bool:
+    return Path(path).suffix.lower() in VIDEO_EXTS
+
+
+def packets(path):
+    """(seconds, bytes, is a video keyframe) of every packet, by time."""
+    try:
+        p = subprocess.run([
+            "ffprobe", "-v", "error",
+            "-show_entries", "packet=codec_type,pts_time,size,flags",
+            "-of", "csv=p=0", str(path),
+        ], capture_output=True, text=True, check=False)
+    except OSError as e:
+        raise SplitError(f"ffprobe unavailable: {e}")
+    if p.returncode != 0:
+        raise SplitError(p.stderr.strip()[-300:] or f"ffprobe exited with {p.returncode}")
+    found = []
+    for line in p.stdout.splitlines():
+        fields = line.split(",")
+        if len(fields) < 4:
+            continue
+        kind, pts, size, flags = fields[:4]
+        try:
+            found.append((float(pts), int(size), kind == "video" and "K" in flags))
+        except ValueError:
+            # packets without a timestamp (N/A)
+            continue
+    found.sort()
+    return found
+
+
+def plan(packets, max_bytes):
+    """Start times of the parts, the first one always 0."""
+    budget = max_bytes * HEADROOM
+    starts = [0.0]
+    used = 0
+    # latest keyframe in the current part and the bytes of the part before it
+    cut = None
+    for pts, size, key in packets:
+        if key and pts > starts[-1]:
+            cut = (pts, used)
+        if used + size > budget and cut is not None:
+            starts.append(cut[0])
+            used -= cut[1]
+            cut = None
+        used += size
+    return starts
+
+
+async def cut(src: Path, start: float, end, dst: Path):
+    """Stream-copy src from the keyframe at `start` up to `end` (None: the end) into dst."""
+    args = ["ffmpeg", "-v", "error", "-y"]
+    if start:
+        args += ["-ss", f"{start + SEEK_MARGIN:.6f}"]
+    args += ["-i", str(src)]
+    if end is not None:
+        args += ["-t", f"{end - start:.6f}"]
+    args += ["-map", "0:v", "-map", "0:a?", "-c", "copy", "-avoid_negative_ts", "make_zero"]
+    if dst.suffix.lower() in (".mp4", ".m4v", ".mov"):
+        args += ["-movflags", "+faststart"]
+    args.append(str(dst))
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    except OSError as e:
+        raise SplitError(f"ffmpeg unavailable: {e}")
+    try:
+        _, err = await proc.communicate()
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+    if proc.returncode != 0 or not dst.exists():
+        raise SplitError(err.decode(errors="replace").strip()[-300:] or f"ffmpeg exited with {proc.returncode}")
+    return dst
+
+
+async def split(src, out_dir, max_bytes: int, workers: int = 2, first: int = 1):
+    """Yield (number, count, part path) in order as the parts are written.
+
+    Parts before `first` are neither cut nor yielded; the same file and
+    max_bytes always give the same parts, so a caller can resume after the
+    ones it already sent. The caller owns out_dir and the parts in it; cuts
+    still running are cancelled when the caller stops iterating.
+    """
+    src = Path(src)
+    starts = plan(await asyncio.to_thread(packets, src), max_bytes)
+    if len(starts) < 2:
+        raise SplitError(f"no keyframe to cut {src.name} at")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    count = len(starts)
+    first = max(1, first)
+    spans = list(enumerate(zip(starts, starts[1:] + [None]), 1))[first - 1:]
+    ahead = max(1, workers)
+    # cuts of the next parts, started only as the caller takes the earlier ones
+    tasks = deque()
+    try:
+        for i, (number, _) in enumerate(spans):
+            while len(tasks) < ahead and i + len(tasks) < len(spans):
+                n, (start, end) = spans[i + len(tasks)]
+                tasks.append(asyncio.create_task(
+                    cut(src, start, end, out_dir / f"{src.stem}.part{n:03d}{src.suffix}")))
+            yield number, count, await tasks.popleft()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,131 @@
+"""Prometheus metrics shared by bot.py, telethon_send.py and the dashboard.
+
+Every stage of a job is a histogram labelled by the gallery-dl extractor
+category of the link (or, for files, the `category` in its `<file>.json`
+sidecar). `serve(port)` exposes them on a small HTTP endpoint. Without
+prometheus_client installed the metrics are no-ops, so the uploader keeps
+working in images that only ship telethon. The dashboard image copies this
+module in, like transcoder.py, and adds its own series in app/metrics.py.
+"""
+import functools
+import json
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+try:
+    import extractors
+except ImportError:  # a copy of this module without the repository's extractors/ beside it
+    extractors = None
+
+SECONDS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+BYTES = tuple(2 ** n for n in range(16, 34, 2))  # 64 KB .. 8 GB
+BYTES_PER_SECOND = tuple(2 ** n for n in range(14, 28))  # 16 KB/s .. 128 MB/s
+
+
+class _Noop:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+def _histogram(name, doc, labels, buckets):
+    if prometheus_client is None:
+        return _Noop()
+    return prometheus_client.Histogram(name, doc, labels, buckets=buckets)
+
+
+def _counter(name, doc, labels):
+    if prometheus_client is None:
+        return _Noop()
+    return prometheus_client.Counter(name, doc, labels)
+
+
+QUEUE_WAIT = _histogram(
+    "media_queue_wait_seconds", "Time a job waited before a worker picked it up", ["category"], SECONDS)
+DOWNLOAD_SECONDS = _histogram(
+    "media_download_seconds", "gallery-dl runtime per job", ["category", "outcome"], SECONDS)
+DOWNLOAD_BYTES = _histogram(
+    "media_download_bytes", "Bytes a job downloaded", ["category"], BYTES)
+PROBE_SECONDS = _histogram(
+    "media_probe_seconds", "Video metadata probe time per file", ["category"], SECONDS)
+UPLOAD_SECONDS = _histogram(
+    "media_upload_seconds", "Time to send one file to Telegram", ["category", "transport"], SECONDS)
+UPLOAD_THROUGHPUT = _histogram(
+    "media_upload_bytes_per_second", "Upload throughput of one file", ["category", "transport"],
+    BYTES_PER_SECOND)
+BACKOFF_SECONDS = _histogram(
+    "telegram_backoff_seconds", "Waits Telegram imposed with 429 / FLOOD_WAIT", ["category"], SECONDS)
+JOBS = _counter("media_jobs_total", "Finished jobs", ["category", "outcome"])
+
+
+@functools.lru_cache(maxsize=1)
+def _gallery_dl_extractor():
+    """gallery_dl.extractor with the repository's own extractors/ registered, or None."""
+    try:
+        from gallery_dl import extractor
+    except ImportError:
+        return None
+    if extractors is not None:
+        try:
+            extractors.register(extractor)
+        except Exception:
+            # labels fall back to gallery-dl's built-in extractors
+            pass
+    return extractor
+
+
+@functools.lru_cache(maxsize=4096)
+def url_category(url):
+    """gallery-dl extractor category for `url`; the host name without gallery-dl."""
+    extractor = _gallery_dl_extractor()
+    if extractor is None:
+        host = urlsplit(url).hostname or "unknown"
+        return host[4:] if host.startswith("www.") else host
+    try:
+        ex = extractor.find(url)
+    except Exception:
+        ex = None
+    return ex.category if ex is not None else "other"
+
+
+def file_category(path, default="unknown"):
+    """Category gallery-dl recorded in the file's metadata sidecar."""
+    try:
+        with open(f"{path}.json", encoding="utf-8") as f:
+            return json.load(f).get("category") or default
+    except (OSError, ValueError, AttributeError):
+        return default
+
+
+def observe_upload(category, transport, size, seconds):
+    UPLOAD_SECONDS.labels(category, transport).observe(seconds)
+    if size and seconds > 0:
+        UPLOAD_THROUGHPUT.labels(category, transport).observe(size / seconds)
+
+
+@contextmanager
+def timed(histogram, *labels):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.monotonic() - started)
+
+
+def serve(port, addr="0.0.0.0"):
+    """Expose /metrics on `port` from a daemon thread; False when unavailable."""
+    if not port or prometheus_client is None:
+        return False
+    prometheus_client.start_http_server(port, addr)
+    return True
@@ -0,0 +1,110 @@
+"""Bounded job queue for bot.py with global and per-user concurrency limits.
+
+Pending jobs are kept ordered by (priority, arrival); a lower priority value
+runs first. A free worker takes the first pending job whose user is below
+the per-user limit, so one user's burst cannot starve everyone else.
+"""
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+log = logging.getLogger("scheduler")
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass(eq=False)
+class Job:
+    user_id: int
+    chat_id: int
+    url: str
+    priority: int = 0
+    # job_journal id, which also names the job's download directory
+    id: str = ""
+    seq: int = 0
+    # time.monotonic() when the job was submitted
+    queued_at: float = 0.0
+
+    def sort_key(self):
+        return (self.priority, self.seq)
+
+
+class JobScheduler:
+    def __init__(self, run, max_concurrent=2, per_user=1, max_queued=50):
+        self._run = run
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_user = max(1, per_user)
+        self.max_queued = max_queued
+        self._pending = []
+        self._running = Counter()
+        self._seq = itertools.count()
+        self._changed = asyncio.Condition()
+        self._workers = []
+
+    @property
+    def running(self):
+        return sum(self._running.values())
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, job):
+        """Queue `job`; returns its 1-based position among pending jobs."""
+        if len(self._pending) >= self.max_queued:
+            raise QueueFull()
+        job.seq = next(self._seq)
+        job.queued_at = time.monotonic()
+        keys = [j.sort_key() for j in self._pending]
+        pos = bisect.bisect(keys, job.sort_key())
+        self._pending.insert(pos, job)
+        asyncio.create_task(self._notify())
+        return pos + 1
+
+    def position(self, job):
+        try:
+            return self._pending.index(job) + 1
+        except ValueError:
+            return 0
+
+    def would_start_now(self):
+        return not self._pending and self.running < self.max_concurrent
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _pick(self):
+        for i, job in enumerate(self._pending):
+            if self._running[job.user_id] < self.per_user:
+                return self._pending.pop(i)
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self._changed:
+                job = self._pick()
+                while job is None:
+                    await self._changed.wait()
+                    job = self._pick()
+                self._running[job.user_id] += 1
+            try:
+                await self._run(job)
+            except Exception:
+                log.exception("job failed: %s", job.url)
+            finally:
+                self._running[job.user_id] -= 1
+                if not self._running[job.user_id]:
+                    del self._running[job.user_id]
+                await self._notify()
@@ -0,0 +1,273 @@
+"""Fallback media-link scraper for pages gallery-dl does not support.
+
+Pages are fetched through one shared httpx.AsyncClient (pooled keep-alive
+connections) with a per-host concurrency limit and a cap on how much of a
+response is read. The body is fed to the link extractor as it streams in,
+so a slow site never blocks the bot's event loop.
+
+Links are ranked rather than returned raw: tracking pixels are dropped,
+thumbnails demoted, variants of one asset (_720p, -1280x720, ...) grouped,
+and HEAD requests decide which variant of each group is sent.
+"""
+import asyncio
+import html
+import os
+import re
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+
+SCRAPE_TIMEOUT = 25
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", str(5 * 1024 * 1024)))
+SCRAPE_PER_HOST = int(os.getenv("SCRAPE_PER_HOST", "2"))
+# variants per asset that get a HEAD request
+HEAD_VARIANTS = 4
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+}
+
+# one pass over the page picks up og:video/og:image tags, <source>/<video>
+# src attributes, JSON-LD contentUrl values and bare media URLs. The
+# alternatives share their leading "<" so the scan stays close to the cost of
+# the plain URL regex; a match without any named group is a bare URL.
+CANDIDATES = re.compile(
+    r'<(?:meta\b(?:[^>]*?\bproperty=["\']og:(?P<og_kind>video|image)(?::(?:secure_)?url)?["\']'
+    r'[^>]*?\bcontent=["\'](?P<og>[^"\']+)["\']'
+    r'|[^>]*?\bcontent=["\'](?P<og_rev>[^"\']+)["\']'
+    r'[^>]*?\bproperty=["\']og:(?P<og_rev_kind>video|image)(?::(?:secure_)?url)?["\'])'
+    r'|(?:source|video)\b[^>]*?\bsrc=["\'](?P<source>[^"\']+)["\'])'
+    r'|"contentUrl"\s*:\s*"(?P<jsonld>[^"]+)"'
+    r'|https?://[^\s"\'<>]+\.(?:mp4|webm|m3u8|jpg|jpeg|png|gif|webp)(?:\?[^\s"\'<>]*)?'
+)
+EXTENSION = re.compile(r"\.([a-z0-9]{2,5})$", re.IGNORECASE)
+# size/quality markers that distinguish variants of one asset: _720p, -1280x720, /1080/, .hd
+VARIANT = re.compile(
+    r"(?:[_\-.](?:\d{3,4}p|\d{2,4}x\d{2,4}|hd|sd|hq|lq|low|high|small|medium|large|orig(?:inal)?)"
+    r"|/(?:(?:240|360|480|540|720|1080|1440|2160)p?|hd|sd)(?=/))(?=[_\-./]|$)",
+    re.IGNORECASE,
+)
+HEIGHT = re.compile(
+    r"(?:(?<=[_\-./])(\d{3,4})p|\d{2,4}x(\d{2,4})|/(240|360|480|540|720|1080|1440|2160)/)", re.IGNORECASE)
+TRACKING = re.compile(r"pixel|beacon|spacer|1x1|/tr\?|doubleclick|analytics|/collect\?", re.IGNORECASE)
+THUMBNAIL = re.compile(r"thumb|poster|preview|avatar|icon|logo|sprite|placeholder|-\d{2,3}x\d{2,3}\.", re.IGNORECASE)
+
+VIDEO_EXTS = {"mp4", "webm", "mov", "m4v", "mkv"}
+IMAGE_EXTS = {"jpg", "jpeg", "png", "gif", "webp"}
+MEDIA_TYPES = ("video/", "image/", "application/vnd.apple.mpegurl", "application/x-mpegurl",
+               "application/octet-stream", "binary/octet-stream")
+SOURCE_WEIGHT = {"og": 3, "jsonld": 3, "source": 2, "link": 0}
+KIND_WEIGHT = {"video": 20, "playlist": 10, "image": 0}
+# characters that can never be part of a matched URL
+DELIMITERS = frozenset(" \t\r\n\f\v\"'<>")
+
+_client = None
+_host_limits = {}
+
+
+@dataclass
+class MediaCandidate:
+    url: str
+    kind: str
+    source: str
+    order: int
+    height: int = 0
+    size: Optional[int] = None
+    content_type: Optional[str] = None
+    reachable: Optional[bool] = None
+
+    @property
+    def group_key(self):
+        parts = urlsplit(self.url)
+        path = VARIANT.sub("", EXTENSION.sub("", parts.path))
+        return (self.kind == "image", parts.hostname, path)
+
+    @property
+    def score(self):
+        score = KIND_WEIGHT[self.kind] + SOURCE_WEIGHT[self.source]
+        if THUMBNAIL.search(self.url):
+            score -= 15
+        return score
+
+
+def _candidate(url, source, order, hint=None):
+    if TRACKING.search(url):
+        return None
+    m = EXTENSION.search(urlsplit(url).path)
+    ext = m.group(1).lower() if m else ""
+    if ext == "m3u8":
+        kind = "playlist"
+    elif ext in VIDEO_EXTS:
+        kind = "video"
+    elif ext in IMAGE_EXTS:
+        kind = "image"
+    elif hint in ("video", "image"):
+        kind = hint
+    elif ext:
+        return None
+    else:
+        kind = "video"
+    h = HEIGHT.search(url)
+    height = int(next(g for g in h.groups() if g)) if h else 0
+    return MediaCandidate(url, kind, source, order, height)
+
+
+class MediaLinkExtractor:
+    """Single-pass, incremental media candidate scanner.
+
+    Text can be fed in arbitrary chunks; the trailing token and any unclosed
+    tag of each chunk are held back until the next one, so matches split
+    across chunks are still found whole.
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+        self.seen = set()
+        self.carry = ""
+        self.count = 0
+
+    def _scan(self, text):
+        out = []
+        for m in CANDIDATES.finditer(text.replace("\\/", "/")):
+            if m.group("og"):
+                url, source, hint = m.group("og"), "og", m.group("og_kind").lower()
+            elif m.group("og_rev"):
+                url, source, hint = m.group("og_rev"), "og", m.group("og_rev_kind").lower()
+            elif m.group("source"):
+                url, source, hint = m.group("source"), "source", "video"
+            elif m.group("jsonld"):
+                url, source, hint = m.group("jsonld"), "jsonld", None
+            else:
+                url, source, hint = m.group(0), "link", None
+            if "&" in url:
+                url = html.unescape(url)
+            if self.base_url and not url.startswith(("http://", "https://")):
+                url = urljoin(self.base_url, url)
+            if not url.startswith(("http://", "https://")) or url in self.seen:
+                continue
+            self.seen.add(url)
+            c = _candidate(url, source, self.count, hint)
+            if c is not None:
+                self.count += 1
+                out.append(c)
+        return out
+
+    def feed(self, chunk):
+        text = self.carry + chunk
+        i = len(text)
+        while i > 0 and text[i - 1] not in DELIMITERS:
+            i -= 1
+        lt = text.rfind("<")
+        if lt >= 0 and text.find(">", lt) < 0:
+            i = min(i, lt)
+        self.carry = text[i:]
+        return self._scan(text[:i])
+
+    def close(self):
+        text, self.carry = self.carry, ""
+        return self._scan(text)
+
+
+def iter_candidates(chunks, base_url=None):
+    extractor = MediaLinkExtractor(base_url)
+    for chunk in chunks:
+        yield from extractor.feed(chunk)
+    yield from extractor.close()
+
+
+def group_variants(candidates):
+    """Group variants of the same asset; groups come best-ranked first."""
+    groups = {}
+    for c in candidates:
+        groups.setdefault(c.group_key, []).append(c)
+    return sorted(groups.values(), key=lambda g: (-max(c.score for c in g), min(c.order for c in g)))
+
+
+def pick_variant(variants, max_bytes=None):
+    """Highest-quality variant that is reachable and fits in `max_bytes`."""
+    usable = [c for c in variants if c.reachable is not False]
+    if not usable:
+        return None
+    fitting = [c for c in usable if c.size is not None and (max_bytes is None or c.size <= max_bytes)]
+    if fitting:
+        return max(fitting, key=lambda c: (KIND_WEIGHT[c.kind], c.height, c.size))
+    unknown = [c for c in usable if c.size is None]
+    if unknown:
+        return max(unknown, key=lambda c: (KIND_WEIGHT[c.kind], c.height, c.score, -c.order))
+    # everything is too large: the smallest one has the best chance
+    return min(usable, key=lambda c: c.size)
+
+
+def extract_media_links(raw_html: str, base_url=None):
+    """Best variant per asset, ranked, without any network access."""
+    groups = group_variants(iter_candidates([raw_html], base_url))
+    return [pick_variant(g).url for g in groups]
+
+
+def get_client():
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers=HEADERS,
+            follow_redirects=True,
+            timeout=SCRAPE_TIMEOUT,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
+    return _client
+
+
+async def close_client():
+    if _client is not None:
+        await _client.aclose()
+
+
+def host_limit(url):
+    host = urlsplit(url).hostname or ""
+    if host not in _host_limits:
+        _host_limits[host] = asyncio.Semaphore(max(1, SCRAPE_PER_HOST))
+    return _host_limits[host]
+
+
+async def head_candidate(c: MediaCandidate):
+    try:
+        async with host_limit(c.url):
+            r = await get_client().head(c.url, timeout=10)
+    except httpx.HTTPError:
+        c.reachable = False
+        return
+    if r.status_code in (405, 501):
+        # HEAD not supported, size stays unknown
+        return
+    c.content_type = r.headers.get("content-type", "").split(";")[0].strip().lower() or None
+    c.reachable = r.is_success and (c.content_type is None or c.content_type.startswith(MEDIA_TYPES))
+    length = r.headers.get("content-length")
+    c.size = int(length) if length and length.isdigit() else None
+
+
+async def scrape_media_links(url: str, max_bytes=None, limit=8):
+    """Fetch `url` and return up to `limit` ranked media URLs, one per asset.
+
+    Variants of the top groups are checked with concurrent HEAD requests so
+    the best one under `max_bytes` can be chosen.
+    """
+    extractor = MediaLinkExtractor(url)
+    candidates = []
+    async with host_limit(url):
+        async with get_client().stream("GET", url) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_text():
+                candidates += extractor.feed(chunk)
+                if r.num_bytes_downloaded >= SCRAPE_MAX_BYTES:
+                    break
+    candidates += extractor.close()
+
+    groups = group_variants(candidates)[:limit * 2]
+    await asyncio.gather(*(head_candidate(c) for g in groups for c in g[:HEAD_VARIANTS]))
+    links = []
+    for g in groups:
+        best = pick_variant(g[:HEAD_VARIANTS], max_bytes)
+        if best is not None:
+            links.append(best.url)
+    return links[:limit]
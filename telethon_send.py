@@ -1,71 +1,560 @@
 import os
 import sys
+import copy
 import json
+import time
+import mimetypes
+import random
 import asyncio
-import subprocess
 from telethon import TelegramClient
+from telethon.errors import (
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    FloodWaitError,
+    MediaEmptyError,
+)
+from telethon.network import MTProtoSender
 from telethon.sessions import StringSession
-from telethon.tl.types import DocumentAttributeVideo
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.help import GetConfigRequest
+from telethon.tl.functions.upload import SaveBigFilePartRequest
+from telethon.tl.types import (
+    DocumentAttributeFilename,
+    DocumentAttributeVideo,
+    InputDocument,
+    InputFileBig,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaUploadedDocument,
+    InputMediaUploadedPhoto,
+    InputPhoto,
+    MessageMediaDocument,
+    MessageMediaPhoto,
+)
+
+import media_probe
+import metrics
+from media_cache import FileIdCache
 
 API_ID = int(os.environ.get('API_ID', '0'))
 API_HASH = os.environ.get('API_HASH', '')
 STRING_SESSION = os.environ.get('STRING_SESSION', '')
+TELETHON_SOCKET = os.environ.get('TELETHON_SOCKET', '')
+TELETHON_CONCURRENCY = int(os.environ.get('TELETHON_CONCURRENCY', '2'))
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', '4'))
+UPLOAD_RETRIES = int(os.environ.get('UPLOAD_RETRIES', '5'))
+# Prometheus metrics for --serve mode on this port; 0 disables
+TELETHON_METRICS_PORT = int(os.environ.get('TELETHON_METRICS_PORT', '0'))
+# document/photo references of earlier uploads, shared with bot.py's file_id cache
+FILE_ID_CACHE = os.environ.get('FILE_ID_CACHE') or os.path.join(
+    os.environ.get('DOWNLOAD_DIR', './downloads'), '.cache', 'file_ids.sqlite3')
+
+# Telegram only accepts SaveBigFilePart for files above 10 MB; parts are at most 512 KB
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+PART_SIZE = 512 * 1024
+# Telegram albums hold at most 10 items
+ALBUM_SIZE = 10
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+# Telegram's limits for photos; larger or more elongated images are sent as documents
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+PHOTO_MAX_SIDES = 10000
+PHOTO_MAX_RATIO = 20
+# errors that mean a cached reference can no longer be sent
+STALE_REFERENCE = (FileReferenceExpiredError, FileReferenceInvalidError, MediaEmptyError)
+
+_file_ids = None
+_sender = None
+
+
+def log(*args):
+    # stdout carries job results in --serve mode, so diagnostics go to stderr
+    print(*args, file=sys.stderr, flush=True)
+
 
+def probe_meta(file_path: str):
+    with metrics.timed(metrics.PROBE_SECONDS, metrics.file_category(file_path)):
+        meta = media_probe.probe(file_path)
+    if not meta.get('width') or not meta.get('duration'):
+        log(f'probe incomplete for {file_path}: {meta or "no metadata"}; using defaults')
+    d = int(round(meta.get('duration') or 0))
+    return {
+        'width': int(meta.get('width') or 720),
+        'height': int(meta.get('height') or 1280),
+        'duration': d if d > 0 else 1,
+    }
 
-def ffprobe_meta(file_path: str):
+
+async def _connect_sender(client):
+    # extra connection to the session's own DC, reusing its auth key
+    dc = await client._get_dc(client.session.dc_id)
+    sender = MTProtoSender(client.session.auth_key, loggers=client._log)
+    await sender.connect(client._connection(
+        dc.ip_address, dc.port, dc.id,
+        loggers=client._log,
+        proxy=client._proxy,
+        local_addr=client._local_addr,
+    ))
+    # every new connection announces its layer and client before its first
+    # request, as Telethon does for the senders it borrows
+    init = copy.copy(client._init_request)
+    init.query = GetConfigRequest()
     try:
-        p = subprocess.run([
-            'ffprobe', '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height:format=duration',
-            '-of', 'json', file_path
-        ], capture_output=True, text=True, check=False)
-        if p.returncode != 0:
-            return {}
-        j = json.loads(p.stdout or '{}')
-        s = (j.get('streams') or [{}])[0]
-        d = int(round(float((j.get('format') or {}).get('duration', 0) or 0)))
-        return {
-            'width': int(s.get('width') or 720),
-            'height': int(s.get('height') or 1280),
-            'duration': d if d > 0 else 1,
-        }
+        await sender.send(InvokeWithLayerRequest(LAYER, init))
+    except BaseException:
+        await sender.disconnect()
+        raise
+    return sender
+
+
+async def _replace_sender(client, sender):
+    """A fresh connection in place of `sender`, or `sender` if none can be opened yet."""
+    try:
+        await sender.disconnect()
     except Exception:
-        return {'width': 720, 'height': 1280, 'duration': 1}
+        pass
+    try:
+        return await _connect_sender(client)
+    except Exception as e:
+        log(f'reconnect failed: {e!r}')
+        return sender
+
+
+def log_progress(file_path):
+    started = time.monotonic()
+    last = [-1]
+
+    def progress(done, total):
+        pct = int(done * 100 / total) if total else 100
+        if pct // 5 == last[0] and done < total:
+            return
+        last[0] = pct // 5
+        elapsed = max(time.monotonic() - started, 1e-6)
+        log(f'upload {os.path.basename(file_path)}: {pct}% '
+            f'({done / 1048576:.1f}/{total / 1048576:.1f} MB, {done / 1048576 / elapsed:.2f} MB/s)')
+    return progress
+
+
+async def upload_parallel(client, file_path, workers=UPLOAD_WORKERS, progress=None):
+    """Upload `file_path` as SaveBigFilePart chunks over `workers` connections.
+
+    Parts are pulled from a shared queue so a slow connection never holds up
+    the others; every part is retried up to UPLOAD_RETRIES times. Returns the
+    InputFileBig handle that send_file accepts in place of a path.
+    """
+    size = os.path.getsize(file_path)
+    total = (size + PART_SIZE - 1) // PART_SIZE
+    file_id = random.getrandbits(63)
+    parts = asyncio.Queue()
+    for i in range(total):
+        parts.put_nowait(i)
+
+    senders = list(await asyncio.gather(*(_connect_sender(client) for _ in range(max(1, min(workers, total))))))
+    fd = os.open(file_path, os.O_RDONLY)
+    uploaded = 0
+
+    async def worker(slot):
+        nonlocal uploaded
+        while True:
+            try:
+                part = parts.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            data = os.pread(fd, PART_SIZE, part * PART_SIZE)
+            request = SaveBigFilePartRequest(file_id, part, total, data)
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    if not await senders[slot].send(request):
+                        raise RuntimeError('part rejected by server')
+                    break
+                except FloodWaitError as e:
+                    log(f'part {part}/{total}: flood wait {e.seconds}s')
+                    metrics.BACKOFF_SECONDS.labels(metrics.file_category(file_path)).observe(e.seconds)
+                    await asyncio.sleep(e.seconds)
+                except Exception as e:
+                    if attempt >= UPLOAD_RETRIES:
+                        raise RuntimeError(f'part {part}/{total} failed after {attempt} attempts: {e!r}') from e
+                    log(f'part {part}/{total}: retry {attempt}/{UPLOAD_RETRIES - 1} after {e!r}')
+                    await asyncio.sleep(attempt)
+                    if isinstance(e, ConnectionError):
+                        # a sender that lost its connection stays unusable; retry on a new one
+                        senders[slot] = await _replace_sender(client, senders[slot])
+            uploaded += len(data)
+            if progress:
+                progress(uploaded, size)
+
+    try:
+        await asyncio.gather(*(worker(slot) for slot in range(len(senders))))
+    finally:
+        os.close(fd)
+        await asyncio.gather(*(s.disconnect() for s in senders), return_exceptions=True)
+
+    return InputFileBig(id=file_id, parts=total, name=os.path.basename(file_path))
+
+
+def video_attributes(file_path, duration=None):
+    meta = probe_meta(file_path)
+    duration = duration or meta.get('duration') or 1
+    width = meta.get('width') or 720
+    height = meta.get('height') or 1280
+    return [DocumentAttributeVideo(duration=duration, w=width, h=height, supports_streaming=True)]
+
+
+async def cached_reference(client, file_path):
+    """(cache, sender, sha256, stored reference or None) for `file_path`."""
+    global _file_ids, _sender
+    if _file_ids is None:
+        _file_ids = FileIdCache(FILE_ID_CACHE)
+    if _sender is None:
+        _sender = f'mtproto:{(await client.get_me()).id}'
+    sha256 = await asyncio.to_thread(_file_ids.digest, file_path)
+    ref = await asyncio.to_thread(_file_ids.get, sha256, _sender)
+    return _file_ids, _sender, sha256, json.loads(ref) if ref else None
+
+
+def reference_media(ref):
+    """InputMedia for a stored {type, id, access_hash, file_reference} reference."""
+    args = (ref['id'], ref['access_hash'], bytes.fromhex(ref['file_reference']))
+    if ref['type'] == 'photo':
+        return InputMediaPhoto(InputPhoto(*args))
+    return InputMediaDocument(InputDocument(*args))
+
+
+def message_reference(message):
+    media = getattr(message, 'media', None)
+    if isinstance(media, MessageMediaDocument) and media.document:
+        obj, kind = media.document, 'document'
+    elif isinstance(media, MessageMediaPhoto) and media.photo:
+        obj, kind = media.photo, 'photo'
+    else:
+        return None
+    return json.dumps({
+        'type': kind,
+        'id': obj.id,
+        'access_hash': obj.access_hash,
+        'file_reference': obj.file_reference.hex(),
+    })
+
+
+def remember(cache, sender, sha256, message):
+    ref = message_reference(message)
+    if ref:
+        cache.put(sha256, sender, ref)
+
+
+async def upload(client, file_path, workers=UPLOAD_WORKERS):
+    if workers > 1 and os.path.getsize(file_path) > BIG_FILE_THRESHOLD:
+        return await upload_parallel(client, file_path, workers, progress=log_progress(file_path))
+    return file_path
+
+
+def make_client():
+    return TelegramClient(StringSession(STRING_SESSION), API_ID, API_HASH)
+
+
+async def send_reference(client, chat_id, file_path, caption, category):
+    """Re-send a stored reference of `file_path`; (message or None, cache, sender, sha256)."""
+    cache, sender, sha256, ref = await cached_reference(client, file_path)
+    if ref:
+        started = time.monotonic()
+        try:
+            msg = await client.send_file(chat_id, file=reference_media(ref), caption=caption)
+            metrics.observe_upload(category, 'reference', 0, time.monotonic() - started)
+            return msg, cache, sender, sha256
+        except STALE_REFERENCE as e:
+            log(f'cached reference for {os.path.basename(file_path)} unusable ({e.__class__.__name__}), uploading')
+            await asyncio.to_thread(cache.forget, sha256, sender)
+    return None, cache, sender, sha256
+
+
+async def send_video(client, chat_id, file_path, caption, duration=None, thumb=None, workers=UPLOAD_WORKERS):
+    if thumb and not os.path.exists(thumb):
+        thumb = None
+
+    category = metrics.file_category(file_path)
+    msg, cache, sender, sha256 = await send_reference(client, chat_id, file_path, caption, category)
+    if msg:
+        return msg
+
+    attrs = video_attributes(file_path, duration)
+    started = time.monotonic()
+    msg = await client.send_file(
+        chat_id,
+        file=await upload(client, file_path, workers),
+        caption=caption,
+        force_document=False,
+        supports_streaming=True,
+        thumb=thumb,
+        mime_type='video/mp4',
+        attributes=attrs,
+    )
+    metrics.observe_upload(category, 'mtproto', os.path.getsize(file_path), time.monotonic() - started)
+    await asyncio.to_thread(remember, cache, sender, sha256, msg)
+    return msg
+
+
+async def send_document(client, chat_id, file_path, caption='', workers=UPLOAD_WORKERS):
+    """Send any file as a document, with the same reference reuse as send_video."""
+    category = metrics.file_category(file_path)
+    msg, cache, sender, sha256 = await send_reference(client, chat_id, file_path, caption, category)
+    if msg:
+        return msg
+
+    started = time.monotonic()
+    msg = await client.send_file(
+        chat_id,
+        file=await upload(client, file_path, workers),
+        caption=caption,
+        force_document=True,
+        attributes=[DocumentAttributeFilename(os.path.basename(file_path))],
+    )
+    metrics.observe_upload(category, 'mtproto', os.path.getsize(file_path), time.monotonic() - started)
+    await asyncio.to_thread(remember, cache, sender, sha256, msg)
+    return msg
+
+
+def load_manifest(path):
+    """Read a batch manifest: a JSON list of items, or {"items": [...]}.
+
+    Each item is either a file path or {"file", "caption", "thumb", "duration"}.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('items') or []
+    return [{'file': i} if isinstance(i, str) else i for i in data]
+
+
+def sends_as_photo(file_path):
+    """Whether the image at `file_path` is within what Telegram accepts as a photo."""
+    if os.path.splitext(file_path)[1].lower() not in IMAGE_EXTS:
+        return False
+    if os.path.getsize(file_path) > PHOTO_MAX_BYTES:
+        return False
+    meta = media_probe.probe(file_path)
+    w, h = meta.get('width'), meta.get('height')
+    return not (w and h and (w + h > PHOTO_MAX_SIDES or max(w, h) > PHOTO_MAX_RATIO * min(w, h)))
+
+
+def album_kind(file_path):
+    """Items of one kind may share an album: photos with videos, audio with
+    audio and other documents with documents; Telegram rejects the rest."""
+    if sends_as_photo(file_path):
+        return 'media'
+    mime_type = mimetypes.guess_type(file_path)[0] or ''
+    if mime_type.startswith('video/'):
+        return 'media'
+    if mime_type.startswith('audio/'):
+        return 'audio'
+    return 'document'
+
+
+async def upload_media(client, item, workers=UPLOAD_WORKERS, ref=None):
+    file_path = item['file']
+    if ref:
+        return reference_media(ref)
+    category = metrics.file_category(file_path)
+    started = time.monotonic()
+    if await asyncio.to_thread(sends_as_photo, file_path):
+        media = InputMediaUploadedPhoto(file=await client.upload_file(file_path))
+        metrics.observe_upload(category, 'mtproto', os.path.getsize(file_path), time.monotonic() - started)
+        return media
+
+    handle = await upload(client, file_path, workers)
+    if isinstance(handle, str):
+        handle = await client.upload_file(handle)
+    metrics.observe_upload(category, 'mtproto', os.path.getsize(file_path), time.monotonic() - started)
+    thumb = item.get('thumb')
+    thumb = await client.upload_file(thumb) if thumb and os.path.exists(thumb) else None
+    mime_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    attrs = []
+    # GIFs, audio and other documents keep their own type and get no video attributes
+    if mime_type.startswith('video/'):
+        duration = item.get('duration')
+        attrs = video_attributes(file_path, int(duration) if str(duration or '').isdigit() else None)
+    attrs.append(DocumentAttributeFilename(os.path.basename(file_path)))
+    # images past the photo limits stay files instead of being turned into photos
+    return InputMediaUploadedDocument(file=handle, mime_type=mime_type, attributes=attrs, thumb=thumb,
+                                      force_file=mime_type.startswith('image/') or None)
+
+
+async def send_batch(client, chat_id, items, workers=UPLOAD_WORKERS):
+    """Upload `items` concurrently, then post them as albums of up to ALBUM_SIZE.
+
+    Photos and videos share albums, audio and other documents get albums of
+    their own, each kind in manifest order. Returns the ids of the posted
+    messages in manifest order.
+    """
+    sem = asyncio.Semaphore(max(1, TELETHON_CONCURRENCY))
+    refs = await asyncio.gather(*(cached_reference(client, i['file']) for i in items))
+
+    async def prepare(item, ref):
+        async with sem:
+            return await upload_media(client, item, workers, ref)
+
+    async def send_group(group, captions):
+        if len(group) == 1:
+            sent = await client.send_file(chat_id, group[0], caption=captions[0], supports_streaming=True)
+        else:
+            sent = await client.send_file(chat_id, group, caption=captions, supports_streaming=True)
+        return sent if isinstance(sent, list) else [sent]
+
+    media = await asyncio.gather(*(prepare(i, r[3]) for i, r in zip(items, refs)))
+    kinds = {}
+    for i, item in enumerate(items):
+        kinds.setdefault(await asyncio.to_thread(album_kind, item['file']), []).append(i)
+    albums = [
+        indexes[start:start + ALBUM_SIZE]
+        for indexes in kinds.values()
+        for start in range(0, len(indexes), ALBUM_SIZE)
+    ]
+    message_ids = {}
+    for number, album in enumerate(albums, 1):
+        group = [media[i] for i in album]
+        captions = [items[i].get('caption') or '' for i in album]
+        try:
+            sent = await send_group(group, captions)
+        except STALE_REFERENCE:
+            # one expired reference fails the whole album: upload those items again
+            log(f'album {number}: cached references unusable, uploading')
+            for slot, i in enumerate(album):
+                cache, sender, sha256, ref = refs[i]
+                if ref:
+                    await asyncio.to_thread(cache.forget, sha256, sender)
+                    refs[i] = (cache, sender, sha256, None)
+                    group[slot] = await upload_media(client, items[i], workers)
+            sent = await send_group(group, captions)
+        for i, message in zip(album, sent):
+            cache, sender, sha256, ref = refs[i]
+            if not ref:
+                await asyncio.to_thread(remember, cache, sender, sha256, message)
+            message_ids[i] = message.id
+    return [message_ids[i] for i in sorted(message_ids)]
+
+
+async def run_job(client, job):
+    """Run one JSON job against a connected client and build its result line."""
+    result = {'id': job.get('id')}
+    try:
+        if job.get('files'):
+            items = [{'file': i} if isinstance(i, str) else i for i in job['files']]
+            ids = await send_batch(client, int(job['chat_id']), items, int(job.get('workers') or UPLOAD_WORKERS))
+            result.update(ok=True, message_ids=ids)
+            return result
+
+        duration = job.get('duration')
+        msg = await send_video(
+            client,
+            int(job['chat_id']),
+            job['file'],
+            job.get('caption') or '',
+            duration=int(duration) if str(duration or '').isdigit() else None,
+            thumb=job.get('thumb') or None,
+            workers=int(job.get('workers') or UPLOAD_WORKERS),
+        )
+        result.update(ok=True, message_id=getattr(msg, 'id', None))
+    except Exception as e:
+        log('job failed:', job.get('id'), repr(e))
+        result.update(ok=False, error=f'{e.__class__.__name__}: {e}')
+    return result
+
+
+async def serve_stream(client, reader, write):
+    """Read JSON-line jobs from `reader` and answer each with a JSON line.
+
+    Jobs run concurrently (bounded by TELETHON_CONCURRENCY) on the shared
+    client, so results may come back out of order; callers match them by id.
+    """
+    sem = asyncio.Semaphore(max(1, TELETHON_CONCURRENCY))
+    pending = set()
+
+    async def handle(job):
+        async with sem:
+            result = await run_job(client, job)
+        write(json.dumps(result) + '\n')
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            write(json.dumps({'id': None, 'ok': False, 'error': f'bad job: {e}'}) + '\n')
+            continue
+        task = asyncio.create_task(handle(job))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    if pending:
+        await asyncio.gather(*pending)
+
+
+async def serve(client):
+    if metrics.serve(TELETHON_METRICS_PORT):
+        log(f'metrics on :{TELETHON_METRICS_PORT}/metrics')
+    if TELETHON_SOCKET:
+        async def on_connect(reader, writer):
+            try:
+                await serve_stream(client, reader, lambda s: writer.write(s.encode()))
+                await writer.drain()
+            finally:
+                writer.close()
+
+        if os.path.exists(TELETHON_SOCKET):
+            os.unlink(TELETHON_SOCKET)
+        server = await asyncio.start_unix_server(on_connect, path=TELETHON_SOCKET)
+        log('serving on', TELETHON_SOCKET)
+        async with server:
+            await server.serve_forever()
+        return
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    def write(s):
+        sys.stdout.write(s)
+        sys.stdout.flush()
+
+    log('serving on stdin')
+    await serve_stream(client, reader, write)
 
 
 async def main():
-    if len(sys.argv) < 4:
+    serve_mode = '--serve' in sys.argv[1:]
+    batch_mode = sys.argv[1:2] == ['--batch']
+    if not serve_mode and len(sys.argv) < 4:
         print('usage: telethon_send.py <chat_id> <file_path> <caption> [duration] [thumb]')
+        print('       telethon_send.py --batch <chat_id> <manifest.json>')
+        print('       telethon_send.py --serve   (JSON-line jobs on stdin or $TELETHON_SOCKET)')
         return 2
 
-    chat_id = int(sys.argv[1])
-    file_path = sys.argv[2]
-    caption = sys.argv[3]
-    duration_arg = int(sys.argv[4]) if len(sys.argv) > 4 and sys.argv[4].isdigit() else None
-    thumb = sys.argv[5] if len(sys.argv) > 5 and sys.argv[5] and os.path.exists(sys.argv[5]) else None
-
     if not API_ID or not API_HASH or not STRING_SESSION:
         print('missing API_ID/API_HASH/STRING_SESSION')
         return 3
 
-    meta = ffprobe_meta(file_path)
-    duration = duration_arg or meta.get('duration') or 1
-    width = meta.get('width') or 720
-    height = meta.get('height') or 1280
+    async with make_client() as client:
+        if serve_mode:
+            await serve(client)
+            return 0
 
-    async with TelegramClient(StringSession(STRING_SESSION), API_ID, API_HASH) as client:
-        attrs = [DocumentAttributeVideo(duration=duration, w=width, h=height, supports_streaming=True)]
-        await client.send_file(
-            chat_id,
-            file=file_path,
-            caption=caption,
-            force_document=False,
-            supports_streaming=True,
-            thumb=thumb,
-            mime_type='video/mp4',
-            attributes=attrs,
-        )
+        if batch_mode:
+            ids = await send_batch(client, int(sys.argv[2]), load_manifest(sys.argv[3]))
+            print(json.dumps({'ok': True, 'message_ids': ids}))
+            return 0
+
+        chat_id = int(sys.argv[1])
+        file_path = sys.argv[2]
+        caption = sys.argv[3]
+        duration_arg = int(sys.argv[4]) if len(sys.argv) > 4 and sys.argv[4].isdigit() else None
+        thumb = sys.argv[5] if len(sys.argv) > 5 and sys.argv[5] else None
+        await send_video(client, chat_id, file_path, caption, duration=duration_arg, thumb=thumb)
     return 0
 
 
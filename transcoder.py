@@ -0,0 +1,323 @@
+"""ffmpeg transcodes and remuxes behind one bounded pool and an output cache.
+
+- At most TRANSCODE_WORKERS encodes run at once per process, each limited to
+  its share of the cores (`-threads`), so a burst of jobs queues up instead
+  of oversubscribing the CPU. Stream copies take a separate, I/O-bound slot.
+- Outputs are cached as `<cache_dir>/<sha256[:2]>/<sha256>.<profile>.mp4`,
+  keyed by the input's SHA-256 and the profile, and hardlinked to where the
+  caller wants them. The least recently used are evicted once the cache
+  passes TRANSCODE_CACHE_MAX_BYTES.
+- The `telegram` profile only remuxes inputs that ffprobe reports as H.264
+  (4:2:0) with AAC or no audio, since those play in Telegram as they are.
+
+bot.js keeps one `transcoder.py --serve` running and sends it JSON-line jobs,
+the same way it drives telethon_send.py:
+    {"id": "j1", "file": "/app/downloads/x.webm", "profile": "hd", "output": "/app/downloads/x.hd.mp4"}
+    {"id": "j1", "ok": true, "output": "...", "cached": false, "remuxed": false}
+Python callers use `get().run(path, profile, output)`.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+CORES = os.cpu_count() or 1
+# encodes running at once; each gets CORES // TRANSCODE_WORKERS encoder threads
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", str(max(1, CORES // 2))))
+# stream copies running at once, next to the encodes
+REMUX_WORKERS = int(os.environ.get("REMUX_WORKERS", "4"))
+TRANSCODE_CACHE_DIR = os.environ.get("TRANSCODE_CACHE_DIR") or os.path.join(
+    os.environ.get("DOWNLOAD_DIR", "./downloads"), ".cache", "transcoded")
+# 0 disables the cache
+TRANSCODE_CACHE_MAX_BYTES = int(os.environ.get("TRANSCODE_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+
+CHUNK_SIZE = 1024 * 1024
+
+_X264 = ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p"]
+PROFILES = {
+    # plays inline in every Telegram client
+    "telegram": ["-vf", "scale=960:-2,fps=30", *_X264, "-profile:v", "baseline", "-level", "3.1",
+                 "-crf", "30", "-c:a", "aac", "-b:a", "96k", "-ac", "1"],
+    "hd": ["-vf", "scale=1280:-2,fps=30", *_X264, "-crf", "23", "-c:a", "aac", "-b:a", "128k", "-ac", "2"],
+    "sd": ["-vf", "scale=854:-2,fps=24", *_X264, "-crf", "30", "-c:a", "aac", "-b:a", "96k", "-ac", "2"],
+    "lq": ["-vf", "scale=1920:-2,fps=30", *_X264, "-crf", "18", "-c:a", "aac", "-b:a", "160k", "-ac", "2"],
+    "trim30": ["-t", "30", "-c:v", "libx264", "-preset", "veryfast", "-crf", "28", "-c:a", "aac"],
+    "remux": ["-c", "copy"],
+}
+# profiles that only exist to get a Telegram-playable MP4: an input that
+# already is one is stream-copied instead
+REMUXABLE = {"telegram"}
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def log(*args):
+    # stdout carries job results in --serve mode, so diagnostics go to stderr
+    print(*args, file=sys.stderr, flush=True)
+
+
+def profile_args(profile):
+    """ffmpeg output options of `profile`; `small:<MB>` compresses towards MB."""
+    if profile.startswith("small:"):
+        try:
+            target_mb = float(profile.split(":", 1)[1])
+        except ValueError:
+            raise TranscodeError(f"bad profile {profile!r}")
+        # bitrate cap that fits one minute into target_mb
+        bits = max(600_000, int(target_mb * 1024 * 1024 * 8 / 60))
+        return ["-vf", "scale=720:-2,fps=24", *_X264, "-crf", "34",
+                "-maxrate", f"{bits // 1000}k", "-bufsize", f"{bits // 500}k",
+                "-c:a", "aac", "-b:a", "64k", "-ac", "1"]
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise TranscodeError(f"unknown profile {profile!r}")
+
+
+def streams(path):
+    """ffprobe's codec_type/codec_name/pix_fmt per stream; [] when it cannot tell."""
+    try:
+        p = subprocess.run([
+            "ffprobe", "-v", "error",
+            "-show_entries", "stream=codec_type,codec_name,pix_fmt",
+            "-of", "json", str(path),
+        ], capture_output=True, text=True, check=False)
+    except OSError:
+        return []
+    if p.returncode != 0:
+        return []
+    try:
+        return json.loads(p.stdout or "{}").get("streams") or []
+    except ValueError:
+        return []
+
+
+def is_telegram_ready(path):
+    """One H.264 4:2:0 video stream and only AAC audio, if any."""
+    found = streams(path)
+    video = [s for s in found if s.get("codec_type") == "video"]
+    audio = [s for s in found if s.get("codec_type") == "audio"]
+    return (
+        len(video) == 1
+        and video[0].get("codec_name") == "h264"
+        and video[0].get("pix_fmt") in ("yuv420p", "yuvj420p")
+        and all(a.get("codec_name") == "aac" for a in audio)
+    )
+
+
+def _place(src, dst):
+    """Hardlink (or copy) src to dst, replacing dst."""
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class Transcoder:
+    def __init__(self, cache_dir=TRANSCODE_CACHE_DIR, max_bytes=TRANSCODE_CACHE_MAX_BYTES,
+                 workers=TRANSCODE_WORKERS, remux_workers=REMUX_WORKERS):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.workers = max(1, workers)
+        self.threads = max(1, CORES // self.workers)
+        self._encode = threading.BoundedSemaphore(self.workers)
+        self._copy = threading.BoundedSemaphore(max(1, remux_workers))
+        self._lock = threading.Lock()
+        # cache path -> [lock held while it is produced, waiters]
+        self._inflight = {}
+        # (dev, inode, size, mtime) -> sha256
+        self._digests = {}
+
+    def digest(self, path):
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        sha256 = self._digests.get(key)
+        if sha256 is None:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+            sha256 = h.hexdigest()
+            if len(self._digests) >= 4096:
+                self._digests.clear()
+            self._digests[key] = sha256
+        return sha256
+
+    def cache_path(self, sha256, profile):
+        return self.cache_dir / sha256[:2] / f"{sha256}.{profile.replace(':', '-')}.mp4"
+
+    @contextmanager
+    def _producing(self, key):
+        # concurrent requests for the same output wait for the first one
+        with self._lock:
+            entry = self._inflight.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._inflight[key]
+
+    def _ffmpeg(self, src, args, out):
+        p = subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-i", str(src), *args, "-movflags", "+faststart", str(out)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False)
+        if p.returncode != 0 or not out.exists():
+            raise TranscodeError(p.stderr.strip()[-1200:] or f"ffmpeg exited with {p.returncode}")
+
+    def _produce(self, src, profile, out):
+        """Write `profile` of src to out; True when it was only remuxed."""
+        args = profile_args(profile)
+        if profile == "remux" or (profile in REMUXABLE and is_telegram_ready(src)):
+            try:
+                with self._copy:
+                    self._ffmpeg(src, PROFILES["remux"], out)
+                return True
+            except TranscodeError:
+                if profile == "remux":
+                    raise
+                log(f"remux of {src.name} failed, encoding")
+        with self._encode:
+            self._ffmpeg(src, [*args, "-threads", str(self.threads)], out)
+        return False
+
+    def run(self, src, profile="telegram", dst=None):
+        """Produce `profile` of src at dst; returns (dst, cached, remuxed).
+
+        dst defaults to `<src stem>.<profile>.mp4` next to src. It is the
+        caller's to delete; the cached copy is separate.
+        """
+        src = Path(src)
+        profile_args(profile)
+        dst = Path(dst) if dst else src.with_name(f"{src.stem}.{profile.replace(':', '-')}.mp4")
+        if self.max_bytes <= 0:
+            return dst, False, self._produce(src, profile, dst)
+
+        out = self.cache_path(self.digest(src), profile)
+        remuxed = False
+        with self._producing(out):
+            cached = out.exists()
+            if cached:
+                # mtime is the last use for eviction
+                os.utime(out)
+            else:
+                out.parent.mkdir(parents=True, exist_ok=True)
+                tmp = out.with_name(f"{out.stem}.{os.getpid()}.{threading.get_ident()}.tmp.mp4")
+                try:
+                    remuxed = self._produce(src, profile, tmp)
+                    os.replace(tmp, out)
+                finally:
+                    tmp.unlink(missing_ok=True)
+            _place(out, dst)
+        if not cached:
+            self.evict()
+        return dst, cached, remuxed
+
+    def evict(self):
+        """Drop least recently used outputs until the cache fits max_bytes."""
+        with self._lock:
+            busy = set(self._inflight)
+        files = []
+        for p in self.cache_dir.glob("*/*.mp4"):
+            if p.name.endswith(".tmp.mp4") or p in busy:
+                continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        total = sum(size for _, size, _ in files)
+        for _, size, p in sorted(files):
+            if total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get():
+    """The process-wide Transcoder, configured from the environment."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Transcoder()
+    return _default
+
+
+async def run_job(job):
+    result = {"id": job.get("id")}
+    try:
+        out, cached, remuxed = await asyncio.to_thread(
+            get().run, job["file"], job.get("profile") or "telegram", job.get("output") or None)
+        result.update(ok=True, output=str(out), cached=cached, remuxed=remuxed)
+    except Exception as e:
+        log("job failed:", job.get("id"), repr(e)[-1200:])
+        result.update(ok=False, error=f"{e.__class__.__name__}: {e}")
+    return result
+
+
+async def serve():
+    """JSON-line jobs on stdin, one JSON line per result on stdout (in any order)."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    pending = set()
+
+    async def handle(job):
+        result = await run_job(job)
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+    log(f"serving on stdin ({get().workers} encode workers x {get().threads} threads)")
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            sys.stdout.write(json.dumps({"id": None, "ok": False, "error": f"bad job: {e}"}) + "\n")
+            sys.stdout.flush()
+            continue
+        task = asyncio.create_task(handle(job))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    if pending:
+        await asyncio.gather(*pending)
+
+
+def main():
+    if sys.argv[1:] == ["--serve"]:
+        asyncio.run(serve())
+        return 0
+    if len(sys.argv) < 3:
+        print("usage: transcoder.py <file> <profile> [output]")
+        print("       transcoder.py --serve   (JSON-line jobs on stdin)")
+        print("profiles:", ", ".join([*PROFILES, "small:<MB>"]))
+        return 2
+    out, cached, remuxed = get().run(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    print(json.dumps({"output": str(out), "cached": cached, "remuxed": remuxed}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())